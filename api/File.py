@@ -12,6 +12,9 @@
 #   2019-12-28  Add publish()
 #   2020-08-30  Fix owner check in update()
 #   2020-09-23  Add decode_bytemultiple()
+#   2026-10-19  Checksum columns 'sha256' and 'blake2b' are read-only.
+#   2026-10-19  download() refuses files that failed integrity verification.
+#   2026-10-19  Add query() for streamed exports.
 #
 #
 #   TODO: remove _* -columns from result sets.
@@ -61,7 +64,10 @@ class File(DataObject):
         '*':            ['anyone']
     })
     # Columns that must not be updated (by client)
-    _readOnly = ['id', 'name', 'size', 'sha1', 'created']
+    _readOnly = [
+        'id', 'name', 'size', 'sha1', 'sha256', 'blake2b',
+        'integrity', 'verified', 'created'
+    ]
 
 
 
@@ -99,16 +105,13 @@ class File(DataObject):
 
 
 
-    def search(
+    def __search_sql(
         self,
         file_type: str = None,
         downloadable_to: str = None,
         owner: str = None
-    ):
-        """Argument 'file_type' as per column file.type, 'role' as column file.downloadable_to, 'owner' as per column file.owner."""
-        app.logger.debug(
-            f"search(type='{file_type}', downloadable_to='{downloadable_to}', owner='{owner}')"
-        )
+    ) -> list:
+        """Sets self.sql for search() and query(). Returns bind variables."""
         self.sql = f"SELECT * FROM {self.table_name}"
         where = []  # SQL WHERE conditions and bind symbols ('?')
         bvars = []  # list of bind variables to match the above
@@ -130,6 +133,22 @@ class File(DataObject):
         if where:
             self.sql += " WHERE " + " AND ".join(where)
         app.logger.debug("SQL: " + self.sql)
+        return bvars
+
+
+
+
+    def search(
+        self,
+        file_type: str = None,
+        downloadable_to: str = None,
+        owner: str = None
+    ):
+        """Argument 'file_type' as per column file.type, 'role' as column file.downloadable_to, 'owner' as per column file.owner."""
+        app.logger.debug(
+            f"search(type='{file_type}', downloadable_to='{downloadable_to}', owner='{owner}')"
+        )
+        bvars = self.__search_sql(file_type, downloadable_to, owner)
         try:
             self.cursor.execute(self.sql, bvars)
         except sqlite3.Error as e:
@@ -160,6 +179,25 @@ class File(DataObject):
 
 
 
+    def query(
+        self,
+        file_type: str = None,
+        downloadable_to: str = None
+    ) -> sqlite3.Cursor:
+        """Executed query for streamed exports (api.stream_result_as_csv(), api.stream_result_as_ndjson()). Same arguments as search(), rows are ordered by 'id'. Cursor is left open for the caller."""
+        bvars = self.__search_sql(file_type, downloadable_to)
+        self.sql += " ORDER BY id"
+        try:
+            return self.cursor.execute(self.sql, bvars)
+        except sqlite3.Error as e:
+            app.logger.exception(
+                f"'{self.table_name}' -table query failed! ({self.sql})"
+            )
+            raise InternalError("Unable to query files", str(e)) from None
+
+
+
+
     def prepublish(self, filepath, owner) -> tuple:
         """Arguments 'filepath' must be an absolute path to the VM image and 'owner' must be an /active/ UID in the 'teacher' table.
         Extract information from the file and prepopulate 'file' table row. On success, returns the 'file' table ID value.
@@ -472,6 +510,7 @@ class File(DataObject):
         403: User is not allowed to delete the file
         404: Specified file does not exist
         404: Database record not found
+        503: File does not match its checksums (file.integrity 'mismatch')
         500: An exception ocurred (and was logged)"""
         #
         # Check that the file exists and get filename
@@ -575,7 +614,7 @@ class File(DataObject):
         #
         # Retrieve information on to whom is it downloadable to
         #
-        self.sql = "SELECT downloadable_to FROM file WHERE name = ?"
+        self.sql = "SELECT downloadable_to, integrity FROM file WHERE name = ?"
         try:
             self.cursor.execute(self.sql, [filename])
             # list of tuples
@@ -590,6 +629,15 @@ class File(DataObject):
             app.logger.exception("Error executing a query!")
             return "Internal Server Error", 500
         #
+        # Corrupted image must not be served, whatever the role
+        # (integrity is verified by 'cron.job/scrub-download-folder.py')
+        #
+        if result[1] == 'mismatch':
+            app.logger.error(
+                f"File '{filepath}' does not match its checksums! (download refused)"
+            )
+            return "File failed integrity verification", 503
+        #
         # Send file
         #
         #   'X-Accel-Redirect' (header directive) is Nginx feature that is
@@ -9,12 +9,16 @@
 #
 #   2020-09-07  Initial version. Basic file-per-chunk implementation.
 #   2020-09-12  Add .progress_events(), SSE implementation.
+#   2026-10-19  SSE reads assembly state from the 'job' table.
+#   2026-10-19  Add .assembly_status(), assembly progress into SSE.
+#   2026-10-19  .create_job() wakes up the background worker.
 #
 #
 import os
 import time
 import json
 import errno
+import signal
 import logging
 import flask
 import sqlite3
@@ -163,6 +167,28 @@ class Flow():
                 },
                 jobfile
             )
+        Flow.wake_worker()
+
+
+    @staticmethod
+    def wake_worker():
+        """Send SIGUSR1 to 'cron.job/background-worker.py' (if it is running), so that it assembles the upload now. Otherwise the upload is assembled on the next scheduled run, which is why errors are only logged."""
+        pidfile = app.config.get('BACKGROUND_WORKER_PIDFILE')
+        if not pidfile:
+            return
+        try:
+            with open(pidfile, "r") as file:
+                pid = int(file.read().strip())
+            # Stale PID file, the process ID may have been reused
+            with open(f"/proc/{pid}/cmdline", "rb") as file:
+                if b'background-worker' not in file.read():
+                    return
+            os.kill(pid, signal.SIGUSR1)
+        except FileNotFoundError:
+            # Background worker is not running
+            pass
+        except Exception as e:
+            app.logger.warning(f"Unable to wake up background worker: {str(e)}")
 
 
     @staticmethod
@@ -207,6 +233,65 @@ class Flow():
         return downdir
 
 
+    @staticmethod
+    def assembly_status(flowid: str) -> dict:
+        """Returns assembly job status as a dictionary, or None if the upload has not been queued for assembly. Keys: 'state' (['queued', 'running', 'done', 'failed']), 'attempts', 'error', 'bytes', 'total', 'percent', 'rate' (bytes/s) and 'eta' (seconds). Progress values are None until the assembler has published them."""
+        sql = """
+            SELECT  state, attempts, error, progress, total, rate
+            FROM    job
+            WHERE   task = 'assemble'
+                    AND
+                    target = ?
+        """
+        # Called also from SSE generator, outside of request context
+        with sqlite3.connect(app.config.get('SQLITE3_DATABASE_FILE')) as db:
+            retries = 3
+            while True:
+                try:
+                    row = db.execute(sql, [flowid]).fetchone()
+                except sqlite3.OperationalError:
+                    # Database is locked
+                    retries -= 1
+                    if not retries:
+                        raise
+                    time.sleep(0.2)
+                else:
+                    break
+        if not row:
+            return None
+        state, attempts, error, done, total, rate = row
+        status = {
+            'state':    state,
+            'attempts': attempts,
+            'error':    error,
+            'bytes':    done,
+            'total':    total,
+            'percent':  None,
+            'rate':     rate,
+            'eta':      None
+        }
+        if state == 'running' and done is not None and total:
+            status['percent'] = round(100 * done / total, 1)
+            if rate:
+                status['eta'] = round((total - done) / rate)
+        return status
+
+
+    @staticmethod
+    def upload_status(flowid: str) -> tuple:
+        """JSON API response for the assembly status of an upload."""
+        try:
+            status = Flow.assembly_status(flowid)
+        except Exception as e:
+            app.logger.exception(f"Assembly status query failed for '{flowid}'")
+            raise InternalError(
+                "Unable to retrieve assembly status", str(e)
+            ) from None
+        if not status:
+            raise NotFound(f"Upload '{flowid}' has not been queued for assembly")
+        return (200, {"data": status})
+
+
     #
     # SSE - Server-Sent Events
     #
@@ -252,8 +337,8 @@ class Flow():
             return f"event: {evtType}\ndata: {json.dumps(payload)}\n\n"
         def evterror(msg: str) -> str:
             return event("ERROR", {'message': msg})
-        def evtstatus(msg: str) -> str:
-            return event("STATUS", {'message': msg})
+        def evtstatus(msg: str, progress: dict = {}) -> str:
+            return event("STATUS", {'message': msg, **progress})
         def evtdone(id: int) -> str:
             return event("DONE", {'id': id})
         import glob
@@ -261,16 +346,20 @@ class Flow():
         downdir     = Flow.download_dir()
         imgfilepath = os.path.join(downdir, filename)
         jobfilepath = os.path.join(updir, f"{flowid}.job")
-        errfilepath = os.path.join(updir, f"{flowid}.error")
-        chunkfilenamepattern = os.path.join(updir, f"{flowid}.*")
-        taggedjobfilenamepattern = os.path.join(updir, f"{flowid}.job.[0-9]*")
+        chunkfilenamepattern = os.path.join(updir, f"{flowid}.[0-9]*")
         while True:
             if len(glob.glob(chunkfilenamepattern)) > 0:
                 # We have chunks!
-                if exists(jobfilepath):
-                    # .job file exists
-                    if older(jobfilepath, 5):
-                        # ...but is older than 5 minutes
+                status = Flow.assembly_status(flowid)
+                state = status['state'] if status else None
+                if state is None:
+                    # Background task has not picked up the upload yet
+                    if not exists(jobfilepath):
+                        yield evterror(
+                            "Incomplete download! .job file has not been created!"
+                        )
+                    elif older(jobfilepath, 5):
+                        # ...but .job is older than 5 minutes
                         yield evterror(
                             "Background task is not running"
                         )
@@ -279,25 +368,28 @@ class Flow():
                         yield evtstatus(
                             "Waiting for background task to start"
                         )
-                else:
-                    # No '.job' file
-                    if len(glob.glob(taggedjobfilenamepattern)) > 0:
-                        # Tagged job file exists
-                        if exists(errfilepath):
-                            # Error file found!
-                            yield evterror(
-                                "File prosessing has failed! Contact administration!"
-                            )
-                        else:
-                            # if older(f"{flowid}.job.[0-9]*"), 5):
-                            #    return evterror("VM image assembly overdue! Contact administration!")
-                            # else:
-                            #    yield evtstatus("VM image is being assembled...")
-                            yield evtstatus("VM image is being assembled...")
+                elif state == 'queued':
+                    yield evtstatus(
+                        "Waiting for background task to start"
+                    )
+                elif state == 'running':
+                    if status['percent'] is None:
+                        yield evtstatus("VM image is being assembled...")
                     else:
-                        yield evterror(
-                            "Incomplete download! .job file has not been created!"
+                        yield evtstatus(
+                            f"VM image is being assembled... {status['percent']:.0f}%",
+                            {
+                                k: status[k]
+                                for k in ('bytes', 'total', 'percent', 'rate', 'eta')
+                            }
                         )
+                elif state == 'failed':
+                    yield evterror(
+                        "File prosessing has failed! Contact administration!"
+                    )
+                else:
+                    # 'done', chunks are being removed
+                    yield evtstatus("VM image is being assembled...")
             else:
                 # No chunks!
                 if exists(imgfilepath):
@@ -0,0 +1,115 @@
+#
+#   HyperLogLog - Cardinality sketch for unique downloader estimates
+#
+#   HyperLogLog.py
+#   2026-10-19  Initial version.
+#
+#
+#   Estimates the number of distinct keys that have been added, in constant
+#   space (M one-byte registers), without storing the keys. A key is a
+#   64-bit hash (AccessLog.py client key): the first P bits select a
+#   register, and the register keeps the highest rank (position of the
+#   first 1-bit) seen in the remaining bits. Standard error is 1.04 / sqrt(M),
+#   about 1.6 %. Cardinalities below 3M are estimated with linear counting
+#   (the raw estimate is biased there), which is practically exact for a
+#   course-sized group of downloaders.
+#
+#   Sketches of the same keys (same hash key) merge by taking the maximum of
+#   each register, so daily sketches merge into months and months into any
+#   range, with the same error. Registers are merged as one big integer
+#   (byte-wise maximum with SWAR arithmetic), which is some 25 times faster
+#   than comparing the bytes in Python.
+#
+#   Serialized form (dumps(), loads()) is the precision P (one byte),
+#   followed by the zlib compressed registers. Sketches of a few downloaders
+#   compress to a few dozen bytes.
+#
+#   Copy of cron.job/HyperLogLog.py, for merging and estimating the stored
+#   sketches (sql/download_statistics.sql).
+#
+#   USAGE
+#       sketch = HyperLogLog()
+#       sketch.add(client)                  # 8 bytes, uniformly distributed
+#       sketch.merge(HyperLogLog.loads(blob))
+#       print(sketch.estimate())
+#
+import math
+import zlib
+
+
+class HyperLogLog():
+
+    P       = 12
+    M       = 1 << P
+    ALPHA   = 0.7213 / (1 + 1.079 / M)
+    # High bit of each register, all bits of all registers (merge())
+    HIGH    = int.from_bytes(b'\x80' * M, 'big')
+    ALL     = int.from_bytes(b'\xff' * M, 'big')
+
+
+    def __init__(self, registers: bytes = None):
+        self.registers = bytearray(registers or HyperLogLog.M)
+
+
+    def __repr__(self):
+        return f"HyperLogLog(~{self.estimate()})"
+
+
+    def add(self, key: bytes):
+        """Add a 64-bit hash ('key', 8 bytes)."""
+        x = int.from_bytes(key[:8], 'big')
+        i = x >> (64 - HyperLogLog.P)
+        rank = 64 - HyperLogLog.P - (x & ((1 << (64 - HyperLogLog.P)) - 1)).bit_length() + 1
+        if rank > self.registers[i]:
+            self.registers[i] = rank
+
+
+    def merge(self, other):
+        """Merge sketch 'other' into this sketch. Returns self."""
+        x = int.from_bytes(self.registers, 'big')
+        y = int.from_bytes(other.registers, 'big')
+        # Lowest bit of each register is 1 where x >= y (registers < 128)
+        ge = (((x | HyperLogLog.HIGH) - y) & HyperLogLog.HIGH) >> 7
+        mask = (ge << 8) - ge
+        self.registers = bytearray(
+            ((x & mask) | (y & ~mask & HyperLogLog.ALL)).to_bytes(
+                HyperLogLog.M, 'big'
+            )
+        )
+        return self
+
+
+    def estimate(self) -> int:
+        """Estimated number of distinct keys."""
+        registers = bytes(self.registers)
+        zeros = registers.count(0)
+        if zeros == HyperLogLog.M:
+            return 0
+        if zeros:
+            # Linear counting, the raw estimate is biased below ~3M
+            estimate = HyperLogLog.M * math.log(HyperLogLog.M / zeros)
+            if estimate <= 3 * HyperLogLog.M:
+                return int(round(estimate))
+        total = sum(
+            registers.count(rank) * 2.0 ** -rank
+            for rank in range(65 - HyperLogLog.P)
+        )
+        return int(round(HyperLogLog.ALPHA * HyperLogLog.M ** 2 / total))
+
+
+    def dumps(self) -> bytes:
+        return bytes((HyperLogLog.P,)) + zlib.compress(bytes(self.registers))
+
+
+    @staticmethod
+    def loads(blob: bytes):
+        """Returns HyperLogLog. Raises ValueError if 'blob' is not a sketch of this precision."""
+        if not blob or blob[0] != HyperLogLog.P:
+            raise ValueError(f"Not a HyperLogLog sketch of precision {HyperLogLog.P}!")
+        registers = zlib.decompress(blob[1:])
+        if len(registers) != HyperLogLog.M:
+            raise ValueError("Truncated HyperLogLog sketch!")
+        return HyperLogLog(registers)
+
+
+# EOF
@@ -0,0 +1,139 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Turku University (2020) Department of Future Technologies
+# Course Virtualization / Website
+# Background job run history and throughput metrics
+#
+# JobMetrics.py
+#
+#   2026-10-19  Initial version.
+#
+#
+#   Reads tables 'job_run' and 'job_metric' (sql/background_jobs.sql), which
+#   are written by the background scripts (cron.job/JobQueue.py:JobRun).
+#
+#   SQLite has no percentile functions. Durations of the selected period are
+#   fetched ordered by task and duration, and the percentiles are picked in
+#   Python (nearest-rank method). Amount of rows is not an issue - there are
+#   a few hundred images, not millions.
+#
+import time
+import sqlite3
+
+from flask              import g
+from application        import app
+from .Exception         import *
+
+# Pylint doesn't understand app.logger ...so we disable all these warnings
+# pylint: disable=maybe-no-member
+
+class JobMetrics():
+
+    PERCENTILES = (50, 90, 95, 99)
+
+
+    def __init__(self):
+        self.cursor = g.db.cursor()
+
+
+    @staticmethod
+    def percentile(values: list, p: int):
+        """Nearest-rank percentile 'p' of sorted list 'values'."""
+        if not values:
+            return None
+        rank = max(1, -(-p * len(values) // 100))   # ceil()
+        return values[rank - 1]
+
+
+    @staticmethod
+    def mbps(nbytes: int, seconds: float):
+        """Throughput in megabytes per second, or None."""
+        if not nbytes or not seconds:
+            return None
+        return round(nbytes / seconds / (1024 * 1024), 2)
+
+
+    def summary(self, days: int = 7, runs: int = 20) -> tuple:
+        """Per task statistics (count, outcomes, duration percentiles, bytes and throughput) for the last 'days' days, and the latest 'runs' script runs."""
+        since = int(time.time()) - days * 24 * 3600
+        sql = """
+            SELECT      task,
+                        duration,
+                        bytes_read,
+                        bytes_written,
+                        outcome
+            FROM        job_metric
+            WHERE       started >= ?
+            ORDER BY    task, duration
+        """
+        try:
+            tasks = {}
+            for task, duration, nread, nwritten, outcome in \
+                self.cursor.execute(sql, [since]).fetchall():
+                t = tasks.setdefault(
+                    task,
+                    {
+                        'durations':        [],
+                        'done':             0,
+                        'retry':            0,
+                        'failed':           0,
+                        'bytes_read':       0,
+                        'bytes_written':    0,
+                        'busy':             0.0
+                    }
+                )
+                t['durations'].append(duration)
+                t[outcome] += 1
+                t['bytes_read'] += nread
+                t['bytes_written'] += nwritten
+                # Throughput is calculated over jobs that moved bytes
+                if nread or nwritten:
+                    t['busy'] += duration
+        except sqlite3.Error as e:
+            app.logger.exception(f"SQL query failed! ({sql})")
+            raise InternalError("Unable to retrieve job metrics", str(e)) from None
+
+        data = {}
+        for task, t in tasks.items():
+            durations = t.pop('durations')
+            busy = t.pop('busy')
+            data[task] = {
+                'jobs':         len(durations),
+                **t,
+                'duration': {
+                    **{
+                        f"p{p}": round(JobMetrics.percentile(durations, p), 3)
+                        for p in JobMetrics.PERCENTILES
+                    },
+                    'max':  round(durations[-1], 3),
+                    'mean': round(sum(durations) / len(durations), 3)
+                },
+                'read_mbps':    JobMetrics.mbps(t['bytes_read'], busy),
+                'write_mbps':   JobMetrics.mbps(t['bytes_written'], busy)
+            }
+
+        sql = """
+            SELECT      id, script, owner, started, duration, jobs, done,
+                        failed, bytes_read, bytes_written, outcome, error
+            FROM        job_run
+            ORDER BY    started DESC
+            LIMIT       ?
+        """
+        try:
+            self.cursor.execute(sql, [runs])
+            cols = [c[0] for c in self.cursor.description]
+            latest = [dict(zip(cols, row)) for row in self.cursor.fetchall()]
+        except sqlite3.Error as e:
+            app.logger.exception(f"SQL query failed! ({sql})")
+            raise InternalError("Unable to retrieve job runs", str(e)) from None
+        for run in latest:
+            run['mbps'] = JobMetrics.mbps(
+                run['bytes_read'] + run['bytes_written'],
+                run['duration']
+            )
+
+        return (200, {"data": {"days": days, "tasks": data, "runs": latest}})
+
+
+# EOF
@@ -0,0 +1,214 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Turku University (2020) Department of Future Technologies
+# Course Virtualization / Website
+# Download statistics
+#
+# Statistics.py
+#
+#   2026-10-19  Initial version.
+#   2026-10-19  Add query() for streamed exports.
+#   2026-10-19  Unique downloader estimates (HyperLogLog sketches).
+#   2026-10-19  Statistics limited by file.downloadable_to (role ACL).
+#
+#
+#   Reads the rollup tables 'download_daily' and 'download_monthly'
+#   (sql/download_statistics.sql), which are maintained by the access log
+#   ingester (cron.job/ingest-access-log.py). Raw 'download' events are
+#   never scanned. Periods are UTC days ('YYYY-MM-DD') or months
+#   ('YYYY-MM').
+#
+#   Unique downloaders are estimated from the HyperLogLog sketches of each
+#   file instance and period ('downloader_daily', 'downloader_monthly').
+#   Sketches are merged for the totals of each file, each period and the
+#   whole range, so that a downloader is counted once in each. Merged
+#   sketches are of fixed size (HyperLogLog.py), however many downloaders
+#   there are.
+#
+#   Statistics of a file are visible to the roles that can download it
+#   (file.downloadable_to, File._role2acl). Without a role, all file
+#   instances are included, also the deleted ones (teachers).
+#
+import re
+import sqlite3
+
+from flask              import g
+from application        import app
+from .Exception         import *
+from .File              import File
+from .HyperLogLog       import HyperLogLog
+
+# Pylint doesn't understand app.logger ...so we disable all these warnings
+# pylint: disable=maybe-no-member
+
+class Statistics():
+
+    # {period: (table, period column, period format, sketch table)}
+    PERIODS = {
+        'daily':    ('download_daily',      'day',      r'\d{4}-\d\d-\d\d',
+                     'downloader_daily'),
+        'monthly':  ('download_monthly',    'month',    r'\d{4}-\d\d',
+                     'downloader_monthly')
+    }
+    COUNTERS = ('downloads', 'complete', 'partial', 'bytes')
+
+
+    def __init__(self):
+        self.cursor = g.db.cursor()
+
+
+    def __select(
+        self,
+        period: str,
+        since: str,
+        until: str,
+        file_id: int,
+        downloadable_to: str,
+        sketch: bool = False
+    ) -> tuple:
+        """Validate arguments and build the rollup query, with the unique downloader estimate (and the sketch, if 'sketch') of each row. If 'downloadable_to' (sso.role) is given, only the files it can download are included. Returns (sql, bind variables, period column)."""
+        if period not in Statistics.PERIODS:
+            raise InvalidArgument(
+                f"Invalid period '{period}'! Must be one of: " +
+                ", ".join(Statistics.PERIODS.keys())
+            )
+        table, column, pattern, sketches = Statistics.PERIODS[period]
+        for value in (since, until):
+            if value is not None and not re.fullmatch(pattern, value):
+                raise InvalidArgument(
+                    f"Invalid {column} '{value}'! ({period} statistics)"
+                )
+
+        where = []
+        args = []
+        if since is not None:
+            where.append(f"r.{column} >= ?")
+            args.append(since)
+        if until is not None:
+            where.append(f"r.{column} <= ?")
+            args.append(until)
+        if file_id is not None:
+            where.append("r.file_id = ?")
+            args.append(file_id)
+        acl = ""
+        if downloadable_to is not None:
+            # Deleted files have no 'file' row and are left out
+            roles = File._role2acl[downloadable_to]
+            acl = f"""
+                        INNER JOIN file f
+                        ON (r.file_id = f.id AND f.downloadable_to IN ({','.join(['?'] * len(roles))}))"""
+            args = roles + args
+        sql = f"""
+            SELECT      r.{column},
+                        r.file_id,
+                        d.filename,
+                        d.size,
+                        {", ".join(f"r.{c}" for c in Statistics.COUNTERS)},
+                        s.downloaders
+                        {", s.sketch" if sketch else ""}
+            FROM        {table} r
+                        INNER JOIN downloadable d
+                        ON (r.file_id = d.file_id){acl}
+                        LEFT OUTER JOIN {sketches} s
+                        ON (r.file_id = s.file_id AND r.{column} = s.{column})
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY    r.{column}, r.file_id
+        """
+        return (sql, args, column)
+
+
+    def downloads(
+        self,
+        period: str = 'monthly',
+        since: str = None,
+        until: str = None,
+        file_id: int = None,
+        downloadable_to: str = None
+    ) -> tuple:
+        """Download counts per 'period' ('daily' or 'monthly') between 'since' and 'until' (inclusive, period format), optionally for one file instance. Argument 'downloadable_to' (sso.role) limits the statistics to the files that the role can download. Returns the totals of each file instance and the totals of each period, with estimates of unique downloaders (None without sketches)."""
+        sql, args, column = self.__select(
+            period, since, until, file_id, downloadable_to, True
+        )
+        try:
+            rows = self.cursor.execute(sql, args).fetchall()
+        except sqlite3.Error as e:
+            app.logger.exception(f"SQL query failed! ({sql})")
+            raise InternalError(
+                "Unable to retrieve download statistics", str(e)
+            ) from None
+
+        files = {}
+        periods = {}
+        # Merged sketches {file_id: HyperLogLog}, {period: HyperLogLog}
+        file_sketches = {}
+        period_sketches = {}
+        total = None
+        for key, fid, filename, size, *counters, _, blob in rows:
+            f = files.setdefault(
+                fid,
+                {
+                    'file_id':  fid,
+                    'filename': filename,
+                    'size':     size,
+                    **dict.fromkeys(Statistics.COUNTERS, 0)
+                }
+            )
+            p = periods.setdefault(
+                key,
+                {column: key, **dict.fromkeys(Statistics.COUNTERS, 0)}
+            )
+            for name, value in zip(Statistics.COUNTERS, counters):
+                f[name] += value
+                p[name] += value
+            if blob is None:
+                continue
+            sketch = HyperLogLog.loads(blob)
+            for sketches, k in ((file_sketches, fid), (period_sketches, key)):
+                if k in sketches:
+                    sketches[k].merge(sketch)
+                else:
+                    sketches[k] = HyperLogLog(sketch.registers)
+            total = sketch if total is None else total.merge(sketch)
+
+        for sketches, totals in ((file_sketches, files), (period_sketches, periods)):
+            for k, t in totals.items():
+                t['downloaders'] = sketches[k].estimate() if k in sketches else None
+
+        return (
+            200,
+            {
+                "data": {
+                    "period":   period,
+                    "since":    since,
+                    "until":    until,
+                    "downloaders": None if total is None else total.estimate(),
+                    "files":    list(files.values()),
+                    "series":   list(periods.values())
+                }
+            }
+        )
+
+
+    def query(
+        self,
+        period: str = 'monthly',
+        since: str = None,
+        until: str = None,
+        file_id: int = None,
+        downloadable_to: str = None
+    ) -> sqlite3.Cursor:
+        """Executed query for streamed exports (api.stream_result_as_csv(), api.stream_result_as_ndjson()). Same arguments as downloads(), one row per period and file instance, with the unique downloader estimate of the row. Cursor is left open for the caller."""
+        sql, args, _ = self.__select(
+            period, since, until, file_id, downloadable_to
+        )
+        try:
+            return self.cursor.execute(sql, args)
+        except sqlite3.Error as e:
+            app.logger.exception(f"SQL query failed! ({sql})")
+            raise InternalError(
+                "Unable to retrieve download statistics", str(e)
+            ) from None
+
+
+# EOF
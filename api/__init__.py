@@ -10,6 +10,9 @@
 #   2019-12-07  Initial version.
 #   2020-01-01  Moved response handlers into response.py module
 #   2020-09-23  Remove Publish class
+#   2026-10-19  Add JobMetrics class
+#   2026-10-19  Add Statistics class
+#   2026-10-19  Add stream_result_as_ndjson()
 #
 #
 #   DOCUMENTATION
@@ -90,6 +93,7 @@
 #       DataObjects may also implement a CSV extraction method by means of
 #       .query() -> SQLite.Cursor method and
 #       api.stream_result_as_csv(result:SQLite.Cursor)
+#       (or api.stream_result_as_ndjson(), for newline delimited JSON)
 #       Implementation belongs into the 'route.py':
 #
 #       @app.route('/csv/classifieddata', methods=['GET'])
@@ -110,7 +114,10 @@ from .File          import File
 from .Upload        import Upload
 from .Flow          import Flow
 from .Teacher       import Teacher
+from .JobMetrics    import JobMetrics
+from .Statistics    import Statistics
 from .Exception     import *
-from .response      import response, exception_response, stream_result_as_csv
+from .response      import response, exception_response
+from .response      import stream_result_as_csv, stream_result_as_ndjson
 
 # EOF
@@ -8,6 +8,7 @@
 #
 #   2020-01-01  Initial version.
 #   2020-09-11  Add mimetype call parameter to response() and __make_response()
+#   2026-10-19  Add stream_result_as_ndjson(), stream rows in batches.
 #
 #
 import time
@@ -155,12 +156,37 @@ def exception_response(ex: Exception):
 
 
 #
-# UNDER TESTING (Seems to fail before streaming out 3 GB)
+# Streaming responses
+#
+#   Query result (cursor) is read STREAM_ROWS rows at the time and each
+#   batch is yielded out as one chunk, so the memory use does not depend
+#   on the size of the result. Cursor must stay open until the response
+#   has been sent - stream_with_context() keeps the request (and g.db)
+#   alive until the generator is exhausted.
+#
+STREAM_ROWS = 1000
+
+
+def __attachment_headers(extension: str, filename: str = None):
+    """Content-Disposition header for a streamed file. Default filename is the current datetime."""
+    from werkzeug.datastructures    import Headers
+    headers = Headers()
+    headers.set(
+        'Content-Disposition',
+        'attachment',
+        filename = (filename or time.strftime(
+            "%Y-%m-%d %H.%M.%S",
+            time.localtime(time.time())
+        )) + extension
+    )
+    return headers
+
+
 # https://stackoverflow.com/questions/28011341/create-and-download-a-csv-file-from-a-flask-view
 #
 # Takes queried cursor and streams it out as CSV file
-def stream_result_as_csv(cursor):
-    """Takes one argument, SQLite3 query result, which is streamed out as CSV file."""
+def stream_result_as_csv(cursor, filename: str = None):
+    """Takes SQLite3 query result (cursor), which is streamed out as CSV file. Optional 'filename' (without extension) for the Content-Disposition header."""
     import io       # for StringIO
     import csv
     # Generator object for the Response() to use
@@ -176,28 +202,15 @@ def stream_result_as_csv(cursor):
         data.seek(0)
         data.truncate(0)
 
-        # Yeild data
-        for row in cursor:
-            writer.writerow(row)
+        # Yield data
+        for rows in iter(lambda: cursor.fetchmany(STREAM_ROWS), []):
+            writer.writerows(rows)
             yield data.getvalue()
             data.seek(0)
             data.truncate(0)
 
-    from werkzeug.datastructures    import Headers
     from werkzeug.wrappers          import Response
     from flask                      import stream_with_context
-    #
-    # Response header
-    #
-    headers = Headers()
-    headers.set(
-        'Content-Disposition',
-        'attachment',
-        filename = time.strftime(
-            "%Y-%m-%d %H.%M.%S.csv",
-            time.localtime(time.time())
-        )
-    )
 
     # RFC 7111 (wich updates RFC 4180) states that the MIME type for
     # CSV is "text/csv". (Google Chrome can shut the hell up).
@@ -206,8 +219,29 @@ def stream_result_as_csv(cursor):
     return Response(
         stream_with_context(generate(cursor)),
         mimetype='text/csv',
-        headers=headers
+        headers=__attachment_headers(".csv", filename)
     )
 
 
+# Takes queried cursor and streams it out as newline delimited JSON
+def stream_result_as_ndjson(cursor, filename: str = None):
+    """Takes SQLite3 query result (cursor), which is streamed out as NDJSON (one JSON object per row and line). Optional 'filename' (without extension) for the Content-Disposition header."""
+    def generate(cursor):
+        keys = [key[0] for key in cursor.description]
+        for rows in iter(lambda: cursor.fetchmany(STREAM_ROWS), []):
+            yield "".join(
+                json.dumps(dict(zip(keys, row)), default=str) + "\n"
+                for row in rows
+            )
+
+    from werkzeug.wrappers          import Response
+    from flask                      import stream_with_context
+
+    return Response(
+        stream_with_context(generate(cursor)),
+        mimetype='application/x-ndjson',
+        headers=__attachment_headers(".ndjson", filename)
+    )
+
 
+# EOF
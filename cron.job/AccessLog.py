@@ -0,0 +1,226 @@
+#
+#   AccessLog - Nginx access log reader for download statistics
+#
+#   AccessLog.py
+#   2026-10-19  Initial version.
+#   2026-10-19  Events include a client key (salted hash) and range start.
+#   2026-10-19  SALT can be replaced with a persistent key.
+#
+#
+#   Reads download events from Nginx access logs ('combined' log format):
+#
+#       $remote_addr - $remote_user [$time_local] "$request" $status
+#       $body_bytes_sent "$http_referer" "$http_user_agent"
+#
+#   Only successful (2xx) "GET /download/<filename>" requests of files with
+#   one of the given extensions are events. Each event is a tuple:
+#
+#       (filename, datetime, size, client, start)
+#
+#   where 'datetime' is UTC epoch (as 'downloadable.created'), 'size' is
+#   the number of bytes sent and 'start' is the offset of the first byte
+#   sent: 0 for a 200 response, the Range start for a 206 response if the
+#   log has it (see below), otherwise None.
+#
+#   CLIENT KEY
+#
+#   'client' identifies the downloader: it is a keyed hash (BLAKE2b) of the
+#   remote address and user agent. The address is discarded as soon as the
+#   line has been parsed. By default, the key (SALT) is random for each
+#   process and the client keys of two runs cannot be linked to each other.
+#   The ingester replaces it with a secret key that is kept from run to run
+#   (unique downloader sketches, ingest-access-log.py), which links the
+#   client keys of different runs, but never to the address. Client keys
+#   are not written anywhere. Forked processes inherit the salt.
+#
+#   RANGE REQUESTS
+#
+#   'combined' format does not log the Range header. To have the exact
+#   ranges, append it to the log format as the last field:
+#
+#       log_format vmstats '$remote_addr - $remote_user [$time_local] '
+#                          '"$request" $status $body_bytes_sent '
+#                          '"$http_referer" "$http_user_agent" "$http_range"';
+#
+#   Lines are read as bytes and other requests are discarded with a
+#   substring test before the (precompiled) regular expression is applied.
+#   Timestamps are converted without strptime(): epoch of the date and
+#   timezone is cached, and only the time of day is added for each line.
+#
+#   ROTATION
+#
+#   Logrotate renames 'access.log' to 'access.log.1' and compresses it
+#   later to 'access.log.2.gz', etc. Neither the name nor the inode (gzip
+#   creates a new file) identifies the log. Instead, a log is identified by
+#   a fingerprint of its first line (remote address and timestamp to the
+#   second), which survives the renames and compression. Read position is
+#   an offset into the uncompressed content, so a position recorded for
+#   'access.log' is valid for the same log as 'access.log.2.gz'.
+#
+#   USAGE
+#       for log in AccessLog.rotated("/var/log/nginx/access.log"):
+#           if log.fingerprint:
+#               for offset, event in log.events(0, ('iso', 'ova')):
+#                   print(event)
+#
+import os
+import re
+import gzip
+import glob
+import struct
+import hashlib
+import calendar
+import urllib.parse
+
+
+class AccessLog():
+
+    # Lines that can be download events contain this
+    PREFILTER   = b'"GET /download/'
+    REQUEST     = re.compile(
+        rb'(\S+) \S+ \S+ '
+        rb'\[(\d\d/\w\w\w/\d{4}):(\d\d):(\d\d):(\d\d) ([-+]\d{4})\] '
+        rb'"GET /download/([^ "?]+)[^ "]* [^"]*" (2\d\d) (\d+) '
+        rb'"[^"]*" "([^"]*)"(?: "bytes=(\d*)-)?'
+    )
+    MONTHS      = {
+        m.encode(): n
+        for n, m in enumerate(
+            ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+             'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'),
+            start = 1
+        )
+    }
+    # Rotated logs, '<name>.<N>' or '<name>.<N>.gz'
+    ROTATED     = re.compile(r'\.(\d+)(\.gz)?$')
+    # Client key hash key, never stored (see CLIENT KEY)
+    SALT        = os.urandom(16)
+
+
+    def __init__(self, filepath: str):
+        self.filepath   = filepath
+        self.compressed = filepath.endswith('.gz')
+        self.stat       = os.stat(filepath)
+        self.fingerprint = None
+        with self.open() as f:
+            line = f.readline()
+        # Without one complete line, the log cannot be identified (yet)
+        if line.endswith(b'\n'):
+            self.fingerprint = hashlib.sha1(line).hexdigest()
+        # {b'19/Oct/2026 +0300': epoch of the date (UTC)}
+        self.__days = {}
+
+
+    def __repr__(self):
+        return f"AccessLog('{self.filepath}')"
+
+
+    @staticmethod
+    def rotated(filepath: str) -> list:
+        """Returns AccessLog instances for 'filepath' and its rotated logs, oldest first. Logs that disappear while being listed are omitted."""
+        numbered = []
+        for path in glob.glob(glob.escape(filepath) + '.*'):
+            match = AccessLog.ROTATED.search(path[len(filepath):])
+            if match and match.start() == 0:
+                numbered.append((int(match.group(1)), path))
+        logs = []
+        for _, path in sorted(numbered, reverse = True) + [(0, filepath)]:
+            try:
+                logs.append(AccessLog(path))
+            except FileNotFoundError:
+                pass
+        return logs
+
+
+    def open(self):
+        if self.compressed:
+            return gzip.open(self.filepath, 'rb')
+        return open(self.filepath, 'rb')
+
+
+    def length(self) -> int:
+        """Uncompressed length. For gzip files, this is read from the gzip trailer (ISIZE, modulo 2^32) and files over 4 GB return None."""
+        if not self.compressed:
+            return self.stat.st_size
+        if self.stat.st_size < 18:
+            return None
+        with open(self.filepath, 'rb') as f:
+            f.seek(-4, os.SEEK_END)
+            isize, = struct.unpack('<I', f.read(4))
+        # Single member file of less than 4 GB (gzip as used by logrotate)
+        return isize if self.stat.st_size < 2**32 else None
+
+
+    def epoch(self, date: bytes, tz: bytes) -> int:
+        """UTC epoch of midnight 'date' (b'19/Oct/2026') in timezone 'tz' (b'+0300')."""
+        key = date + tz
+        epoch = self.__days.get(key)
+        if epoch is None:
+            epoch = calendar.timegm(
+                (
+                    int(date[7:11]),
+                    AccessLog.MONTHS[date[3:6]],
+                    int(date[0:2]),
+                    0, 0, 0
+                )
+            )
+            offset = int(tz[1:3]) * 3600 + int(tz[3:5]) * 60
+            epoch = epoch - offset if tz[0:1] == b'+' else epoch + offset
+            self.__days[key] = epoch
+        return epoch
+
+
+    @staticmethod
+    def client(address: bytes, agent: bytes) -> bytes:
+        """Client key (see CLIENT KEY)."""
+        return hashlib.blake2b(
+            address + b'\0' + agent,
+            key = AccessLog.SALT,
+            digest_size = 8
+        ).digest()
+
+
+    def parse(self, line: bytes, extensions: tuple) -> tuple:
+        """Returns (filename, datetime, size, client, start) if 'line' is a download of a file with one of the 'extensions' (lower case, without dot), otherwise None."""
+        if AccessLog.PREFILTER not in line:
+            return None
+        match = AccessLog.REQUEST.match(line)
+        if not match:
+            return None
+        address, date, h, m, s, tz, path, status, size, agent, start = \
+            match.groups()
+        filename = os.path.basename(urllib.parse.unquote(path.decode(errors = 'replace')))
+        if filename.rpartition('.')[2].lower() not in extensions:
+            return None
+        if status == b'200':
+            start = 0
+        elif status == b'206' and start:
+            start = int(start)
+        else:
+            start = None
+        return (
+            filename,
+            self.epoch(date, tz) + int(h) * 3600 + int(m) * 60 + int(s),
+            int(size),
+            AccessLog.client(address, agent),
+            start
+        )
+
+
+    def events(self, offset: int, extensions: tuple):
+        """Generator of (offset, event) for each download event after 'offset' (uncompressed). Returned 'offset' is the position after the line of the event, and (offset, None) is generated at the end of the complete lines. An incomplete last line (being written) is not consumed."""
+        extensions = tuple(e.strip().lower().lstrip('.') for e in extensions)
+        with self.open() as f:
+            # For gzip files, seek() decompresses up to 'offset'
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                event = self.parse(line, extensions)
+                if event:
+                    yield (offset, event)
+        yield (offset, None)
+
+
+# EOF
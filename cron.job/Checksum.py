@@ -0,0 +1,126 @@
+#
+#   Checksum - Calculate several digests with one read of the file
+#
+#   Checksum.py
+#   2026-10-19  Initial version.
+#   2026-10-19  Page cache friendly reads (fadvise, drop-behind).
+#   2026-10-19  Add 'progress' callback (throttling, job heartbeat).
+#
+#
+#   Images are several gigabytes. Each published checksum is a column in
+#   table 'file' (ALGORITHMS) and all of them are calculated from the same
+#   read loop, so that adding an algorithm does not add a read of the file.
+#
+#   Site configuration 'CHECKSUMS' lists the algorithms to calculate
+#   (comma separated, for example "sha1, sha256, blake2b").
+#
+#   PAGE CACHE
+#
+#   Reading a large image through the page cache evicts the images that
+#   Nginx is serving. Checksum.file() therefore:
+#       - Advises sequential access (POSIX_FADV_SEQUENTIAL, larger readahead).
+#       - Reads in BLOCKSIZE blocks, which are page aligned.
+#       - Drops the pages of each block after hashing it
+#         (POSIX_FADV_DONTNEED), according to argument 'cache':
+#           'cold'  Drop only the blocks that were not in the page cache
+#                   when the read started (PageCache.py). Hot files, which
+#                   Nginx is serving, stay in the cache. (default)
+#           'drop'  Drop all blocks. For files no one else is reading,
+#                   such as a freshly assembled image. Dirty pages are not
+#                   dropped by DONTNEED, so the file is fsync()'ed first.
+#           'keep'  Do not drop anything.
+#
+#   'page-cache-benchmark.py' shows the effect on cache residency.
+#
+#   PROGRESS
+#
+#   Optional 'progress' is called with the number of bytes read so far
+#   after each block. Callers use it to renew job leases and to throttle
+#   the read rate (by sleeping in the callback).
+#
+#   USAGE
+#       algorithms = Checksum.parse(CHECKSUMS)
+#       digests = Checksum.file(filepath, algorithms)
+#       # {'sha1': '...', 'sha256': '...', 'blake2b': '...'}
+#
+import os
+import hashlib
+
+from PageCache  import PageCache
+
+
+class Checksum():
+
+    # Supported algorithms. Each is also a column in table 'file'.
+    ALGORITHMS  = ('sha1', 'sha256', 'blake2b')
+    # Read size. Multiple of page size (aligned reads) and large enough to
+    # keep the system call and fadvise() overhead negligible.
+    BLOCKSIZE   = 8 * 1024 * 1024
+    # Block is "hot" if more than this share of its pages were cached
+    HOT         = 0.5
+
+
+    @staticmethod
+    def parse(value: str) -> list:
+        """Convert comma separated configuration value into a list of algorithms. Raises ValueError for unsupported algorithms."""
+        algorithms = [a.strip().lower() for a in value.split(',') if a.strip()]
+        for algorithm in algorithms:
+            if algorithm not in Checksum.ALGORITHMS:
+                raise ValueError(
+                    f"Unsupported checksum algorithm '{algorithm}'! (supported: {', '.join(Checksum.ALGORITHMS)})"
+                )
+        if not algorithms:
+            raise ValueError("No checksum algorithms configured!")
+        return algorithms
+
+
+    @staticmethod
+    def file(
+        filepath: str,
+        algorithms: list = ALGORITHMS,
+        cache: str = 'cold',
+        progress = None
+    ) -> dict:
+        """Read 'filepath' once and return {algorithm: hexdigest} for each of the 'algorithms'. Argument 'cache' ('cold', 'drop' or 'keep') selects which pages are dropped from the page cache after reading. Callable 'progress' receives the number of bytes read after each block."""
+        if cache not in ('cold', 'drop', 'keep'):
+            raise ValueError(f"Invalid cache mode '{cache}'!")
+        hashes = [(a, hashlib.new(a)) for a in algorithms]
+        buffer = bytearray(Checksum.BLOCKSIZE)
+        view = memoryview(buffer)
+        pages_per_block = Checksum.BLOCKSIZE // PageCache.PAGESIZE
+        with open(filepath, 'rb', buffering = 0) as f:
+            fd = f.fileno()
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            if cache == 'drop':
+                os.fsync(fd)
+            # Residency before we read anything. Without mincore(), the
+            # whole file is considered cold.
+            residency = None
+            if cache == 'cold' and PageCache.available:
+                try:
+                    residency = PageCache.residency(fd)
+                except OSError:
+                    pass
+            offset = 0
+            while True:
+                n = f.readinto(buffer)
+                if not n:
+                    break
+                for _, h in hashes:
+                    h.update(view[:n])
+                if cache == 'drop':
+                    os.posix_fadvise(fd, offset, n, os.POSIX_FADV_DONTNEED)
+                elif cache == 'cold':
+                    page = offset // PageCache.PAGESIZE
+                    cached = PageCache.resident(
+                        residency, page, page + pages_per_block
+                    ) if residency else 0
+                    if cached <= Checksum.HOT * pages_per_block:
+                        os.posix_fadvise(fd, offset, n, os.POSIX_FADV_DONTNEED)
+                offset += n
+                if progress:
+                    progress(offset)
+        return {a: h.hexdigest() for a, h in hashes}
+
+
+# EOF
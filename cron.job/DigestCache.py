@@ -0,0 +1,157 @@
+#
+#   DigestCache - Reuse checksums of files that have not changed
+#
+#   DigestCache.py
+#   2026-10-19  Initial version.
+#
+#
+#   Checksums are calculated for table 'file' rows, and a row that is
+#   recreated (re-import, rename, database rebuild) would have its image read
+#   again - several gigabytes per image. This cache remembers the digests by
+#   file identity and state instead:
+#
+#       (device, inode, size, mtime_ns)
+#
+#   Rename keeps the inode (and mtime), so the digests are found under the
+#   new name. Any write to the file changes its mtime, and a replaced file
+#   has a new inode, so stale digests are never returned.
+#
+#   Cache is a separate SQLite database in the STATE_DIR (site.conf), so
+#   that it survives the rebuild of the application database. Without
+#   STATE_DIR, the cache is disabled (lookups miss, stores are ignored).
+#
+#   Entries that have not been used for EXPIRE days are removed by purge().
+#
+#   USAGE
+#       with DigestCache(STATE_DIR) as cache:
+#           st = os.stat(filepath)
+#           digests = cache.get(st, algorithms)
+#           if digests is None:
+#               digests = Checksum.file(filepath, algorithms)
+#               if DigestCache.unchanged(st, os.stat(filepath)):
+#                   cache.put(st, digests)
+#
+import os
+import time
+import sqlite3
+
+
+class DigestCache():
+
+    FILENAME    = "digests.sqlite3"
+    # Days an unused entry is kept
+    EXPIRE      = 90
+    # Seconds to wait for a lock held by another process
+    TIMEOUT     = 30
+
+
+    def __init__(self, directory: str = None):
+        self.db = None
+        if directory:
+            self.db = sqlite3.connect(
+                os.path.join(directory, DigestCache.FILENAME),
+                timeout = DigestCache.TIMEOUT
+            )
+            self.db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS digest
+                (
+                    dev         INTEGER NOT NULL,
+                    ino         INTEGER NOT NULL,
+                    size        INTEGER NOT NULL,
+                    mtime_ns    INTEGER NOT NULL,
+                    algorithm   TEXT    NOT NULL,
+                    hexdigest   TEXT    NOT NULL,
+                    used        INTEGER NOT NULL,
+                    PRIMARY KEY (dev, ino, size, mtime_ns, algorithm)
+                ) WITHOUT ROWID
+                """
+            )
+            self.db.commit()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def close(self):
+        if self.db:
+            self.db.close()
+            self.db = None
+
+
+    @staticmethod
+    def key(st: os.stat_result) -> tuple:
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+    @staticmethod
+    def unchanged(before: os.stat_result, after: os.stat_result) -> bool:
+        """True if the file was not modified (or replaced) between the two stat() calls."""
+        return DigestCache.key(before) == DigestCache.key(after)
+
+
+    def get(self, st: os.stat_result, algorithms: list) -> dict:
+        """Returns {algorithm: hexdigest} for the file described by 'st', or None unless all 'algorithms' are cached."""
+        if not self.db:
+            return None
+        digests = dict(
+            self.db.execute(
+                """
+                SELECT  algorithm, hexdigest
+                FROM    digest
+                WHERE   dev = ? AND ino = ? AND size = ? AND mtime_ns = ?
+                """,
+                DigestCache.key(st)
+            ).fetchall()
+        )
+        if not all(a in digests for a in algorithms):
+            return None
+        self.db.execute(
+            """
+            UPDATE  digest
+            SET     used = ?
+            WHERE   dev = ? AND ino = ? AND size = ? AND mtime_ns = ?
+            """,
+            (int(time.time()), *DigestCache.key(st))
+        )
+        self.db.commit()
+        return {a: digests[a] for a in algorithms}
+
+
+    def put(self, st: os.stat_result, digests: dict):
+        """Store {algorithm: hexdigest} for the file described by 'st'."""
+        if not self.db:
+            return
+        now = int(time.time())
+        self.db.executemany(
+            """
+            INSERT OR REPLACE INTO digest
+            (dev, ino, size, mtime_ns, algorithm, hexdigest, used)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (*DigestCache.key(st), a, d, now)
+                for a, d in digests.items()
+            ]
+        )
+        self.db.commit()
+
+
+    def purge(self, days: int = EXPIRE) -> int:
+        """Remove entries not used in 'days' days. Returns the number of removed entries."""
+        if not self.db:
+            return 0
+        cursor = self.db.execute(
+            "DELETE FROM digest WHERE used < ?",
+            [int(time.time()) - days * 24 * 3600]
+        )
+        self.db.commit()
+        return cursor.rowcount
+
+
+# EOF
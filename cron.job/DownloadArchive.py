@@ -0,0 +1,243 @@
+#
+#   DownloadArchive - Columnar archive of download events
+#
+#   DownloadArchive.py
+#   2026-10-19  Initial version.
+#
+#
+#   Download events of closed months are moved out of the application
+#   database (table 'download') into one archive file per month, in the
+#   STATE_DIR (site.conf):
+#
+#       download-YYYY-MM.arc
+#
+#   Rows are stored as columns (array module), each column compressed
+#   with zlib:
+#
+#       key         Index into the dictionary of (file_id, filename)
+#       datetime    Delta encoded epoch (see below)
+#       size        Bytes sent
+#       complete    1 = 'TRUE', 0 = 'FALSE', 2 = NULL
+#
+#   Rows are sorted by (file_id, filename, datetime), which makes each
+#   dictionary entry a contiguous segment of the columns. Dictionary in the
+#   header records the segments [file_id, filename, start, count]. The
+#   first 'datetime' value of a segment is relative to the header 'base'
+#   and the following values are relative to the previous row.
+#
+#   Aggregation (rollup(), trend()) works on the decoded arrays: period
+#   boundaries are located in each (sorted) segment with bisect, and
+#   counts and sums are taken over array slices, so that the events are
+#   never iterated in Python.
+#
+#   FILE FORMAT
+#
+#       MAGIC               8 bytes
+#       header length       uint32, little endian
+#       header              JSON (UTF-8)
+#       columns             zlib compressed little endian arrays, in the
+#                           order and of the lengths listed in the header
+#
+#   USAGE
+#       DownloadArchive.write(filepath, month, rows)
+#       archive = DownloadArchive.read(filepath)
+#       archive.rollup('%Y-%m')     # {(file_id, '2020-09'): [...], ...}
+#       DownloadArchive.trend(STATE_DIR, '%Y')
+#
+import os
+import sys
+import json
+import glob
+import time
+import zlib
+import array
+import bisect
+import struct
+import calendar
+import itertools
+
+
+class DownloadArchive():
+
+    MAGIC       = b"VMDLARC1"
+    HEADER      = struct.Struct("<I")
+    PATTERN     = "download-????-??.arc"
+    # (name, typecode)
+    COLUMNS     = (
+        ('key',         'I'),
+        ('datetime',    'i'),
+        ('size',        'Q'),
+        ('complete',    'B')
+    )
+    COMPLETE    = {'TRUE': 1, 'FALSE': 0, None: 2}
+
+
+    def __init__(self, header: dict, columns: dict):
+        self.month      = header['month']
+        self.dictionary = header['dictionary']
+        self.key        = columns['key']
+        self.size       = columns['size']
+        self.complete   = columns['complete']
+        # Decode datetime, segment by segment
+        deltas = columns['datetime']
+        self.datetime = array.array('q')
+        for _, _, start, count in self.dictionary:
+            segment = array.array('q', deltas[start:start + count])
+            segment[0] += header['base']
+            self.datetime.extend(itertools.accumulate(segment))
+
+
+    def __len__(self):
+        return len(self.datetime)
+
+
+    @staticmethod
+    def filename(month: str) -> str:
+        return f"download-{month}.arc"
+
+
+    @staticmethod
+    def write(filepath: str, month: str, rows: list) -> int:
+        """Write 'download' rows (file_id, filename, datetime, size, complete) of 'month' ('YYYY-MM') into 'filepath' (replaced atomically). Returns the size of the file."""
+        rows = sorted(rows, key = lambda r: (r[0], r[1], r[2]))
+        base = min((r[2] for r in rows), default = 0)
+        dictionary = []
+        columns = {name: array.array(t) for name, t in DownloadArchive.COLUMNS}
+        previous = None
+        for n, (file_id, filename, datetime, size, complete) in enumerate(rows):
+            if previous is None or (file_id, filename) != previous:
+                dictionary.append([file_id, filename, n, 0])
+                previous = (file_id, filename)
+                columns['datetime'].append(datetime - base)
+            else:
+                columns['datetime'].append(datetime - last)
+            last = datetime
+            dictionary[-1][3] += 1
+            columns['key'].append(len(dictionary) - 1)
+            columns['size'].append(size)
+            columns['complete'].append(DownloadArchive.COMPLETE[complete])
+        blobs = []
+        for name, _ in DownloadArchive.COLUMNS:
+            if sys.byteorder == 'big':
+                columns[name].byteswap()
+            blobs.append(zlib.compress(columns[name].tobytes(), 9))
+        header = json.dumps(
+            {
+                'month':        month,
+                'rows':         len(rows),
+                'base':         base,
+                'created':      int(time.time()),
+                'dictionary':   dictionary,
+                'columns':      [
+                    [name, t, len(blob)]
+                    for (name, t), blob in zip(DownloadArchive.COLUMNS, blobs)
+                ]
+            }
+        ).encode()
+        with open(filepath + ".tmp", "wb") as f:
+            f.write(DownloadArchive.MAGIC)
+            f.write(DownloadArchive.HEADER.pack(len(header)))
+            f.write(header)
+            for blob in blobs:
+                f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(filepath + ".tmp", filepath)
+        return os.stat(filepath).st_size
+
+
+    @staticmethod
+    def read(filepath: str):
+        """Returns DownloadArchive. Raises ValueError if the file is not an archive."""
+        with open(filepath, "rb") as f:
+            if f.read(len(DownloadArchive.MAGIC)) != DownloadArchive.MAGIC:
+                raise ValueError(f"'{filepath}' is not a download archive!")
+            length, = DownloadArchive.HEADER.unpack(
+                f.read(DownloadArchive.HEADER.size)
+            )
+            header = json.loads(f.read(length))
+            columns = {}
+            for name, typecode, length in header['columns']:
+                columns[name] = array.array(typecode)
+                columns[name].frombytes(zlib.decompress(f.read(length)))
+                if sys.byteorder == 'big':
+                    columns[name].byteswap()
+        if any(len(c) != header['rows'] for c in columns.values()):
+            raise ValueError(f"'{filepath}' is truncated!")
+        return DownloadArchive(header, columns)
+
+
+    def rows(self):
+        """Generator of the archived 'download' rows (file_id, filename, datetime, size, complete)."""
+        complete = {v: k for k, v in DownloadArchive.COMPLETE.items()}
+        for file_id, filename, start, count in self.dictionary:
+            for n in range(start, start + count):
+                yield (
+                    file_id, filename, self.datetime[n],
+                    self.size[n], complete[self.complete[n]]
+                )
+
+
+    def rollup(self, fmt: str, file_id: int = None, totals: dict = None) -> dict:
+        """Aggregate by file instance and period (strftime() format 'fmt' of a UTC day, month or year: '%Y-%m-%d', '%Y-%m', '%Y'). Returns {(file_id, period): [downloads, complete, partial, bytes]}, added into 'totals', if given."""
+        if totals is None:
+            totals = {}
+        for fid, _, start, count in self.dictionary:
+            if file_id is not None and fid != file_id:
+                continue
+            end = start + count
+            lo = start
+            while lo < end:
+                period, next_period = DownloadArchive.period(
+                    self.datetime[lo], fmt
+                )
+                hi = bisect.bisect_left(self.datetime, next_period, lo, end)
+                complete = self.complete[lo:hi].count(1)
+                t = totals.setdefault((fid, period), [0, 0, 0, 0])
+                t[0] += hi - lo
+                t[1] += complete
+                t[2] += hi - lo - complete
+                t[3] += sum(self.size[lo:hi])
+                lo = hi
+        return totals
+
+
+    @staticmethod
+    def period(datetime: int, fmt: str) -> tuple:
+        """Returns (period of 'datetime' formatted with 'fmt', epoch of the start of the next period)."""
+        tm = time.gmtime(datetime)
+        if '%d' in fmt:
+            start = calendar.timegm((tm.tm_year, tm.tm_mon, tm.tm_mday, 0, 0, 0))
+            next_period = start + 24 * 3600
+        elif '%m' in fmt:
+            next_period = calendar.timegm(
+                (tm.tm_year + tm.tm_mon // 12, tm.tm_mon % 12 + 1, 1, 0, 0, 0)
+            )
+        else:
+            next_period = calendar.timegm((tm.tm_year + 1, 1, 1, 0, 0, 0))
+        return (time.strftime(fmt, tm), next_period)
+
+
+    @staticmethod
+    def archives(directory: str) -> list:
+        """Archive files in 'directory', oldest first."""
+        if not directory:
+            return []
+        return sorted(glob.glob(os.path.join(directory, DownloadArchive.PATTERN)))
+
+
+    @staticmethod
+    def trend(directory: str, fmt: str = '%Y-%m', file_id: int = None) -> dict:
+        """Aggregate all archives in 'directory' by period (see rollup()), over all file instances, or one. Returns {period: [downloads, complete, partial, bytes]}, in period order."""
+        totals = {}
+        for filepath in DownloadArchive.archives(directory):
+            DownloadArchive.read(filepath).rollup(fmt, file_id, totals)
+        trend = {}
+        for (_, period), t in sorted(totals.items(), key = lambda i: i[0][1]):
+            s = trend.setdefault(period, [0, 0, 0, 0])
+            for i, value in enumerate(t):
+                s[i] += value
+        return trend
+
+
+# EOF
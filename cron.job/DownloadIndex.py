@@ -0,0 +1,79 @@
+#
+#   DownloadIndex - Attribute download events to file instances
+#
+#   DownloadIndex.py
+#   2026-10-19  Initial version.
+#   2026-10-19  Add lookup().
+#
+#
+#   A filename can be reused by later uploads, so a download event belongs
+#   to the 'downloadable' (sql/download_statistics.sql) of that filename
+#   that existed at the time of the event:
+#
+#       created <= datetime AND (deleted IS NULL OR deleted >= datetime)
+#
+#   Trigger 'dlevent_iri' evaluates this with a grouped subquery for each
+#   inserted event. This index loads 'downloadable' once, as a sorted list
+#   of creation times for each filename, and finds the instance with a
+#   binary search (bisect). Two files by the same name cannot exist at the
+#   same time, so the only candidate is the latest instance created before
+#   the event.
+#
+#   USAGE
+#       index = DownloadIndex(db)
+#       file_id, complete = index.resolve("image.ova", 1600000000, 4096)
+#       file_id, size = index.lookup("image.ova", 1600000000)
+#
+import bisect
+import sqlite3
+
+
+class DownloadIndex():
+
+    def __init__(self, db: sqlite3.Connection):
+        # {filename: ([created, ...], [(file_id, deleted, size), ...])}
+        self.files = {}
+        for file_id, filename, size, created, deleted in db.execute(
+            """
+            SELECT      file_id, filename, size, created, deleted
+            FROM        downloadable
+            ORDER BY    filename, created
+            """
+        ):
+            created_list, instances = self.files.setdefault(
+                filename, ([], [])
+            )
+            created_list.append(int(created))
+            instances.append(
+                (file_id, None if deleted is None else int(deleted), size)
+            )
+
+
+    def __len__(self):
+        return sum(len(c) for c, _ in self.files.values())
+
+
+    def lookup(self, filename: str, datetime: int) -> tuple:
+        """Returns (file_id, size) of the instance of 'filename' that existed at 'datetime', or (None, None)."""
+        entry = self.files.get(filename)
+        if not entry:
+            return (None, None)
+        created_list, instances = entry
+        i = bisect.bisect_right(created_list, datetime) - 1
+        if i < 0:
+            return (None, None)
+        file_id, deleted, filesize = instances[i]
+        if deleted is not None and deleted < datetime:
+            return (None, None)
+        return (file_id, filesize)
+
+
+    def resolve(self, filename: str, datetime: int, size: int) -> tuple:
+        """Returns (file_id, complete) for the download event, or (None, None) if no instance of 'filename' existed at 'datetime'. 'complete' is 'TRUE' if 'size' equals the file size, otherwise 'FALSE'."""
+        file_id, filesize = self.lookup(filename, datetime)
+        if file_id is None:
+            return (None, None)
+        return (file_id, 'TRUE' if size == filesize else 'FALSE')
+
+
+# EOF
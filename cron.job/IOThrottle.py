@@ -0,0 +1,202 @@
+#
+#   IOThrottle - Token bucket shared by all background disk IO
+#
+#   IOThrottle.py
+#   2026-10-19  Initial version.
+#
+#
+#   Background jobs (assembly, checksums, scrubbing) read and write images
+#   of several gigabytes. At full speed, they compete with Nginx, which is
+#   serving the same disks to the students. All bulk IO of the cron jobs is
+#   therefore charged to one token bucket, shared by all processes through
+#   a state file (STATE_DIR/FILENAME) that is locked with flock() while
+#   the bucket is updated.
+#
+#   The bucket is refilled at IO_RATE bytes per second, up to IO_BURST
+#   bytes. IO is charged after it is done and a process that takes the
+#   bucket below zero sleeps until the debt is paid back. Concurrent
+#   processes find the bucket deeper in debt and sleep longer, so the
+#   combined rate stays at IO_RATE however many processes there are.
+#
+#   ADAPTIVE MODE
+#
+#   With IO_ADAPTIVE = yes, the rate is divided by one plus the number of
+#   active downloads, down to IO_MIN_RATE. A download is an established
+#   TCP connection to one of IO_PORTS that has unacknowledged data in its
+#   send queue (/proc/net/tcp, /proc/net/tcp6) - idle keep-alive
+#   connections are not counted. The count is refreshed every
+#   ADAPTIVE_INTERVAL seconds.
+#
+#   Site configuration (site.conf, defaults in DEFAULTS):
+#       IO_RATE         Bytes per second, 0 = unlimited (no throttling).
+#       IO_BURST        Bucket size, bytes.
+#       IO_ADAPTIVE     'yes' or 'no'.
+#       IO_MIN_RATE     Lowest adaptive rate, bytes per second.
+#       IO_PORTS        Comma separated list of web server ports.
+#
+#   Without STATE_DIR, each process has a bucket of its own.
+#
+#   USAGE
+#       throttle = IOThrottle.from_config(globals())
+#       for data in iter(lambda: src.read(BLKSIZE), b''):
+#           tgt.write(data)
+#           throttle.consume(2 * len(data))
+#       # Checksum.file() style progress callback (cumulative byte count)
+#       Checksum.file(filepath, algorithms, progress = throttle.counter())
+#
+import os
+import time
+import fcntl
+import struct
+
+
+class IOThrottle():
+
+    FILENAME            = "io-throttle.state"
+    # Bucket state: tokens (bytes), time of the last update
+    STATE               = struct.Struct("dd")
+    # Seconds between the download load checks (adaptive mode)
+    ADAPTIVE_INTERVAL   = 5
+    # Defaults for the site configuration values
+    DEFAULTS = {
+        'IO_RATE':      "0",
+        'IO_BURST':     str(64 * 1024 * 1024),
+        'IO_ADAPTIVE':  "no",
+        'IO_MIN_RATE':  str(5 * 1024 * 1024),
+        'IO_PORTS':     "80, 443"
+    }
+
+
+    def __init__(
+        self,
+        directory: str = None,
+        rate: int = 0,
+        burst: int = 64 * 1024 * 1024,
+        adaptive: bool = False,
+        min_rate: int = 5 * 1024 * 1024,
+        ports: list = [80, 443]
+    ):
+        """Rates are in bytes per second, 'rate' 0 = unlimited. State is shared through a file in 'directory', if given."""
+        self.filepath   = os.path.join(directory, IOThrottle.FILENAME) \
+                          if directory else None
+        self.rate       = rate
+        self.burst      = burst
+        self.adaptive   = adaptive
+        self.min_rate   = min_rate
+        self.ports      = set(ports)
+        # Opened in the process that uses it (see __state_fd())
+        self.fd         = None
+        self.pid        = None
+        # Private bucket, used without a state file
+        self.tokens     = burst
+        self.updated    = time.time()
+        # Adaptive mode
+        self.downloads  = 0
+        self.checked    = 0
+
+
+    @staticmethod
+    def from_config(cfg: dict):
+        """Create from site configuration values (a script's globals())."""
+        value = lambda key: cfg.get(key, IOThrottle.DEFAULTS[key])
+        return IOThrottle(
+            cfg.get('STATE_DIR'),
+            int(value('IO_RATE')),
+            int(value('IO_BURST')),
+            value('IO_ADAPTIVE').strip().lower() in ('yes', 'true', '1'),
+            int(value('IO_MIN_RATE')),
+            [int(p) for p in value('IO_PORTS').split(',') if p.strip()]
+        )
+
+
+    @staticmethod
+    def active_downloads(ports: set) -> int:
+        """Number of established TCP connections to 'ports' with data in their send queue."""
+        count = 0
+        for table in ('/proc/net/tcp', '/proc/net/tcp6'):
+            try:
+                with open(table) as f:
+                    next(f)     # Header
+                    for line in f:
+                        # sl local_address rem_address st tx_queue:rx_queue
+                        fields = line.split()
+                        port = int(fields[1].rsplit(':', 1)[1], 16)
+                        if port in ports and fields[3] == '01' and \
+                           int(fields[4].split(':')[0], 16):
+                            count += 1
+            except (OSError, IndexError, ValueError, StopIteration):
+                pass
+        return count
+
+
+    def current_rate(self) -> float:
+        """Refill rate, bytes per second (adjusted to download load in adaptive mode)."""
+        if not self.adaptive:
+            return self.rate
+        now = time.time()
+        if now - self.checked >= IOThrottle.ADAPTIVE_INTERVAL:
+            self.downloads = IOThrottle.active_downloads(self.ports)
+            self.checked = now
+        return max(self.min_rate, self.rate / (1 + self.downloads))
+
+
+    def __state_fd(self) -> int:
+        # flock() locks belong to the open file description, which a forked
+        # process would share with its parent. Each process opens its own.
+        if self.fd is None or self.pid != os.getpid():
+            self.fd = os.open(self.filepath, os.O_RDWR | os.O_CREAT, 0o664)
+            self.pid = os.getpid()
+        return self.fd
+
+
+    def __charge(self, nbytes: int, rate: float, tokens: float, updated: float) -> tuple:
+        """Refill bucket and charge 'nbytes'. Returns (tokens, now)."""
+        now = time.time()
+        tokens = min(self.burst, tokens + (now - updated) * rate)
+        return (tokens - nbytes, now)
+
+
+    def consume(self, nbytes: int):
+        """Charge 'nbytes' of IO. Sleeps if the bucket is in debt."""
+        if not self.rate or nbytes <= 0:
+            return
+        rate = self.current_rate()
+        if self.filepath:
+            fd = self.__state_fd()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                data = os.pread(fd, IOThrottle.STATE.size, 0)
+                if len(data) == IOThrottle.STATE.size:
+                    tokens, updated = IOThrottle.STATE.unpack(data)
+                else:
+                    tokens, updated = self.burst, time.time()
+                tokens, updated = self.__charge(nbytes, rate, tokens, updated)
+                os.pwrite(fd, IOThrottle.STATE.pack(tokens, updated), 0)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            self.tokens, self.updated = self.__charge(
+                nbytes, rate, self.tokens, self.updated
+            )
+            tokens = self.tokens
+        if tokens < 0:
+            time.sleep(-tokens / rate)
+
+
+    def counter(self, factor: int = 1):
+        """Returns a progress callback that receives a cumulative byte count and charges the increase ('factor' times, 2 for a copy)."""
+        last = 0
+        def progress(done: int, *args):
+            nonlocal last
+            self.consume(factor * (done - last))
+            last = done
+        return progress
+
+
+    def close(self):
+        if self.fd is not None and self.pid == os.getpid():
+            os.close(self.fd)
+        self.fd = None
+
+
+# EOF
@@ -0,0 +1,142 @@
+#
+#   Inotify - Directory change notifications (inotify(7))
+#
+#   Inotify.py
+#   2026-10-19  Initial version.
+#
+#
+#   Python standard library has no interface to inotify, so the system
+#   calls are made with libc functions through ctypes. Events are read
+#   from the inotify file descriptor (non-blocking) with os.read() and
+#   unpacked from the kernel's 'struct inotify_event':
+#
+#       int      wd;        Watch descriptor
+#       uint32_t mask;      Event bits
+#       uint32_t cookie;    Connects IN_MOVED_FROM and IN_MOVED_TO
+#       uint32_t len;       Size of 'name' (NUL padded)
+#       char     name[];    File name, relative to the watched directory
+#
+#   Inotify.available is False if libc functions could not be loaded
+#   (non-Linux system).
+#
+#   USAGE
+#       with Inotify() as inotify:
+#           inotify.add_watch(directory, Inotify.IN_CLOSE_WRITE)
+#           while True:
+#               for wd, mask, cookie, name in inotify.read(timeout = 5):
+#                   print(name)
+#
+import os
+import select
+import struct
+import ctypes
+import ctypes.util
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(
+            ctypes.util.find_library('c') or 'libc.so.6',
+            use_errno = True
+        )
+        libc.inotify_init1.restype      = ctypes.c_int
+        libc.inotify_init1.argtypes     = [ctypes.c_int]
+        libc.inotify_add_watch.restype  = ctypes.c_int
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32
+        ]
+        libc.inotify_rm_watch.restype   = ctypes.c_int
+        libc.inotify_rm_watch.argtypes  = [ctypes.c_int, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+
+class Inotify():
+
+    # Events (<sys/inotify.h>)
+    IN_MODIFY       = 0x00000002
+    IN_ATTRIB       = 0x00000004
+    IN_CLOSE_WRITE  = 0x00000008
+    IN_MOVED_FROM   = 0x00000040
+    IN_MOVED_TO     = 0x00000080
+    IN_CREATE       = 0x00000100
+    IN_DELETE       = 0x00000200
+    IN_DELETE_SELF  = 0x00000400
+    IN_MOVE_SELF    = 0x00000800
+    IN_Q_OVERFLOW   = 0x00004000
+    IN_IGNORED      = 0x00008000
+    IN_ISDIR        = 0x40000000
+    # inotify_init1() flags
+    IN_NONBLOCK     = os.O_NONBLOCK
+    IN_CLOEXEC      = os.O_CLOEXEC
+
+    EVENT           = struct.Struct("iIII")
+    BUFSIZE         = 64 * 1024
+
+    libc            = _load_libc()
+    available       = libc is not None
+
+
+    def __init__(self):
+        if not Inotify.available:
+            raise OSError("inotify is not available!")
+        self.fd = Inotify.libc.inotify_init1(
+            Inotify.IN_NONBLOCK | Inotify.IN_CLOEXEC
+        )
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, f"inotify_init1(): {os.strerror(e)}")
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+    def fileno(self) -> int:
+        return self.fd
+
+
+    def add_watch(self, path: str, mask: int) -> int:
+        """Watch 'path' for 'mask' events. Returns the watch descriptor. Raises OSError."""
+        wd = Inotify.libc.inotify_add_watch(
+            self.fd, os.fsencode(path), mask
+        )
+        if wd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, f"inotify_add_watch('{path}'): {os.strerror(e)}")
+        return wd
+
+
+    def read(self, timeout: float = None) -> list:
+        """Wait up to 'timeout' seconds (None = forever) for events. Returns a list of (wd, mask, cookie, name) tuples, which is empty if the timeout expired."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, Inotify.BUFSIZE)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + Inotify.EVENT.size <= len(data):
+            wd, mask, cookie, length = Inotify.EVENT.unpack_from(data, offset)
+            offset += Inotify.EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            events.append((wd, mask, cookie, os.fsdecode(name)))
+        return events
+
+
+# EOF
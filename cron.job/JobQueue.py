@@ -0,0 +1,541 @@
+#
+#   JobQueue - SQLite backed job queue with leases for background workers
+#
+#   JobQueue.py
+#   2026-10-19  Initial version.
+#   2026-10-19  Add Job.progress().
+#   2026-10-19  Add JobRun (run history and metrics).
+#   2026-10-19  Add .due() and claim(targets = ...) for caller side scheduling.
+#   2026-10-19  Add .enqueue_all() (one transaction for many targets).
+#   2026-10-19  .enqueue_all() accepts a payload for each target.
+#   2026-10-19  Job.complete() raises LeaseLost if the job was taken over.
+#
+#
+#   Table 'job' is created by 'sql/background_jobs.sql'. See that file for
+#   the description of the states and columns.
+#
+#   JobQueue(db, task) is a view to the jobs of one task type ('assemble',
+#   'checksum', 'import', 'cleanup', 'scrub'). Producers call .enqueue() for
+#   each unit of work they find, workers call .claim() and receive Job
+#   objects, which must be finished with .complete() or .fail(). Long-running
+#   work calls Job.heartbeat() frequently - it only writes into the database
+#   once in every 'heartbeat' seconds and raises LeaseLost if another worker
+#   has taken over the job (because our lease had expired). Workers that know
+#   how much work there is, call Job.progress() instead. It publishes bytes
+#   done, total bytes and throughput once in every 'progress_interval' seconds
+#   and renews the lease while doing so. Job.complete() also raises LeaseLost
+#   if the job was taken over - it is then finished by the other worker.
+#
+#   A script records its execution with JobRun, which is given to the
+#   JobQueue objects it uses. Each completed or failed job is then recorded
+#   with its duration and the bytes the worker reports in Job.bytes_read and
+#   Job.bytes_written. Nothing is written until JobRun.finish() (or the end
+#   of the 'with' block), and runs that did no work are not recorded at all.
+#
+#   All methods commit their own changes. Claims are made inside a
+#   'BEGIN IMMEDIATE' transaction, which takes the database write lock and
+#   thus makes the claim atomic between processes.
+#
+#   USAGE
+#       with JobRun(db, 'my-script.py') as run:
+#           queue = JobQueue(db, 'assemble', run = run)
+#           queue.enqueue(flowid, {'filename': 'my.ova'})
+#           for job in queue.claim():
+#               try:
+#                   job.bytes_read = do_work(job.payload, job.heartbeat)
+#               except Exception as e:
+#                   job.fail(str(e))
+#               else:
+#                   job.complete()
+#
+import os
+import json
+import time
+import socket
+import sqlite3
+
+
+class LeaseLost(Exception):
+    """Another worker has claimed the job after our lease expired."""
+    pass
+
+
+
+class Job():
+    """Claimed job. Created by JobQueue.claim() - not by the workers."""
+
+    def __init__(self, queue, id: int, target: str, payload, attempts: int):
+        self.queue      = queue
+        self.id         = id
+        self.task       = queue.task
+        self.target     = target
+        self.payload    = json.loads(payload) if payload else {}
+        self.attempts   = attempts
+        self.last_beat  = time.time()
+        self.started    = self.last_beat
+        # Reported by the worker, for the metrics (JobRun)
+        self.bytes_read     = 0
+        self.bytes_written  = 0
+        # Last published progress
+        self.last_progress  = self.last_beat
+        self.last_done      = 0
+
+
+    def __renew(self, now: float, columns: dict = {}):
+        """Renew the lease and update additional 'columns'. Raises LeaseLost."""
+        sql  = "UPDATE job SET heartbeat = :now, lease_expires = :expires, "
+        sql += "".join(f"{c} = :{c}, " for c in columns)
+        sql += "updated = :now "
+        sql += "WHERE id = :id AND state = 'running' AND lease_owner = :owner"
+        cursor = self.queue.execute(
+            sql,
+            {
+                **columns,
+                'now':      int(now),
+                'expires':  int(now) + self.queue.lease,
+                'id':       self.id,
+                'owner':    self.queue.owner
+            }
+        )
+        if cursor.rowcount != 1:
+            raise LeaseLost(
+                f"Job {self.id} ({self.task} '{self.target}') is no longer leased to '{self.queue.owner}'!"
+            )
+        self.last_beat = now
+
+
+    def heartbeat(self, force: bool = False):
+        """Renew the lease. Writes only once in 'JobQueue.heartbeat' seconds, unless 'force' is True. Raises LeaseLost if the job has been taken over."""
+        now = time.time()
+        if not force and now - self.last_beat < self.queue.heartbeat:
+            return
+        self.__renew(now)
+
+
+    def progress(self, done: int, total: int = None, force: bool = False):
+        """Publish bytes 'done' (of 'total') and the throughput since the previous publish. Writes only once in 'JobQueue.progress_interval' seconds, unless 'force' is True. Also renews the lease and raises LeaseLost like .heartbeat()."""
+        now = time.time()
+        if not force and now - self.last_progress < self.queue.progress_interval:
+            return
+        elapsed = now - self.last_progress
+        self.__renew(
+            now,
+            {
+                'progress': done,
+                'total':    total,
+                'rate':     (done - self.last_done) / elapsed if elapsed else None
+            }
+        )
+        self.last_progress  = now
+        self.last_done      = done
+
+
+    def complete(self):
+        """Mark job as done. Raises LeaseLost if the job has been taken over (the job is not done, the other worker will finish it)."""
+        sql = """
+            UPDATE  job
+            SET     state           = 'done',
+                    lease_owner     = NULL,
+                    lease_expires   = NULL,
+                    error           = NULL,
+                    updated         = :now
+            WHERE   id              = :id
+                    AND
+                    state           = 'running'
+                    AND
+                    lease_owner     = :owner
+        """
+        cursor = self.queue.execute(
+            sql,
+            {'now': int(time.time()), 'id': self.id, 'owner': self.queue.owner}
+        )
+        if cursor.rowcount != 1:
+            raise LeaseLost(
+                f"Job {self.id} ({self.task} '{self.target}') is no longer leased to '{self.queue.owner}'!"
+            )
+        if self.queue.run:
+            self.queue.run.record(self, 'done')
+
+
+    def fail(self, error: str = None):
+        """Release the job for a retry (with exponential backoff), or mark it as failed if it has no attempts left."""
+        now = int(time.time())
+        # 1st retry after 'backoff' seconds, 2nd after 2 x 'backoff', ...
+        delay = min(
+            self.queue.backoff * (2 ** max(self.attempts - 1, 0)),
+            self.queue.max_backoff
+        )
+        sql = """
+            UPDATE  job
+            SET     state           = CASE
+                                        WHEN attempts >= max_attempts
+                                        THEN 'failed'
+                                        ELSE 'queued'
+                                      END,
+                    not_before      = :not_before,
+                    lease_owner     = NULL,
+                    lease_expires   = NULL,
+                    error           = :error,
+                    updated         = :now
+            WHERE   id              = :id
+                    AND
+                    lease_owner     = :owner
+        """
+        self.queue.execute(
+            sql,
+            {
+                'not_before':   now + delay,
+                'error':        error,
+                'now':          now,
+                'id':           self.id,
+                'owner':        self.queue.owner
+            }
+        )
+        if self.queue.run:
+            self.queue.run.record(
+                self,
+                'failed' if self.attempts >= self.queue.max_attempts else 'retry',
+                error
+            )
+
+
+    def __str__(self):
+        return f"job {self.id} ({self.task} '{self.target}', attempt {self.attempts})"
+
+
+
+class JobQueue():
+
+    def __init__(
+        self,
+        db: sqlite3.Connection,
+        task: str,
+        lease: int          = 300,
+        heartbeat: int      = 30,
+        max_attempts: int   = 5,
+        backoff: int        = 60,
+        max_backoff: int    = 3600,
+        progress_interval: float = 2,
+        run = None
+    ):
+        """Arguments 'lease', 'heartbeat', 'backoff', 'max_backoff' and 'progress_interval' are in seconds. Finished jobs are recorded into JobRun 'run', if given."""
+        self.db             = db
+        self.task           = task
+        self.run            = run
+        self.lease          = lease
+        self.heartbeat      = heartbeat
+        self.progress_interval = progress_interval
+        self.max_attempts   = max_attempts
+        self.backoff        = backoff
+        self.max_backoff    = max_backoff
+        # Identifies this process as the lease holder
+        self.owner          = f"{socket.gethostname()}:{os.getpid()}"
+
+
+    def execute(self, sql: str, params = ()) -> sqlite3.Cursor:
+        """Execute one statement and commit."""
+        try:
+            cursor = self.db.execute(sql, params)
+        except:
+            self.db.rollback()
+            raise
+        else:
+            self.db.commit()
+        return cursor
+
+
+    def enqueue(self, target, payload: dict = None) -> bool:
+        """Add a job, unless one exists for the same target. A 'done' job is re-armed. Returns True if the job was (re)queued."""
+        return self.enqueue_all([target], payload) == 1
+
+
+    def enqueue_all(self, targets, payload: dict = None) -> int:
+        """Enqueue a job for each of the 'targets' (like .enqueue()), in one transaction. 'targets' is a list (all jobs get 'payload') or a dictionary {target: payload}. Returns the number of jobs (re)queued."""
+        now = int(time.time())
+        if not isinstance(targets, dict):
+            targets = dict.fromkeys(targets, payload)
+        data = [
+            {
+                'task':         self.task,
+                'target':       str(target),
+                'payload':      json.dumps(payload) if payload else None,
+                'max_attempts': self.max_attempts,
+                'now':          now
+            }
+            for target, payload in targets.items()
+        ]
+        if not data:
+            return 0
+        try:
+            queued = self.db.executemany(
+                """
+                INSERT OR IGNORE INTO job
+                    (task, target, payload, max_attempts, not_before, created, updated)
+                VALUES
+                    (:task, :target, :payload, :max_attempts, :now, :now, :now)
+                """,
+                data
+            ).rowcount
+            # Rows inserted above are 'queued', only existing 'done' rows
+            # are re-armed.
+            queued += self.db.executemany(
+                """
+                UPDATE  job
+                SET     state           = 'queued',
+                        payload         = :payload,
+                        attempts        = 0,
+                        max_attempts    = :max_attempts,
+                        not_before      = :now,
+                        error           = NULL,
+                        updated         = :now
+                WHERE   task            = :task
+                        AND
+                        target          = :target
+                        AND
+                        state           = 'done'
+                """,
+                data
+            ).rowcount
+        except:
+            self.db.rollback()
+            raise
+        else:
+            self.db.commit()
+        return queued
+
+
+    def claim(self, limit: int = 1, targets: list = None) -> list:
+        """Atomically lease up to 'limit' jobs that are due, optionally only from 'targets'. Jobs with expired leases are reclaimed (or failed if they have no attempts left). Returns a list of Job objects."""
+        now = int(time.time())
+        params = {'task': self.task, 'now': now, 'limit': limit}
+        only = ""
+        if targets is not None:
+            params.update({f"t{i}": str(t) for i, t in enumerate(targets)})
+            only = "AND target IN (" + ", ".join(
+                f":t{i}" for i in range(len(targets))
+            ) + ")"
+        if self.db.in_transaction:
+            self.db.commit()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            # Abandoned jobs (worker crashed) without attempts left
+            self.db.execute(
+                """
+                UPDATE  job
+                SET     state           = 'failed',
+                        lease_owner     = NULL,
+                        lease_expires   = NULL,
+                        error           = coalesce(error, 'Lease expired'),
+                        updated         = :now
+                WHERE   task            = :task
+                        AND
+                        state           = 'running'
+                        AND
+                        lease_expires   < :now
+                        AND
+                        attempts        >= max_attempts
+                """,
+                {'task': self.task, 'now': now}
+            )
+            rows = self.db.execute(
+                """
+                SELECT      id, target, payload, attempts
+                FROM        job
+                WHERE       task = :task
+                            AND
+                            (
+                                (state = 'queued' AND not_before <= :now)
+                                OR
+                                (state = 'running' AND lease_expires < :now)
+                            )
+                            {only}
+                ORDER BY    not_before, id
+                LIMIT       :limit
+                """.format(only = only),
+                params
+            ).fetchall()
+            for id, _, _, _ in rows:
+                self.db.execute(
+                    """
+                    UPDATE  job
+                    SET     state           = 'running',
+                            attempts        = attempts + 1,
+                            lease_owner     = :owner,
+                            lease_expires   = :expires,
+                            heartbeat       = :now,
+                            progress        = NULL,
+                            total           = NULL,
+                            rate            = NULL,
+                            updated         = :now
+                    WHERE   id              = :id
+                    """,
+                    {
+                        'owner':    self.owner,
+                        'expires':  now + self.lease,
+                        'now':      now,
+                        'id':       id
+                    }
+                )
+        except:
+            self.db.rollback()
+            raise
+        else:
+            self.db.commit()
+        return [
+            Job(self, id, target, payload, attempts + 1)
+            for id, target, payload, attempts in rows
+        ]
+
+
+    def pending(self) -> int:
+        """Number of jobs that could be claimed right now."""
+        now = int(time.time())
+        return self.db.execute(
+            """
+            SELECT  count(*)
+            FROM    job
+            WHERE   task = :task
+                    AND
+                    (
+                        (state = 'queued' AND not_before <= :now)
+                        OR
+                        (state = 'running' AND lease_expires < :now)
+                    )
+            """,
+            {'task': self.task, 'now': now}
+        ).fetchone()[0]
+
+
+    def due(self) -> list:
+        """Jobs that could be claimed right now, as a list of (target, payload dict) tuples. Nothing is claimed - another worker may claim them first."""
+        now = int(time.time())
+        return [
+            (target, json.loads(payload) if payload else {})
+            for target, payload in self.db.execute(
+                """
+                SELECT      target, payload
+                FROM        job
+                WHERE       task = :task
+                            AND
+                            (
+                                (state = 'queued' AND not_before <= :now)
+                                OR
+                                (state = 'running' AND lease_expires < :now)
+                            )
+                ORDER BY    not_before, id
+                """,
+                {'task': self.task, 'now': now}
+            ).fetchall()
+        ]
+
+
+    def remove(self, target):
+        """Delete the job row for 'target', regardless of its state."""
+        self.execute(
+            "DELETE FROM job WHERE task = ? AND target = ?",
+            (self.task, str(target))
+        )
+
+
+
+class JobRun():
+    """Run history and job metrics of one execution of a script. Tables 'job_run' and 'job_metric' are written by .finish()."""
+
+    def __init__(self, db: sqlite3.Connection, script: str):
+        self.db         = db
+        self.script     = script
+        self.started    = time.time()
+        self.owner      = f"{socket.gethostname()}:{os.getpid()}"
+        self.metrics    = []
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.finish(str(exc_value) if exc_type else None)
+        except sqlite3.Error:
+            # Do not replace the original exception
+            if not exc_type:
+                raise
+        # Do not suppress the exception
+        return False
+
+
+    def record(self, job: Job, outcome: str, error: str = None):
+        """Called by Job.complete() and Job.fail()."""
+        self.metrics.append(
+            {
+                'task':             job.task,
+                'target':           job.target,
+                'attempt':          job.attempts,
+                'started':          int(job.started),
+                'duration':         time.time() - job.started,
+                'bytes_read':       job.bytes_read,
+                'bytes_written':    job.bytes_written,
+                'outcome':          outcome,
+                'error':            error
+            }
+        )
+
+
+    def finish(self, error: str = None):
+        """Write the run and its job metrics, if any jobs were finished or the run failed ('error')."""
+        if not self.metrics and not error:
+            return
+        try:
+            if self.db.in_transaction:
+                self.db.commit()
+            cursor = self.db.execute(
+                """
+                INSERT INTO job_run
+                (
+                    script, owner, started, duration, jobs, done, failed,
+                    bytes_read, bytes_written, outcome, error
+                )
+                VALUES
+                (
+                    :script, :owner, :started, :duration, :jobs, :done,
+                    :failed, :bytes_read, :bytes_written, :outcome, :error
+                )
+                """,
+                {
+                    'script':           self.script,
+                    'owner':            self.owner,
+                    'started':          int(self.started),
+                    'duration':         time.time() - self.started,
+                    'jobs':             len(self.metrics),
+                    'done':             sum(m['outcome'] == 'done' for m in self.metrics),
+                    'failed':           sum(m['outcome'] != 'done' for m in self.metrics),
+                    'bytes_read':       sum(m['bytes_read'] for m in self.metrics),
+                    'bytes_written':    sum(m['bytes_written'] for m in self.metrics),
+                    'outcome':          'error' if error else 'ok',
+                    'error':            error
+                }
+            )
+            run_id = cursor.lastrowid
+            self.db.executemany(
+                """
+                INSERT INTO job_metric
+                (
+                    run_id, task, target, attempt, started, duration,
+                    bytes_read, bytes_written, outcome, error
+                )
+                VALUES
+                (
+                    :run_id, :task, :target, :attempt, :started, :duration,
+                    :bytes_read, :bytes_written, :outcome, :error
+                )
+                """,
+                [{**m, 'run_id': run_id} for m in self.metrics]
+            )
+        except:
+            self.db.rollback()
+            raise
+        else:
+            self.db.commit()
+        self.metrics = []
+
+# EOF
@@ -0,0 +1,104 @@
+#
+#   PageCache - Page cache residency of files (mincore(2))
+#
+#   PageCache.py
+#   2026-10-19  Initial version.
+#
+#
+#   Python has no interface to mincore(2), so the file is mapped (without
+#   reading it) with libc mmap() through ctypes and mincore() tells which
+#   of the pages are in the page cache. Mapping a file does not load it.
+#
+#   Residency vector has one byte per page, value 1 = resident, 0 = not.
+#
+#   PageCache.available is False if libc functions could not be loaded
+#   (non-Linux system). Callers should then assume nothing is cached.
+#
+#   USAGE
+#       with open(filepath, 'rb') as f:
+#           vec = PageCache.residency(f.fileno())
+#       print(f"{PageCache.resident(vec)} of {len(vec)} pages in cache")
+#
+import os
+import mmap
+import ctypes
+import ctypes.util
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(
+            ctypes.util.find_library('c') or 'libc.so.6',
+            use_errno = True
+        )
+        libc.mmap.restype   = ctypes.c_void_p
+        libc.mmap.argtypes  = [
+            ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int,
+            ctypes.c_int, ctypes.c_int, ctypes.c_long
+        ]
+        libc.munmap.restype     = ctypes.c_int
+        libc.munmap.argtypes    = [ctypes.c_void_p, ctypes.c_size_t]
+        libc.mincore.restype    = ctypes.c_int
+        libc.mincore.argtypes   = [
+            ctypes.c_void_p, ctypes.c_size_t, ctypes.POINTER(ctypes.c_ubyte)
+        ]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+
+class PageCache():
+
+    PAGESIZE    = mmap.PAGESIZE
+    MAP_FAILED  = ctypes.c_void_p(-1).value
+    libc        = _load_libc()
+    available   = libc is not None
+    # Translation table that keeps only the least significant bit
+    _LSB        = bytes(i & 1 for i in range(256))
+
+
+    @staticmethod
+    def residency(fd: int, size: int = None) -> bytearray:
+        """Residency vector of open file 'fd' (first 'size' bytes, default all). Raises OSError."""
+        if not PageCache.available:
+            raise OSError("mincore() is not available!")
+        if size is None:
+            size = os.fstat(fd).st_size
+        if not size:
+            return bytearray()
+        libc = PageCache.libc
+        addr = libc.mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED, fd, 0)
+        if addr is None or addr == PageCache.MAP_FAILED:
+            e = ctypes.get_errno()
+            raise OSError(e, f"mmap(): {os.strerror(e)}")
+        try:
+            npages = (size + PageCache.PAGESIZE - 1) // PageCache.PAGESIZE
+            vec = (ctypes.c_ubyte * npages)()
+            if libc.mincore(addr, size, vec):
+                e = ctypes.get_errno()
+                raise OSError(e, f"mincore(): {os.strerror(e)}")
+        finally:
+            libc.munmap(addr, size)
+        # Only the least significant bit is defined
+        return bytearray(vec).translate(PageCache._LSB)
+
+
+    @staticmethod
+    def resident(vec: bytearray, start: int = 0, end: int = None) -> int:
+        """Number of resident pages in residency vector 'vec' (pages 'start' ... 'end' - 1)."""
+        end = len(vec) if end is None else min(end, len(vec))
+        if start >= end:
+            return 0
+        return (end - start) - vec.count(0, start, end)
+
+
+    @staticmethod
+    def file(filepath: str) -> tuple:
+        """Returns (resident pages, total pages) for 'filepath'."""
+        with open(filepath, 'rb') as f:
+            vec = PageCache.residency(f.fileno())
+        return (PageCache.resident(vec), len(vec))
+
+
+# EOF
@@ -0,0 +1,224 @@
+#
+#   Sessionizer - Merge range requests into logical downloads
+#
+#   Sessionizer.py
+#   2026-10-19  Initial version.
+#   2026-10-19  Log positions of the requests, .take_settled().
+#
+#
+#   Download managers and browsers that resume an interrupted download
+#   fetch a file in several requests (HTTP Range, '206 Partial Content').
+#   Counted per request, one download of a large image shows up as several
+#   partial downloads, and none of them complete. Instead, the requests of
+#   one client (AccessLog.py client key) for one file instance are merged
+#   into a session, as long as the gap between the requests is at most
+#   'window' seconds. Each session is one logical download:
+#
+#       datetime    Time of the first request
+#       size        Bytes sent, all requests
+#       complete    'TRUE' if the byte ranges of the requests cover the
+#                   whole file, otherwise 'FALSE'
+#
+#   The range of a request is [start, start + bytes sent). If the start is
+#   not known (the Range header is not logged), the request is assumed to
+#   resume where the previous requests of the session ended.
+#
+#   Client keys stay in memory only. Sessions are converted into 'download'
+#   and 'download_unresolved' rows (sql/download_statistics.sql), which have
+#   no client columns.
+#
+#   RESUMING
+#
+#   Open sessions are not stored anywhere. Instead, each request can be
+#   given its position in the log (any comparable value), and the reader
+#   stops short of the open sessions: .take_settled() returns the position
+#   of the first request of the earliest open session (lowered to the first
+#   request of any closed session that continues past it), and only the
+#   closed sessions that started before it. Reading the log again from that
+#   position rebuilds the remaining sessions exactly, as every request after
+#   it belongs to a session that started after it.
+#
+#   USAGE
+#       sessionizer = Sessionizer(DownloadIndex(db), 3600)
+#       for position, event in events:
+#           sessionizer.add(*event, position)
+#       sessionizer.expire()            # close sessions idle for 'window'
+#       sessions, resume = sessionizer.take_settled()
+#       rows, unresolved = Sessionizer.rows(sessions)
+#
+from DownloadIndex import DownloadIndex
+
+
+class Session():
+
+    def __init__(self, key: tuple, filesize: int, datetime: int):
+        # (client, filename, file_id)
+        self.key        = key
+        self.filename   = key[1]
+        self.file_id    = key[2]
+        self.filesize   = filesize
+        self.first      = datetime
+        self.last       = datetime
+        self.requests   = 0
+        self.sent       = 0
+        # [(start or None, size), ...] in request order
+        self.ranges     = []
+        # Log positions of the first and the last request (if given)
+        self.position   = None
+        self.last_position = None
+
+
+    def __repr__(self):
+        return f"Session('{self.filename}', {self.first}, {self.sent})"
+
+
+    def add(self, datetime: int, start: int, size: int, position = None):
+        """Add a request of 'size' bytes from offset 'start' (None if not known), at log 'position'."""
+        if not self.ranges:
+            self.position = position
+        self.last_position = position
+        self.ranges.append((start, size))
+        self.first      = min(self.first, datetime)
+        self.last       = max(self.last, datetime)
+        self.requests  += 1
+        self.sent      += size
+
+
+    def merge(self, other):
+        """Add the requests of a later session 'other' (same client and file instance)."""
+        self.ranges.extend(other.ranges)
+        self.last_position = other.last_position
+        self.first      = min(self.first, other.first)
+        self.last       = max(self.last, other.last)
+        self.requests  += other.requests
+        self.sent      += other.sent
+
+
+    def covered(self) -> int:
+        """Number of bytes covered by the ranges."""
+        ranges = []
+        end = 0
+        for start, size in self.ranges:
+            if start is None:
+                start = end
+            ranges.append((start, start + size))
+            end = max(end, start + size)
+        covered = 0
+        end = 0
+        for s, e in sorted(ranges):
+            if e > end:
+                covered += e - max(s, end)
+                end = e
+        return covered
+
+
+    def complete(self) -> str:
+        return 'TRUE' if self.covered() >= self.filesize else 'FALSE'
+
+
+
+class Sessionizer():
+
+    def __init__(self, index: DownloadIndex, window: int):
+        self.index      = index
+        self.window     = window
+        # {(client, filename, file_id): Session}
+        self.open       = {}
+        self.closed     = []
+        # Latest event time
+        self.latest     = None
+
+
+    def __len__(self):
+        return len(self.open)
+
+
+    def add(
+        self,
+        filename: str,
+        datetime: int,
+        size: int,
+        client: bytes,
+        start: int,
+        position = None
+    ):
+        """Add an event (AccessLog.events()) and its log 'position' (see RESUMING). Events must be added in log order."""
+        if self.latest is None or datetime > self.latest:
+            self.latest = datetime
+        file_id, filesize = self.index.lookup(filename, datetime)
+        key = (client, filename, file_id)
+        session = self.open.get(key)
+        if session is None or datetime - session.last > self.window:
+            if session is not None:
+                self.closed.append(session)
+            session = self.open[key] = Session(key, filesize, datetime)
+        session.add(datetime, start, size, position)
+
+
+    def add_session(self, session: Session):
+        """Add a 'session' that was sessionized elsewhere (backfill). Sessions must be added in the order of their first request."""
+        current = self.open.get(session.key)
+        if current is None or session.first - current.last > self.window:
+            if current is not None:
+                self.closed.append(current)
+            self.open[session.key] = session
+        else:
+            current.merge(session)
+
+
+    def expire(self, now: int = None):
+        """Close the sessions that have been idle for more than 'window' seconds at 'now' (default: the latest event)."""
+        if now is None:
+            now = self.latest
+        if now is None:
+            return
+        for key in [k for k, s in self.open.items() if now - s.last > self.window]:
+            self.closed.append(self.open.pop(key))
+
+
+    def flush(self):
+        """Close all sessions."""
+        self.closed.extend(self.open.values())
+        self.open = {}
+
+
+    def take(self) -> list:
+        """Returns the closed sessions, in the order of their first request, and forgets them."""
+        closed, self.closed = self.closed, []
+        return sorted(closed, key = lambda s: (s.first, s.filename, s.sent))
+
+
+    def take_settled(self) -> tuple:
+        """Returns (sessions, resume). 'resume' is the log position from which the requests must be read again to rebuild the open sessions, or None if there are none, and 'sessions' are the closed sessions that started before it (see take()). Closed sessions that started after it are kept, until they are returned by a later call or discarded with the open sessions. Requires the positions (add())."""
+        resume = min((s.position for s in self.open.values()), default = None)
+        if resume is None:
+            return self.take(), None
+        # A closed session that continues past 'resume' would be rebuilt
+        # only partially. Latest first, so that one pass is enough.
+        for s in sorted(self.closed, key = lambda s: s.position, reverse = True):
+            if s.position < resume <= s.last_position:
+                resume = s.position
+        settled = [s for s in self.closed if s.position < resume]
+        self.closed = [s for s in self.closed if s.position >= resume]
+        return (
+            sorted(settled, key = lambda s: (s.first, s.filename, s.sent)),
+            resume
+        )
+
+
+    @staticmethod
+    def rows(sessions: list) -> tuple:
+        """Returns ('download' rows, 'download_unresolved' rows) of 'sessions'."""
+        rows = []
+        unresolved = []
+        for s in sessions:
+            if s.file_id is None:
+                unresolved.append((s.filename, s.first, s.sent))
+            else:
+                rows.append(
+                    (s.file_id, s.filename, s.first, s.sent, s.complete())
+                )
+        return rows, unresolved
+
+
+# EOF
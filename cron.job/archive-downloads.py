@@ -0,0 +1,272 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Turku University (2020) Department of Future Technologies
+# Course Virtualization / Website / Cron Jobs
+# Move download events of closed months into columnar archive files.
+#
+# archive-downloads.py
+#   2026-10-19  Initial version.
+#   2026-10-19  Month is archived under one write lock (BEGIN IMMEDIATE).
+#   2026-10-19  Rows backfilled into an archived month are merged into it.
+#
+#   - Job added to crontab by 'setup.py'.
+#   - Logging to syslog.
+#   - Must be executed as 'www-data'.
+#
+#
+# FUNCTIONAL DESCRIPTION
+#
+#   Table 'download' grows with every term, while the statistics are served
+#   from the rollup tables (sql/download_statistics.sql). Events of closed
+#   months are kept for later analysis in compact archive files instead
+#   (DownloadArchive.py):
+#
+#   1. Find the months before the last ARCHIVE_AFTER months that have
+#      'download' rows.
+#   2. For each month, oldest first, take the database write lock (BEGIN
+#      IMMEDIATE), select its rows, write them into the archive file
+#      STATE_DIR/download-YYYY-MM.arc, delete the rows and record the
+#      month ('download_archive') and commit.
+#   3. VACUUM the database, so that the file shrinks.
+#
+#   Events of an archived month that are ingested later (backfill of old
+#   logs) are merged into its archive file. Merged file is written next to
+#   the archive ('.merge') and replaces it after the commit. A merge file
+#   that an interrupted run left behind replaces the archive if its events
+#   were recorded, and is removed otherwise. Rollups are not affected by
+#   archiving.
+#
+#   Configuration (CONFIG_FILE, defaults below):
+#       STATE_DIR       Archive directory. Without it, nothing is archived.
+#       ARCHIVE_AFTER   Months kept in 'download' (current month included).
+#
+import os
+import pwd
+import time
+import logging
+import logging.handlers
+import sqlite3
+import calendar
+
+from DownloadArchive    import DownloadArchive
+from JobQueue           import JobRun
+
+# pylint: disable=undefined-variable
+
+# Unprivileged os.nice() values: 0 ... 20 (= lowest priority)
+NICE            = 20
+EXECUTE_AS      = "www-data"
+LOGLEVEL        = logging.INFO  # logging.[DEBUG|INFO|WARNING|ERROR|CRITICAL]
+CONFIG_FILE     = "site.conf" # All instance/site specific values
+# Defaults for site configuration values (if not in CONFIG_FILE)
+STATE_DIR       = None
+ARCHIVE_AFTER   = "13"
+
+SCRIPTNAME = os.path.basename(__file__)
+
+
+
+def read_config_file(cfgfile: str):
+    """Reads (with ConfigParser()) '[Site]' and creates global variables. Argument 'cfgfile' has to be a filename only (not path + file) and the file must exist in the same directory as this script."""
+    cfgfile = os.path.join(
+        os.path.split(os.path.realpath(__file__))[0],
+        cfgfile
+    )
+    if not os.path.exists(cfgfile):
+        raise FileNotFoundError(f"Site configuration '{cfgfile}' not found!")
+    import configparser
+    cfg = configparser.ConfigParser()
+    cfg.optionxform = lambda option: option # preserve case
+    cfg.read(cfgfile)
+    for k, v in cfg.items('Site'):
+        globals()[k] = v
+
+
+
+def month_range(month: str) -> tuple:
+    """Returns UTC epoch (start, end) of 'month' ('YYYY-MM')."""
+    year, mon = (int(v) for v in month.split('-'))
+    return (
+        calendar.timegm((year, mon, 1, 0, 0, 0)),
+        calendar.timegm((year + mon // 12, mon % 12 + 1, 1, 0, 0, 0))
+    )
+
+
+
+def finish_merge(filepath: str, events: int):
+    """Complete or discard a merge that an interrupted run left behind. Merged file ('filepath' + '.merge') replaces the archive if its rows were recorded ('events' of the month in 'download_archive'), otherwise the merge was rolled back and the file is removed."""
+    mergepath = filepath + ".merge"
+    if not os.path.exists(mergepath):
+        return
+    if events is not None and len(DownloadArchive.read(mergepath)) == events:
+        os.replace(mergepath, filepath)
+        log.info(f"Interrupted merge into '{filepath}' completed")
+    else:
+        os.remove(mergepath)
+
+
+
+def archive_month(db: sqlite3.Connection, month: str) -> tuple:
+    """Move the 'download' rows of 'month' into its archive file. Rows of an archived month (backfilled later) are merged into its file. Returns (events, file size)."""
+    start, end = month_range(month)
+    filename = DownloadArchive.filename(month)
+    filepath = os.path.join(STATE_DIR, filename)
+    # Write lock is held from the SELECT to the DELETE, rows inserted in
+    # between would be deleted without being archived
+    if db.in_transaction:
+        db.commit()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        archived = db.execute(
+            "SELECT events FROM download_archive WHERE month = ?",
+            [month]
+        ).fetchone()
+        rows = db.execute(
+            """
+            SELECT  file_id, filename, datetime, size, complete
+            FROM    download
+            WHERE   datetime >= ? AND datetime < ?
+            """,
+            [start, end]
+        ).fetchall()
+        nrows = len(rows)
+        if archived:
+            # Archive is replaced only after the commit (see finish_merge())
+            rows.extend(DownloadArchive.read(filepath).rows())
+            filesize = DownloadArchive.write(filepath + ".merge", month, rows)
+        else:
+            filesize = DownloadArchive.write(filepath, month, rows)
+        db.execute(
+            "DELETE FROM download WHERE datetime >= ? AND datetime < ?",
+            [start, end]
+        )
+        if archived:
+            db.execute(
+                """
+                UPDATE  download_archive
+                SET     events      = ?,
+                        filesize    = ?
+                WHERE   month       = ?
+                """,
+                [len(rows), filesize, month]
+            )
+        else:
+            db.execute(
+                """
+                INSERT INTO download_archive (month, filename, events, filesize)
+                VALUES (?, ?, ?, ?)
+                """,
+                [month, filename, len(rows), filesize]
+            )
+        db.commit()
+    except:
+        db.rollback()
+        raise
+    if archived:
+        os.replace(filepath + ".merge", filepath)
+    return (nrows, filesize)
+
+
+
+def process(db: sqlite3.Connection) -> int:
+    """Archive closed months. Returns the number of events archived. Requires site configuration (read_config_file()) and module global 'log'."""
+    if not STATE_DIR:
+        log.warning("STATE_DIR not configured, nothing archived")
+        return 0
+    with JobRun(db, SCRIPTNAME):
+        for month, filename, events in db.execute(
+            "SELECT month, filename, events FROM download_archive"
+        ).fetchall():
+            finish_merge(os.path.join(STATE_DIR, filename), events)
+        # Start of the oldest month that is kept
+        tm = time.gmtime()
+        year, mon = divmod(tm.tm_year * 12 + tm.tm_mon - int(ARCHIVE_AFTER), 12)
+        cutoff = calendar.timegm((year, mon + 1, 1, 0, 0, 0))
+        months = [
+            row[0] for row in db.execute(
+                """
+                SELECT DISTINCT strftime('%Y-%m', datetime, 'unixepoch')
+                FROM            download
+                WHERE           datetime < ?
+                ORDER BY        1
+                """,
+                [cutoff]
+            )
+        ]
+
+
+        nevents = 0
+        for month in months:
+            t = time.time()
+            n, filesize = archive_month(db, month)
+            log.info(
+                f"{month}: {n} events archived into {filesize / 1024:.1f} kB in {(time.time() - t):.2f} seconds"
+            )
+            nevents += n
+        if nevents:
+            db.execute("VACUUM")
+        return nevents
+
+
+
+###############################################################################
+#
+# MAIN
+#
+###############################################################################
+if __name__ == '__main__':
+
+    #
+    # Be nice, we're not in a hurry
+    #
+    os.nice(NICE)
+
+
+    #
+    # Set up logging
+    #
+    log = logging.getLogger(SCRIPTNAME)
+    log.setLevel(LOGLEVEL)
+    handler = logging.handlers.SysLogHandler(address = '/dev/log')
+    handler.setFormatter(
+        logging.Formatter('%(name)s: [%(levelname)s] %(message)s')
+    )
+    log.addHandler(handler)
+
+    #
+    # Resolve user and require to be executed as EXECUTE_AS
+    #
+    running_as = pwd.getpwuid(os.geteuid()).pw_name
+    if running_as != EXECUTE_AS:
+        log.error(
+           f"This job must be executed as {EXECUTE_AS} (started by user '{running_as}')"
+        )
+        os._exit(-1)
+    else:
+        log.debug(f"Started! (executing as '{running_as}')")
+
+
+    #
+    # Read site specific configuration
+    #
+    try:
+        log.debug(f"Reading site configuration '{CONFIG_FILE}'")
+        read_config_file(CONFIG_FILE)
+    except:
+        log.exception(f"Error reading site configuration '{CONFIG_FILE}'")
+        os._exit(-1)
+
+
+    #
+    # Archive closed months
+    #
+    try:
+        with sqlite3.connect(DATABASE) as db:
+            process(db)
+    except:
+        log.exception("Process failure!")
+        os._exit(-1)
+
+
+# EOF
@@ -0,0 +1,377 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Turku University (2020) Department of Future Technologies
+# Course Virtualization / Website / Cron Jobs
+# Resident background worker that hosts the frequent www-data cron tasks.
+#
+# background-worker.py
+#   2026-10-19  Initial version.
+#   2026-10-19  Signals are blocked only while waiting (Python 3.6).
+#   2026-10-19  PID file (wake-up on upload), shutdown wait is bounded.
+#
+#   - Runs until terminated (SIGTERM). Started by systemd, the unit is
+#     installed by 'setup.py' (see below).
+#   - Logging to syslog.
+#   - Must be executed as 'www-data'.
+#
+#
+# FUNCTIONAL DESCRIPTION
+#
+#   Cron starts a new interpreter for each run of each task, and every run
+#   reads 'site.conf', imports its modules and opens a database connection
+#   again. This daemon loads the task scripts once (as modules) and calls
+#   their process() functions on an internal schedule (TASKS), each with a
+#   database connection that is kept open between the runs.
+#
+#   1. Acquire an exclusive lock on this script file (one instance only)
+#      and write the process ID into STATE_DIR/PIDFILE.
+#   2. Load each script in TASKS and read site configuration for it.
+#   3. Run each task that is due. Task is due again after 'interval'
+#      seconds. If a run did any work, tasks listed in 'then' are due
+#      immediately (an import creates rows that need checksums).
+#   4. Sleep until the next task is due, or a signal arrives.
+#
+#   Task scripts remain usable as one-shot cron jobs. Work is claimed from
+#   the job queue (JobQueue.py), so the daemon and cron jobs can run at the
+#   same time. 'setup.py' installs the service and removes the crontab
+#   entries of the tasks in TASKS. Jobs that are not hosted here stay in
+#   cron ('remove-failed-uploads.py' runs as root).
+#
+#   When an upload completes, the Flask application (api/Flow.py) reads the
+#   PID file (BACKGROUND_WORKER_PIDFILE in 'instance/application.conf') and
+#   wakes this process up with SIGUSR1, so the upload is assembled without
+#   waiting for the next scheduled run.
+#
+# SIGNALS
+#
+#   SIGUSR1     Run all tasks now.
+#   SIGHUP      Read site configuration again.
+#   SIGTERM     Exit after the current task. If the task has not finished
+#   SIGINT      in SHUTDOWN_TIMEOUT seconds, it is interrupted (SystemExit).
+#               Interrupted work is not lost; its job lease expires and the
+#               job is retried.
+#
+#   Signals that arrive while a task is running are recorded by a handler
+#   and acted upon after the task. Between the runs, signals are blocked and
+#   received with sigtimedwait(), so that a signal cannot arrive between
+#   checking for received signals and going to sleep. Processes forked by
+#   the tasks (calculate-checksum.py workers, import-download-folder.py
+#   pool) therefore inherit an unblocked signal mask, and they restore the
+#   default signal handlers themselves.
+#
+# SYSTEMD UNIT
+#
+#   /etc/systemd/system/vm-background-worker.service
+#       [Unit]
+#       Description=vm.utu.fi background worker
+#       After=network.target
+#
+#       [Service]
+#       User=www-data
+#       ExecStart=/var/www/vm.utu.fi/cron.job/background-worker.py
+#       ExecReload=/bin/kill -HUP $MAINPID
+#       Restart=on-failure
+#       TimeoutStopSec=60
+#
+#       [Install]
+#       WantedBy=multi-user.target
+#
+import os
+import pwd
+import sys
+import time
+import fcntl
+import signal
+import logging
+import logging.handlers
+import sqlite3
+import importlib.util
+
+# pylint: disable=undefined-variable
+
+# Unprivileged os.nice() values: 0 ... 20 (= lowest priority)
+NICE            = 20
+EXECUTE_AS      = "www-data"
+LOGLEVEL        = logging.INFO  # logging.[DEBUG|INFO|WARNING|ERROR|CRITICAL]
+CONFIG_FILE     = "site.conf" # All instance/site specific values
+STATE_DIR       = None          # Site configuration
+PIDFILE         = "background-worker.pid"   # In STATE_DIR
+# Seconds a task may run after SIGTERM (less than systemd TimeoutStopSec)
+SHUTDOWN_TIMEOUT = 30
+
+# Hosted task scripts
+#   'interval'  Seconds between runs
+#   'then'      Tasks to run immediately after a run that did some work
+# Completed uploads wake the worker up (SIGUSR1), the interval of
+# 'flow-upload-processor.py' only covers a missed wake-up.
+TASKS = {
+    'flow-upload-processor.py': {
+        'interval': 60,
+        'then':     []
+    },
+    'import-download-folder.py': {
+        'interval': 15 * 60,
+        'then':     ['calculate-checksum.py']
+    },
+    'calculate-checksum.py': {
+        'interval': 5 * 60,
+        'then':     []
+    }
+}
+
+SIGNALS = {signal.SIGUSR1, signal.SIGHUP, signal.SIGTERM, signal.SIGINT}
+
+SCRIPTNAME = os.path.basename(__file__)
+
+# Signals received while a task was running (on_signal())
+received = set()
+
+
+
+def read_config_file(cfgfile: str):
+    """Reads (with ConfigParser()) '[Site]' and creates global variables. Argument 'cfgfile' has to be a filename only (not path + file) and the file must exist in the same directory as this script."""
+    cfgfile = os.path.join(
+        os.path.split(os.path.realpath(__file__))[0],
+        cfgfile
+    )
+    if not os.path.exists(cfgfile):
+        raise FileNotFoundError(f"Site configuration '{cfgfile}' not found!")
+    import configparser
+    cfg = configparser.ConfigParser()
+    cfg.optionxform = lambda option: option # preserve case
+    cfg.read(cfgfile)
+    for k, v in cfg.items('Site'):
+        globals()[k] = v
+
+
+
+def on_signal(signum: int, frame):
+    """Signal handler. Records the signal for the scheduler loop. Termination while a task is running starts the shutdown timeout."""
+    received.add(signum)
+    if signum in (signal.SIGTERM, signal.SIGINT):
+        signal.alarm(int(SHUTDOWN_TIMEOUT))
+
+
+
+def on_alarm(signum: int, frame):
+    """Shutdown timeout. Interrupts the running task (Task.run() does not catch SystemExit)."""
+    raise SystemExit(
+        f"Task did not finish in {SHUTDOWN_TIMEOUT} seconds after termination"
+    )
+
+
+
+def pidfile() -> str:
+    return os.path.join(STATE_DIR, PIDFILE) if STATE_DIR else None
+
+
+
+class Task():
+    """Task script loaded as a module. Keeps its database connection open between the runs."""
+
+    def __init__(self, script: str, interval: int, then: list = []):
+        self.script     = script
+        self.interval   = interval
+        self.then       = then
+        self.next_run   = 0
+        self.db         = None
+        self.module     = self.load(script)
+
+
+    @staticmethod
+    def load(script: str):
+        """Import task script (file names have hyphens, so importlib is needed) and give it a logger."""
+        filepath = os.path.join(
+            os.path.split(os.path.realpath(__file__))[0],
+            script
+        )
+        name = os.path.splitext(script)[0].replace('-', '_')
+        spec = importlib.util.spec_from_file_location(name, filepath)
+        module = importlib.util.module_from_spec(spec)
+        # Registered, so that objects of the module can be pickled
+        # (calculate-checksum.py sends Task objects to its Workers)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+        if not callable(getattr(module, 'process', None)):
+            raise ValueError(f"Task script '{script}' has no process() function!")
+        # Task scripts log through module global 'log'
+        module.log = logging.getLogger(module.SCRIPTNAME)
+        module.log.setLevel(module.LOGLEVEL)
+        module.log.addHandler(handler)
+        return module
+
+
+    def configure(self):
+        """Read (or re-read) site configuration into the module. Reconnects to the database on next run."""
+        self.module.read_config_file(CONFIG_FILE)
+        self.close()
+
+
+    def close(self):
+        if self.db:
+            try:
+                self.db.close()
+            except:
+                pass
+            self.db = None
+
+
+    def run(self) -> int:
+        """Execute task once. Returns the amount of work done (as reported by the task)."""
+        start_time = time.time()
+        self.next_run = start_time + self.interval
+        try:
+            if not self.db:
+                self.db = sqlite3.connect(self.module.DATABASE)
+            done = self.module.process(self.db) or 0
+        except Exception as e:
+            log.exception(f"Task '{self.script}' failed!")
+            # Start with a fresh connection next time
+            self.close()
+            return 0
+        if done:
+            log.debug(
+                f"Task '{self.script}': {done} done in {(time.time() - start_time):.2f} seconds"
+            )
+        return done
+
+
+
+###############################################################################
+#
+# MAIN
+#
+###############################################################################
+if __name__ == '__main__':
+
+    #
+    # Be nice, we're not in a hurry
+    #
+    os.nice(NICE)
+
+
+    #
+    # Set up logging
+    #
+    log = logging.getLogger(SCRIPTNAME)
+    log.setLevel(LOGLEVEL)
+    handler = logging.handlers.SysLogHandler(address = '/dev/log')
+    handler.setFormatter(
+        logging.Formatter('%(name)s: [%(levelname)s] %(message)s')
+    )
+    log.addHandler(handler)
+
+    #
+    # Resolve user and require to be executed as EXECUTE_AS
+    #
+    running_as = pwd.getpwuid(os.geteuid()).pw_name
+    if running_as != EXECUTE_AS:
+        log.error(
+           f"This job must be executed as {EXECUTE_AS} (started by user '{running_as}')"
+        )
+        os._exit(-1)
+    else:
+        log.debug(f"Started! (executing as '{running_as}')")
+
+
+    #
+    # Only one instance (lock is released when the process exits)
+    #
+    lockfile = open(os.path.realpath(__file__), "r")
+    try:
+        fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        log.error("Another instance is already running!")
+        os._exit(-1)
+
+
+    #
+    # Load task scripts and read site specific configuration for each
+    #
+    try:
+        read_config_file(CONFIG_FILE)
+        tasks = {}
+        for script, options in TASKS.items():
+            tasks[script] = Task(script, **options)
+            tasks[script].configure()
+    except:
+        log.exception("Unable to load tasks!")
+        os._exit(-1)
+
+
+    #
+    # Signals are recorded while tasks run (see SIGNALS)
+    #
+    for signum in SIGNALS:
+        signal.signal(signum, on_signal)
+    signal.signal(signal.SIGALRM, on_alarm)
+    log.info(f"Hosting {len(tasks)} tasks: {', '.join(tasks.keys())}")
+
+
+    #
+    # PID file, for the wake-up on completed uploads
+    #
+    if pidfile():
+        try:
+            with open(pidfile(), "w") as file:
+                file.write(f"{os.getpid()}\n")
+        except OSError:
+            log.exception(f"Unable to write PID file '{pidfile()}'!")
+    else:
+        log.warning("STATE_DIR is not configured, uploads do not wake up the worker")
+
+
+    #
+    # Scheduler loop
+    #
+    try:
+        while True:
+            for task in tasks.values():
+                if task.next_run <= time.time():
+                    if task.run():
+                        for name in task.then:
+                            tasks[name].next_run = 0
+            timeout = min(task.next_run for task in tasks.values()) - time.time()
+            # Blocked while waiting, a signal received after the check would
+            # otherwise go unnoticed until the timeout
+            signal.pthread_sigmask(signal.SIG_BLOCK, SIGNALS)
+            if not received and timeout > 0:
+                siginfo = signal.sigtimedwait(SIGNALS, timeout)
+                if siginfo:
+                    received.add(siginfo.si_signo)
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, SIGNALS)
+            if received & {signal.SIGTERM, signal.SIGINT}:
+                log.info(
+                    f"Terminated by signal {min(received & {signal.SIGTERM, signal.SIGINT})}"
+                )
+                break
+            while received:
+                signum = received.pop()
+                if signum == signal.SIGHUP:
+                    log.info("Reading site configuration")
+                    for task in tasks.values():
+                        try:
+                            task.configure()
+                        except:
+                            log.exception(
+                                f"Error reading site configuration for '{task.script}'"
+                            )
+                elif signum == signal.SIGUSR1:
+                    log.info("Running all tasks")
+                    for task in tasks.values():
+                        task.next_run = 0
+    except SystemExit as e:
+        log.warning(f"{str(e)}, interrupted")
+    finally:
+        signal.alarm(0)
+        for task in tasks.values():
+            task.close()
+        if pidfile():
+            try:
+                os.remove(pidfile())
+            except OSError:
+                pass
+
+
+# EOF
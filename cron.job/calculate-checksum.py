@@ -3,7 +3,7 @@
 #
 # Turku University (2020) Department of Future Technologies
 # Course Virtualization / Website / Cron Jobs
-# Calculate SHA1 Checksums for VM Images
+# Calculate Checksums (SHA1, SHA256, BLAKE2b) for VM Images
 #
 # calculate-checksum.py - Jani Tammi <jasata@utu.fi>
 #   2020-01-02  Initial version
@@ -12,44 +12,99 @@
 #   2020-01-03  Slight improvements to error reporting
 #   2020-09-13  Run as 'www-data' instead of root
 #   2020-09-18  Config file now 'site.conf'.
+#   2026-10-19  Work is claimed from the 'job' table (JobQueue.py). Rows are
+#               no longer tagged with a "scheduled on" message.
+#   2026-10-19  Work moved into process(), which 'background-worker.py' calls.
+#   2026-10-19  Run and job metrics recorded (JobRun).
+#   2026-10-19  All CHECKSUMS calculated with one read of the file (Checksum.py).
+#   2026-10-19  Reads no longer evict cached images (Checksum.py, 'cold').
+#   2026-10-19  Workers scheduled per device (DEVICE_WORKERS), smallest first.
+#   2026-10-19  Reuse digests of unchanged files (DigestCache.py, STATE_DIR).
+#   2026-10-19  File that was read is marked verified (scrub-download-folder.py).
+#   2026-10-19  Workers no longer write into the database. Results are
+#               written by the main process in batches, with busy timeout
+#               and retries.
+#   2026-10-19  Reads are charged to IOThrottle.py.
+#   2026-10-19  Jobs are enqueued in one transaction (.enqueue_all()).
+#   2026-10-19  Workers restore default signal handling.
+#   2026-10-19  Workers are terminated if the main process fails.
 #
-#   - Job added to crontab by 'setup.py'.
+#   - Hosted by 'background-worker.py' (service installed by 'setup.py').
 #   - Logging to syslog.
 #   - Must be executed as 'www-data'.
+#   - Can also be run as a one-shot cron job (the worker calls process()).
 #
 #
-#   1) Script SELECTs all 'file' table rows that have NULL 'sha1' column
-#   2) multiprosessing.Queue() is loaded with Task objects (id, filename)
-#      and
-#      'sha1' row is updated with a string about sheduled SHA1 calculation
-#   3) Worker objects created (parallerization)
+#   1) Script SELECTs all 'file' table rows that have NULL value in any of
+#      the CHECKSUMS columns ('sha1', 'sha256', 'blake2b')
+#      and enqueues a 'checksum' job for each (JobQueue.py). Rows that are
+#      already queued or being worked on are left alone.
+#   2) Due jobs are grouped by the device (st_dev) of their file and
+#      sorted by file size. Jobs are claimed (leased) from the job queue one
+#      at the time, smallest file first, only when the device has less than
+#      DEVICE_WORKERS jobs in progress, and Task objects (id, filename,
+#      job_id) are loaded into multiprocessing.Queue().
+#   3) Worker objects created (parallerization), no more than there are
+#      cores or DEVICE_WORKERS for each device.
 #      See "Each Worker"
-#   4) While any Workers exist:
-#       a) Fetch Task from Result Queue
-#       b) If Task.id is NULL, worker exited (decrement alive Worker count)
-#       c) If Task.result is NULL, SHA1 failed (log error)
-#       d) Else SHA1 calculated OK
+#   4) While any jobs are in progress:
+#       a) Fetch Task from Result Queue (renew leases while waiting)
+#       b) If Task.result is NULL, checksums failed (job fails, retried later)
+#       c) Else checksums calculated OK, add Task to the write batch
+#       d) Write the batch, if it has BATCH_SIZE results or its oldest result
+#          has waited BATCH_DELAY seconds (see "Writing results")
+#       e) Claim another job for a device with a free worker, if any
+#   5) Write the remaining batch.
+#   6) Log aggregate throughput (MB/s).
+#   7) Poison pill for each Worker, wait for the Workers to exit.
 #
 #   Each Worker:
 #       1) Fetch Task object from Queue
 #       2) If Task.id (and filename) are not NULL - Execute Task object:
 #           TASK:
-#           - Open file and feed it to hashlib.sha1() in chunks for SHA1
-#           - Update 'file' table 'sha1' column with SHA1 value.
+#           - If the file (device, inode, size, mtime) is in the digest
+#             cache, use the cached digests. Otherwise read file once,
+#             feeding each block to all CHECKSUMS digests (reads charged
+#             to the shared IO throttle), and store the digests into the
+#             cache.
 #           - Return
 #       3) Put Task object into Result Queue
 #       4) If Task was NULL, EXIT. Else goto step 1.
 #
+#   Because job leases are renewed by the main process while it waits for
+#   the results, a crashed run leaves the jobs to expire and the next run
+#   (or a concurrently running instance) will claim them again.
+#
+#   Writing results
+#
+#   The database is shared with the web application and the other cron
+#   jobs. Workers do not have database connections at all - the main
+#   process is the only writer and updates the 'file' table checksum
+#   columns for a whole batch in one transaction (a file that was read is
+#   also marked verified, 'integrity' 'ok'). Jobs are completed after the
+#   batch is committed. The connection waits BUSY_TIMEOUT seconds for a
+#   lock, and a batch that still finds the database locked is retried
+#   BUSY_RETRIES times with exponential backoff before its jobs are failed
+#   (and retried by the job queue later).
+#
 import os
 import pwd
 import sys
+import time
+import signal
 import logging
 import logging.handlers
 import sqlite3
 
+import queue
 import multiprocessing
 from multiprocessing import Process
 
+from JobQueue   import JobQueue, JobRun, LeaseLost
+from Checksum   import Checksum
+from DigestCache import DigestCache
+from IOThrottle import IOThrottle
+
 # pylint: disable=undefined-variable
 
 # Unprivileged os.nice() values: 0 ... 20 (= lowest priority)
@@ -57,12 +112,24 @@ NICE        = 20
 EXECUTE_AS      = "www-data"
 LOGLEVEL        = logging.INFO  # logging.[DEBUG|INFO|WARNING|ERROR|CRITICAL]
 CONFIG_FILE     = "site.conf" # All instance/site specific values
+# Default for site configuration value (if not in CONFIG_FILE)
+CHECKSUMS       = "sha1, sha256, blake2b"
+# Concurrent checksums per device (a spindle or a LUN). Also from CONFIG_FILE.
+DEVICE_WORKERS  = "2"
+# Digest cache directory (DigestCache.py). Also from CONFIG_FILE.
+STATE_DIR       = None
 
 # Settings specific for this script (and, unlikely to change)
 TABLE       = 'file'
 PKCOLUMN    = 'id'
-SHA1COLUMN  = 'sha1'
 NAMECOLUMN  = 'name'
+# Results written in one transaction, at most
+BATCH_SIZE      = 32
+# Seconds a result may wait for the batch to fill
+BATCH_DELAY     = 2
+# Seconds to wait for a database lock, and retries after that
+BUSY_TIMEOUT    = 10
+BUSY_RETRIES    = 5
 
 SCRIPTNAME  = os.path.basename(__file__)
 
@@ -85,61 +152,59 @@ def read_config_file(cfgfile: str):
 
 
 #
-# Task calculates SHA1 for *one* file and nothing else.
+# Task calculates checksums for *one* file and nothing else.
 # Poison pill method is used (NULL work data
 # triggers the Task to exit/"die").
 #
 class Task(object):
     id          = None
     filename    = None
+    job_id      = None
+    algorithms  = None
     result      = None
+    error       = None
+    bytes_read  = 0
+    verified    = None
 
 
     # default as Poison Pill (None values)
-    def __init__(self, id = None, filename = None):
+    def __init__(
+        self,
+        id = None,
+        filename = None,
+        job_id = None,
+        algorithms = None
+    ):
         self.id         = id
         self.filename   = filename
+        self.job_id     = job_id
+        self.algorithms = algorithms
 
 
-    def __call__(self, db):
-        def sha1(filename: str) -> str:
-            """Return SHA1 checksum for given file, in hex format."""
-            import hashlib
-            # BUF_SIZE is totally arbitrary. Anywhere between 64kB and 1MB ??
-            BUF_SIZE = 1024 * 1024
-            sha1 = hashlib.sha1()
-            with open(filename, 'rb') as f:
-                while True:
-                    data = f.read(BUF_SIZE)
-                    if not data:
-                        break
-                    sha1.update(data)
-            return sha1.hexdigest()
-        #    1. Update the row with process number
-        #       This way a long-running calculation is not started again
-        #       for the same missing checksum
-        #    2. Calculate checksum
-        #    3. Update the row with the actual checksum.
-        update = f"UPDATE {TABLE} SET {SHA1COLUMN} = ? WHERE {PKCOLUMN} = ?"
+    def __call__(self, throttle: IOThrottle):
+        # Calculate checksums (one read for all). Result is written into
+        # the database by the main process.
         try:
-            # Using worker's database connection
-            cursor = db.cursor()
-            self.result = sha1(DOWNLOAD_DIR + '/' + self.filename)
-            # Update with actual SHA1 value
-            cursor.execute(update, [self.result, self.id])
-            if cursor.rowcount != 1:
-                raise ValueError("None or too many rows updated!")
+            filepath = os.path.join(DOWNLOAD_DIR, self.filename)
+            with DigestCache(STATE_DIR) as cache:
+                st = os.stat(filepath)
+                self.result = cache.get(st, self.algorithms)
+                if self.result is None:
+                    self.result = Checksum.file(
+                        filepath,
+                        self.algorithms,
+                        progress = throttle.counter()
+                    )
+                    self.bytes_read = st.st_size
+                    self.verified = int(time.time())
+                    if DigestCache.unchanged(st, os.stat(filepath)):
+                        cache.put(st, self.result)
+                    else:
+                        raise ValueError("File was modified while reading!")
         except Exception as e:
-            db.rollback()
             log.exception(f"Task failure for file '{self.filename}'")
-            try:
-                # Restore NULL so that another process will do this
-                cursor.execute(update, [None, self.id])
-            except Exception:
-                pass
-        finally:
-            db.commit()
-            cursor.close()
+            self.result = None
+            self.error  = str(e)
         # In case of an exception, this could still be None
         return self.result
 
@@ -154,7 +219,6 @@ class Task(object):
 
 
 class Worker(multiprocessing.Process):
-    db          = None
     qTask       = None
     qResult     = None
     taskCount   = 0
@@ -172,13 +236,17 @@ class Worker(multiprocessing.Process):
     def run(self):
         # Be nice
         os.nice(NICE)
+        # Handlers and mask inherited from 'background-worker.py' (if hosted)
+        for signum in (signal.SIGUSR1, signal.SIGHUP, signal.SIGTERM, signal.SIGALRM):
+            signal.signal(signum, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.pthread_sigmask(signal.SIG_SETMASK, [])
         log = logging.getLogger(
             os.path.basename(__file__) + ":" + \
             self.__class__.__name__ + "." + \
             sys._getframe().f_code.co_name + "()"
         )
-        # Open connections cannot be shared by different processes
-        self.db = sqlite3.connect(DATABASE)
+        throttle = IOThrottle.from_config(globals())
         while True:
             # Retrieve a Task object (blocks until task becomes available)
             task = self.qTask.get()
@@ -190,8 +258,8 @@ class Worker(multiprocessing.Process):
                 task.result = self.taskCount
                 self.qResult.put(task)
                 break # end while-loop (terminate this worker)
-            # perform the task, using Worker's DB connection
-            r = task(self.db)
+            # perform the task
+            r = task(throttle)
             log.debug(f"{self.name}: {str(task)}")
             self.qResult.put(task)
             self.taskCount += 1
@@ -199,28 +267,260 @@ class Worker(multiprocessing.Process):
         return
 
 
-def tag_file(db, id: int) -> bool:
-    """Write a message into 'sha1' column so that the same row will not be picked up as a task by the next cron job starting."""
-    import datetime
-    success = True
-    sql = f"UPDATE {TABLE} SET {SHA1COLUMN} = ? WHERE {PKCOLUMN} = ?"
-    try:
-        cursor = db.cursor()
-        # Tag the row with PID to "protect" it against
-        # other cron job instances
-        msg = f"SHA1 checksum calculation for this file has been scheduled "
-        msg += f"on {datetime.datetime.now().isoformat()}"
-        cursor.execute(sql, [msg, id])
-        if cursor.rowcount != 1:
-            raise ValueError("None or too many rows updated!")
+def write_results(db: sqlite3.Connection, tasks: list) -> dict:
+    """Update the checksum columns of all 'tasks' in one transaction. Retries BUSY_RETRIES times if the database is locked. Returns {Task.job_id: error} for the tasks that could not be written (row not found) - other errors are raised."""
+    if db.in_transaction:
         db.commit()
-        cursor.close()
-    except Exception as e:
-        db.rollback()
-        success = False
-    finally:
-        cursor.close()
-    return success
+    for attempt in range(BUSY_RETRIES + 1):
+        errors = {}
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            for task in tasks:
+                update  = f"UPDATE {TABLE} SET "
+                update += ", ".join(f"{a} = :{a}" for a in task.algorithms)
+                # Digests that were just calculated also verify the file
+                if task.verified:
+                    update += ", integrity = 'ok', verified = :verified"
+                update += f" WHERE {PKCOLUMN} = :id"
+                cursor = db.execute(
+                    update,
+                    {**task.result, 'id': task.id, 'verified': task.verified}
+                )
+                if cursor.rowcount != 1:
+                    errors[task.job_id] = "None or too many rows updated!"
+            db.commit()
+            return errors
+        except sqlite3.OperationalError as e:
+            db.rollback()
+            if attempt >= BUSY_RETRIES or \
+               not any(s in str(e) for s in ('locked', 'busy')):
+                raise
+            delay = 0.1 * 2 ** attempt
+            log.warning(
+                f"Database is locked, retrying in {delay:.1f} seconds ({len(tasks)} results)"
+            )
+            time.sleep(delay)
+
+
+
+def schedule(due: list) -> dict:
+    """Group due jobs by the device their file is on. Returns {st_dev: [(size, target, name), ...]}, each list sorted largest first (so that list.pop() returns the smallest). Files that cannot be stat()'ed are grouped under None - the worker will fail them with a proper error."""
+    devices = {}
+    for target, payload in due:
+        try:
+            st = os.stat(os.path.join(DOWNLOAD_DIR, payload['name']))
+            device, size = st.st_dev, st.st_size
+        except OSError:
+            device, size = None, 0
+        devices.setdefault(device, []).append((size, target, payload['name']))
+    for tasks in devices.values():
+        tasks.sort(reverse = True)
+    return devices
+
+
+
+def process(db: sqlite3.Connection) -> int:
+    """Enqueue and execute 'checksum' jobs until none are due. Returns the number of checksums calculated. Requires site configuration (read_config_file()) and module global 'log'."""
+    algorithms = Checksum.parse(CHECKSUMS)
+    per_device = int(DEVICE_WORKERS)
+    db.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT * 1000}")
+    select = f"SELECT {PKCOLUMN}, {NAMECOLUMN} FROM {TABLE} "
+    select += "WHERE " + " OR ".join(f"{a} IS NULL" for a in algorithms)
+    with JobRun(db, SCRIPTNAME) as run:
+        jobs = JobQueue(db, 'checksum', run = run)
+        jobs.enqueue_all(
+            {id: {'name': name} for id, name in db.execute(select).fetchall()}
+        )
+        pending = schedule(jobs.due())
+        ntasks = sum(len(tasks) for tasks in pending.values())
+        ndevices = len(pending)
+        ncompleted = 0
+        if ntasks:
+            start_time = time.time()
+            nbytes = {}             # {device: bytes read}
+            #
+            # There is work to do! Create taskqueue
+            #
+            q_task      = multiprocessing.Queue()
+            q_result    = multiprocessing.Queue()
+
+
+            # Checksums are disk bound. Start no more than DEVICE_WORKERS
+            # workers per device, and no more than there are cores.
+            nworkers = min(
+                multiprocessing.cpu_count(),
+                sum(min(per_device, len(t)) for t in pending.values())
+            )
+
+
+            #
+            # Claim a job only when its device has a free worker, smallest
+            # file first. Jobs on other devices are not held up, and neither
+            # are small files by a large one. Unclaimed jobs remain in the
+            # job queue for another instance of this script.
+            #
+            inflight = {}           # {job.id: (Job, device)}
+            active = {}             # {device: number of jobs in progress}
+            def dispatch():
+                for device in list(pending):
+                    tasks = pending[device]
+                    while tasks and \
+                          active.get(device, 0) < per_device and \
+                          len(inflight) < nworkers:
+                        size, target, name = tasks.pop()
+                        claimed = jobs.claim(targets = [target])
+                        if not claimed:
+                            # Claimed by another instance
+                            continue
+                        job = claimed[0]
+                        inflight[job.id] = (job, device)
+                        active[device] = active.get(device, 0) + 1
+                        q_task.put(
+                            Task(int(job.target), name, job.id, algorithms)
+                        )
+                    if not tasks:
+                        del pending[device]
+            dispatch()
+
+
+            #
+            # Create and start the workers
+            #
+            log.info(
+                f"Creating {nworkers} workers for {ntasks} tasks on {ndevices} devices ({per_device} per device)"
+            )
+            workers = [Worker(q_task, q_result) for _ in range(nworkers)]
+            for worker in workers:
+                worker.start()
+
+
+            try:
+                #
+                # Results are written in batches (see "Writing results").
+                # Jobs are completed only after their results are committed.
+                #
+                batch = []              # [(Job, Task, time received)]
+                def flush():
+                    try:
+                        errors = write_results(db, [task for _, task, _ in batch])
+                    except Exception as e:
+                        log.exception(f"Unable to write {len(batch)} results!")
+                        errors = {task.job_id: str(e) for _, task, _ in batch}
+                    for job, task, _ in batch:
+                        if task.job_id in errors:
+                            job.fail(errors[task.job_id])
+                            log.error(
+                                f"Checksums for ID {task.id} '{task.filename}' not written! ({str(job)})"
+                            )
+                        else:
+                            try:
+                                job.complete()
+                            except LeaseLost:
+                                log.error(f"Lease lost before completion ({str(job)})")
+                                continue
+                            log.info(
+                                f"File '{task.filename}' " + ", ".join(
+                                    f"{a.upper()}: {d}" for a, d in task.result.items()
+                                )
+                            )
+                    batch.clear()
+
+
+                #
+                # Loop until all claimed jobs are finished and written, or we
+                # receive ABORT command. Job leases are renewed while we wait.
+                #
+                # Queue can be inserted with strings as well as Task objects.
+                # We use strings to signal commands.
+                #
+                while inflight or batch:
+                    for job, _ in inflight.values():
+                        job.heartbeat()
+                    if batch and (
+                        not inflight or
+                        len(batch) >= BATCH_SIZE or
+                        time.time() - batch[0][2] >= BATCH_DELAY
+                    ):
+                        flush()
+                        continue
+                    try:
+                        q_item = q_result.get(
+                            timeout = BATCH_DELAY if batch else jobs.heartbeat
+                        )
+                    except queue.Empty:
+                        continue
+                    if isinstance(q_item, str):
+                        if q_item == 'ABORT':
+                            log.debug("ABORT command received")
+                            # TODO: Worker.terminate() all - but how?
+                            flush()
+                            break
+                        else:
+                            # log and ignore
+                            log.error(
+                                f"Received unsupported command '{q_item}'"
+                            )
+                        continue
+                    job, device = inflight.pop(q_item.job_id)
+                    active[device] -= 1
+                    job.bytes_read = q_item.bytes_read
+                    nbytes[device] = nbytes.get(device, 0) + q_item.bytes_read
+                    if q_item.result is None:
+                        # None result = failure! Retried later.
+                        job.fail(q_item.error)
+                        log.error(
+                            f"Checksums for ID {q_item.id} '{q_item.filename}' failed! ({str(job)})"
+                        )
+                    else:
+                        # Successful checksum calculation, to be written
+                        batch.append((job, q_item, time.time()))
+                    dispatch()
+
+
+                #
+                # Add one Poison Pill for each worker (None value Task)
+                # Worker exit is signaled by insertion of Task.id = None
+                #
+                for _ in range(nworkers):
+                    q_task.put(Task())
+                while nworkers:
+                    q_item = q_result.get()
+                    if isinstance(q_item, Task) and q_item.id is None:
+                        nworkers -= 1
+                        ncompleted += q_item.result
+                        log.debug(
+                            f"Worker exited after completing {q_item.result} tasks"
+                        )
+            except:
+                # Lost lease, database error or termination (SystemExit).
+                # Workers would wait for tasks forever. Their jobs are
+                # retried when the leases expire.
+                q_task.cancel_join_thread()
+                for worker in workers:
+                    worker.terminate()
+                raise
+            finally:
+                for worker in workers:
+                    worker.join()
+
+
+            elapsed = time.time() - start_time
+            for device, n in nbytes.items():
+                log.debug(
+                    f"Device {device}: {n / 1048576:.1f} MB ({n / 1048576 / elapsed:.1f} MB/s)"
+                )
+            total = sum(nbytes.values())
+            log.info(
+                f"{ncompleted} checksums calculated, {total / 1048576:.1f} MB in {elapsed:.2f} seconds ({total / 1048576 / elapsed:.1f} MB/s). Exiting..."
+            )
+        else: # ntasks = 0
+            log.info("None of the files need checksums to be calculated. Bye!")
+    with DigestCache(STATE_DIR) as cache:
+        n = cache.purge()
+        if n:
+            log.info(f"{n} unused entries removed from the digest cache")
+    return ncompleted
+
 
 
 if __name__ == '__main__':
@@ -265,95 +565,9 @@ if __name__ == '__main__':
     #
     # Actual work
     #
-    select = f"SELECT {PKCOLUMN}, {NAMECOLUMN} FROM {TABLE} "
-    select += f"WHERE {SHA1COLUMN} IS NULL"
     try:
         with sqlite3.connect(DATABASE) as db:
-            selcur = db.cursor()
-            result = selcur.execute(select).fetchall()
-            ntasks = len(result)
-            ncompleted = 0
-            if ntasks:
-                #
-                # There is work to do! Create taskqueue
-                #
-                q_task      = multiprocessing.Queue()
-                q_result    = multiprocessing.Queue()
-                for id, name,  in result:
-                    if tag_file(db, id):
-                        q_task.put(Task(id, name))
-                    else:
-                        log.error(
-                            f"Could not tag and queue ID {id}, file '{name}'!"
-                        )
-
-
-                # Start only as many workers as there are tasks
-                # or as many as there are cores, which ever is less.
-                nworkers = min(
-                    multiprocessing.cpu_count(),
-                    ntasks
-                )
-                #
-                # Add one Poison Pill for each worker (None value Task)
-                #
-                for _ in range(nworkers):
-                    q_task.put(Task())
-
-
-                #
-                # Create and start the workers
-                #
-                log.info(
-                    f"Creating {nworkers} workers for {ntasks} tasks"
-                )
-                workers = [Worker(q_task, q_result) for _ in range(nworkers)]
-                for worker in workers:
-                    worker.start()
-
-
-                #
-                # Loop until all Workers exit or we receive ABORT command.
-                #
-                # Worker exit is signaled by insertion of Task.result = None
-                #
-                # Queue can be inserted with strings as well as Task objects.
-                # We use strings to signal commands.
-                #
-                while nworkers:
-                    q_item = q_result.get()
-                    if isinstance(q_item, str):
-                        if q_item == 'ABORT':
-                            log.debug("ABORT command received")
-                            # TODO: Worker.terminate() all - but how?
-                            break
-                        else:
-                            # log and ignore
-                            log.error(
-                                f"Received unsupported command '{q_item}'"
-                            )
-                    elif q_item.id is None:
-                        # Worker exited, passing the poison pill to result queue
-                        nworkers -= 1
-                        ncompleted += q_item.result
-                        log.debug(
-                            f"Worker exited after completing {q_item.result} tasks"
-                        )
-                    elif q_item.result is None:
-                        # Was not poison pill, and None result = failure!
-                        log.error(
-                            f"SHA1 for ID {q_item.id} '{q_item.filename}' failed!"
-                        )
-                    else:
-                        # Successful SHA1 calculation
-                        log.info(
-                            f"File '{q_item.filename}' SHA1: {q_item.result}"
-                        )
-                log.info(f"{ncompleted} checksums calculated. Exiting...")
-            else: # ntasks = 0
-                log.info("None of the files need SHA1 to be calculated. Bye!")
-
-
+            process(db)
     except Exception as e:
         log.exception("Process failure! Database might need manual clean-up!")
         os._exit(-1)
@@ -13,19 +13,48 @@
 #   2020-09-13  Site specific configurations now read from CONFIG_FILE.
 #   2020-09-18  Config file now 'site.conf'.
 #   2020-09-23  Add SHA1 calculation
+#   2026-10-19  Jobs are claimed from the 'job' table (JobQueue.py) instead
+#               of renaming '.job' files.
+#   2026-10-19  Assembly progress published into the job row.
+#   2026-10-19  Single chunk uploads are hard linked, not copied.
+#   2026-10-19  allocate() reserves space with posix_fallocate().
+#   2026-10-19  Work moved into process(), which 'background-worker.py' calls.
+#   2026-10-19  Run and job metrics recorded (JobRun).
+#   2026-10-19  Calculate all CHECKSUMS with one read (Checksum.py).
+#   2026-10-19  New image is dropped from the page cache after checksums.
+#   2026-10-19  Digests of new images are stored into DigestCache.py.
+#   2026-10-19  Image with checksums is inserted as verified ('integrity').
+#   2026-10-19  Assembly and checksum IO charged to IOThrottle.py.
+#   2026-10-19  Image assembled by a crashed attempt is not assembled again.
+#   2026-10-19  Chunks are assembled into a '.partial' file, which is
+#               published with a hard link (existing image is never removed).
 #
-#   - Job added to crontab by 'setup.py'.
+#   - Hosted by 'background-worker.py' (service installed by 'setup.py').
 #   - Logging to syslog.
 #   - Must be executed as 'www-data'.
+#   - Can also be run as a one-shot cron job (the worker calls process()).
 #
 #
 # FUNCTIONAL DESCRIPTION
 #
-#   1. Scan UPLOAD_DIR for '.job' files (completed Flow.js uploads).
-#   2. Add '.{PID}' suffix to each '.job' file to reserve them for this task.
+#   1. Scan UPLOAD_DIR for '.job' files (completed Flow.js uploads) and
+#      enqueue an 'assemble' job for each (existing jobs are left alone).
+#   2. Claim one 'assemble' job at the time from the job queue.
 #   3. Read '.job' JSON and assemble file into DOWNLOAD_DIR
 #   4. Try extracting .OVA information.
 #   5. Insert database entry.
+#   6. Mark the job done (or failed, which schedules a retry with backoff).
+#
+#   Claimed jobs are leased. Assembly renews the lease while copying and if
+#   this process crashes, the lease expires and the next run will retry the
+#   job. Several instances of this script can run at the same time. Chunks
+#   are copied into DOWNLOAD_DIR/.{flowid}.partial, which is published as
+#   the image with os.link() (fails if the image name is already taken).
+#   A retry removes only the '.partial' file of its own job. Chunks and then
+#   the '.partial' file are removed only after the image is published, so a
+#   retry that finds the image (of the expected size) and no chunks, or
+#   finds the image to be the same file as the chunk or '.partial' file,
+#   continues from step 4.
 #
 #
 #   If there will be a post-Flow update page that monitors / waits until this
@@ -40,13 +69,18 @@
 import os
 import pwd
 import json
+import errno
 import glob
 import time
 import logging
 import logging.handlers
 import sqlite3
 
-from OVFData import OVFData
+from OVFData    import OVFData
+from JobQueue   import JobQueue, JobRun, LeaseLost
+from Checksum   import Checksum
+from DigestCache import DigestCache
+from IOThrottle import IOThrottle
 
 # pylint: disable=undefined-variable
 
@@ -55,6 +89,12 @@ NICE            = 20
 EXECUTE_AS      = "www-data"
 LOGLEVEL        = logging.INFO  # logging.[DEBUG|INFO|WARNING|ERROR|CRITICAL]
 CONFIG_FILE     = "site.conf" # All instance/site specific values
+# Default for site configuration value (if not in CONFIG_FILE)
+CHECKSUMS       = "sha1, sha256, blake2b"
+# Digest cache directory (DigestCache.py). Also from CONFIG_FILE.
+STATE_DIR       = None
+# Free space that must remain in DOWNLOAD_DIR after allocating an image
+RESERVED_SPACE  = 1024 * 1024 * 1024
 
 SCRIPTNAME = os.path.basename(__file__)
 
@@ -103,18 +143,39 @@ def allocate(filename: str, size: int) -> str:
     )
 
 
-    # Create empty target file
-    # 1. Create new file
-    # 2. seek to size-1 byte position
-    # 3. write 1 byte
-    # NOTE: Will NOT work as expected in some systems/filesystems
-    #       Linux + ReiserFS will NOT allocate all the space,
-    #       although it APPEARS that the file is as big as it should.
+    #
+    # Preflight: Refuse to start an assembly that cannot complete
+    #
+    fs = os.statvfs(DOWNLOAD_DIR)
+    available = fs.f_bavail * fs.f_frsize
+    if available - size < RESERVED_SPACE:
+        raise OSError(
+            errno.ENOSPC,
+            f"Not enough free space for {size} bytes in '{DOWNLOAD_DIR}' ({available} bytes available, {RESERVED_SPACE} reserved)"
+        )
+
+
+    # Reserve the blocks for the whole file. Unlike a sparse file (seek to
+    # size - 1 and write one byte), this fails now instead of halfway through
+    # the assembly, and lets the filesystem allocate contiguous extents
+    # (better sendfile() throughput for the downloads).
+    # Open with "xb" - fails if the file was created after the check above.
     try:
-        with open(filepath, "wb") as f:
-            f.seek(size - 1)
-            f.write(b"\0")
+        with open(filepath, "xb") as f:
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+            except OSError as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                    raise
+                # Filesystem does not support allocation, create sparse file
+                log.warning(
+                    f"allocate(): posix_fallocate() not supported for '{filepath}', creating sparse file"
+                )
+                f.seek(size - 1)
+                f.write(b"\0")
         log.debug(f"allocate(): {filepath} {size} bytes")
+    except FileExistsError:
+        raise ValueError(f"File '{filepath}' already exists!") from None
     except Exception as e:
         # If the file was created, remove it
         try:
@@ -126,16 +187,72 @@ def allocate(filename: str, size: int) -> str:
     return filepath
 
 
-def assemble_file(job: dict) -> str:
-    """Assembles flow chunks into a VM image file. Returns full filepath as received from allocate()."""
+def link_chunk(srcname: str, filename: str) -> str:
+    """Publish a single chunk file as 'filename' into DOWNLOAD_DIR by creating a hard link. Returns full filepath, or None if UPLOAD_DIR and DOWNLOAD_DIR are not in the same filesystem."""
+    filepath = os.path.join(DOWNLOAD_DIR, filename)
+    if os.stat(UPLOAD_DIR).st_dev != os.stat(DOWNLOAD_DIR).st_dev:
+        return None
+    # os.link() fails if the target exists (os.rename() would replace it),
+    # which makes the publish atomic and conflict-safe.
+    try:
+        os.link(srcname, filepath)
+    except FileExistsError:
+        raise ValueError(f"File '{filepath}' already exists!") from None
+    except OSError as e:
+        # EXDEV (bind mounts), EPERM (fs.protected_hardlinks), ...
+        log.debug(f"link_chunk(): Cannot link '{srcname}' ({str(e)})")
+        return None
+    log.debug(f"link_chunk(): '{srcname}' -> '{filepath}'")
+    return filepath
+
+
+def partial_name(flowid: str) -> str:
+    """Name of the file in DOWNLOAD_DIR into which the chunks of upload 'flowid' are assembled. Hidden and without an ALLOWED_EXT extension, so that 'import-download-folder.py' does not import it."""
+    return f".{flowid}.partial"
+
+
+def assemble_file(
+    job: dict,
+    progress = lambda done, total: None,
+    throttle: IOThrottle = None
+) -> str:
+    """Assembles flow chunks into a VM image file. Returns full filepath. Optional 'progress' callable is called with bytes written and total bytes after each written block (to publish progress and renew the job lease). Copied bytes (read and written) are charged to 'throttle', if given."""
     chunks = glob.glob(os.path.join(UPLOAD_DIR, f"{job['flowid']}.[0-9]*"))
     BLKSIZE = 1024 * 1024
+    #
+    # Fast path: Upload consists of one complete chunk. Nothing to assemble,
+    # the chunk file is linked into DOWNLOAD_DIR (if on the same filesystem).
+    #
+    if len(chunks) == 1 and os.stat(chunks[0]).st_size == job['size']:
+        try:
+            tgtname = link_chunk(chunks[0], job['filename'])
+        except Exception as e:
+            try:
+                errfilepath = os.path.join(UPLOAD_DIR, f"{job['flowid']}.error")
+                with open(errfilepath, "w") as errorfile:
+                    errorfile.write(str(e))
+            except:
+                pass
+            raise e
+        if tgtname:
+            os.remove(chunks[0])
+            progress(job['size'], job['size'])
+            return tgtname
+    #
+    # Chunks are copied into a partial file, which is owned by this job, and
+    # published with os.link(), which fails if the target exists. A retry can
+    # remove the partial file, but never the image (it may not be ours).
+    #
+    filepath = os.path.join(DOWNLOAD_DIR, job['filename'])
     total = 0       # Total bytes written into target file
     # allocate raises an exception, if it fails -> terminates this function.
     try:
-        tgtname = allocate(job['filename'], job['size'])
+        if exists(filepath):
+            raise ValueError(f"File '{filepath}' already exists!")
+        tgtname = allocate(partial_name(job['flowid']), job['size'])
         try:
-            with open(tgtname, 'wb') as tgt:
+            # "r+b", because "wb" would truncate the allocated file
+            with open(tgtname, 'r+b') as tgt:
                 #for cnknum in range (1, job['chunks'] + 1):
                 for srcname in sorted(chunks):
                     log.debug(f"write chunk '{srcname}' to '{tgtname}'")
@@ -151,6 +268,18 @@ def assemble_file(job: dict) -> str:
                             tgt.seek(total)
                             tgt.write(src.read(readsize))
                             total += readsize
+                            if throttle:
+                                throttle.consume(2 * readsize)
+                            progress(total, job['size'])
+                if total != job['size']:
+                    raise ValueError(
+                        f"Chunks contain {total} bytes, expected {job['size']}!"
+                    )
+            try:
+                os.link(tgtname, filepath)
+            except FileExistsError:
+                raise ValueError(f"File '{filepath}' already exists!") from None
+            log.debug(f"assemble_file(): '{tgtname}' -> '{filepath}'")
         except Exception as e:
             # Remove whatever we managed to create until exception
             try:
@@ -161,15 +290,19 @@ def assemble_file(job: dict) -> str:
     except Exception as e:
         try:
             # Dump exception to an error file
-            with open(f"{job['flowid']}.error", "w") as errorfile:
+            errfilepath = os.path.join(UPLOAD_DIR, f"{job['flowid']}.error")
+            with open(errfilepath, "w") as errorfile:
                 errorfile.write(str(e))
         except:
             pass
         raise e
     else:
+        # Partial file is removed last, a retry recognizes the published
+        # image by it (or by the chunks)
         for srcname in chunks:
             os.remove(srcname)
-    return tgtname
+        os.remove(tgtname)
+    return filepath
 
 
 
@@ -236,19 +369,216 @@ def basic_attributes(filepath: str) -> dict:
 
 
 
-def sha1(filepath: str) -> str:
-    """Return SHA1 checksum for given file, in hex format."""
-    import hashlib
-    # BUF_SIZE is totally arbitrary. Anywhere between 64kB and 1MB ??
-    BUF_SIZE = 1024 * 1024
-    sha1 = hashlib.sha1()
-    with open(filepath, 'rb') as f:
+def process(db: sqlite3.Connection) -> int:
+    """Enqueue and execute 'assemble' jobs until none are due. Returns the number of jobs executed. Requires site configuration (read_config_file()) and module global 'log'."""
+    start_time = time.time()
+    throttle = IOThrottle.from_config(globals())
+
+
+    with JobRun(db, SCRIPTNAME) as run:
+        #
+        # Enqueue an 'assemble' job for each '.job' file
+        #
+        log.debug(f"Looking for jobs in '{UPLOAD_DIR}'")
+        try:
+            queue = JobQueue(db, 'assemble', run = run)
+            for jobfilepath in glob.glob(os.path.join(UPLOAD_DIR, "*.job")):
+                flowid = os.path.basename(jobfilepath)[:-len(".job")]
+                if queue.enqueue(flowid):
+                    log.debug(f"Job '{flowid}' queued")
+        except Exception as e:
+            log.exception("Job queueing failed!")
+            raise
+
+
+        #
+        # Execute jobs
+        #
+        n_jobs = 0
+        n_success = 0
         while True:
-            data = f.read(BUF_SIZE)
-            if not data:
+            try:
+                claimed = queue.claim()
+            except Exception as e:
+                log.exception("Unable to claim a job!")
+                break
+            if not claimed:
                 break
-            sha1.update(data)
-    return sha1.hexdigest()
+            qjob = claimed[0]
+            n_jobs += 1
+            job = {}
+            job_start_time = time.time()
+            jobfilename = os.path.join(UPLOAD_DIR, f"{qjob.target}.job")
+
+
+            #
+            #   Concatenate chunks into an image file
+            #
+            try:
+                with open(jobfilename, "r") as jsonfile:
+                    job = json.load(jsonfile)
+                #log.debug(str(job))
+                # (Flow.file_exists prevents uploads over existing images and
+                # chunks are removed only after the image is complete)
+                target = os.path.join(DOWNLOAD_DIR, job['filename'])
+                partial = os.path.join(DOWNLOAD_DIR, partial_name(qjob.target))
+                chunks = glob.glob(os.path.join(UPLOAD_DIR, f"{qjob.target}.[0-9]*"))
+                if exists(target) and any(
+                    exists(f) and os.path.samefile(f, target)
+                    for f in chunks + [partial]
+                ):
+                    # A previous attempt published the image (it is a link
+                    # to the partial file or to the single chunk), but
+                    # crashed before removing the chunks
+                    log.info(f"Image '{target}' was published by a previous attempt")
+                    for f in chunks + [partial]:
+                        if exists(f):
+                            os.remove(f)
+                    chunks = []
+                if not chunks and \
+                   exists(target) and os.stat(target).st_size == job['size']:
+                    # A previous attempt assembled the image, but crashed
+                    # before the '.job' file was removed
+                    log.info(f"Image '{target}' was assembled by a previous attempt")
+                    vmfile = target
+                else:
+                    # A crashed previous attempt may have left its partial
+                    # file behind (the image itself is never removed)
+                    if exists(partial):
+                        log.info(f"Removing partial file '{partial}' of a previous attempt")
+                        os.remove(partial)
+                    # Single chunk is linked, not copied (see assemble_file())
+                    chunk_ino = os.stat(chunks[0]).st_ino if len(chunks) == 1 else None
+                    # vmfile will be full filepath
+                    vmfile = assemble_file(job, qjob.progress, throttle)
+                    qjob.bytes_read = job['size']
+                    if os.stat(vmfile).st_ino != chunk_ino:
+                        qjob.bytes_written = job['size']
+            except Exception as e:
+                log.error(
+                    f"Assembly of '{job.get('filename', '(null)')}' failed ({str(qjob)})! See error file for details."
+                )
+                log.debug(f"Exception: {str(e)}")
+                qjob.fail(str(e))
+                # Try next
+                continue
+            else:
+                # Chunks assembled into image, '.job' can also be removed
+                os.remove(jobfilename)
+                # ...and error file from a failed previous attempt
+                errfilename = os.path.join(UPLOAD_DIR, f"{qjob.target}.error")
+                if exists(errfilename):
+                    os.remove(errfilename)
+
+
+            #
+            # Get attributes
+            #
+            _, ext = os.path.splitext(vmfile)
+            # Required attributes
+            data = basic_attributes(vmfile)
+            # Add 'owner'
+            data['owner'] = job['owner']
+            # .OVF attributes, if an '.ova' file
+            if ext.lower() == '.ova':
+                try:
+                    ovfdata = ova_attributes(vmfile)
+                except:
+                    log.error(f".OVF extraction failed from {vmfile}!")
+                else:
+                    # Merge, 'ovfdata' overwrites values in 'data' dictionary
+                    data = {**data, **ovfdata}
+
+
+            #
+            # Calculate checksums (one read for all algorithms)
+            # Image was just written and is not yet served to anyone, its
+            # pages would only evict images that Nginx is serving.
+            # Digests are cached, so that re-importing the image later
+            # (import-download-folder.py) does not read it again.
+            #
+            try:
+                st = os.stat(vmfile)
+                digests = Checksum.file(
+                    vmfile,
+                    Checksum.parse(CHECKSUMS),
+                    'drop',
+                    throttle.counter()
+                )
+                data.update(digests)
+                data['integrity'] = 'ok'
+                data['verified'] = int(time.time())
+                qjob.bytes_read += data['size']
+                if DigestCache.unchanged(st, os.stat(vmfile)):
+                    with DigestCache(STATE_DIR) as cache:
+                        cache.put(st, digests)
+            except:
+                log.exception("Error while calculating checksums")
+                # we can ignore this, backgroud task will take care of it
+
+
+            #
+            # Parse SQL
+            #
+            try:
+                sql  = f"INSERT INTO file ({','.join(data.keys())}) "
+                sql += f"VALUES (:{',:'.join(data.keys())})"
+            except Exception as e:
+                log.exception("Error parsing SQL!")
+                # Chunks are gone, a retry cannot succeed
+                try:
+                    qjob.complete()
+                except LeaseLost:
+                    log.error(f"Lease lost before completion ({str(qjob)})")
+                continue
+            #
+            # Insert record
+            #
+            try:
+                try:
+                    cursor = db.cursor()
+                    cursor.execute(sql, data)
+                    # Get AUTOINCREMENT PK
+                    file_id = cursor.lastrowid
+                    cursor.connection.commit()
+                except sqlite3.IntegrityError as e:
+                    cursor.connection.rollback()
+                    log.error(
+                        f"sqlite3.IntegrityError! SQL: {sql}, data: {str(data)}"
+                    )
+                    raise e
+                except Exception as e:
+                    cursor.connection.rollback()
+                    log.error("Non-SQL error!")
+                    raise e
+            except Exception as e:
+                log.debug(str(e))
+                log.error("Error while inserting 'file' row!")
+                # Image exists in DOWNLOAD_DIR, 'import-download-folder.py'
+                # will create the row. Assembly itself is done.
+                try:
+                    qjob.complete()
+                except LeaseLost:
+                    log.error(f"Lease lost before completion ({str(qjob)})")
+                # Jump to the ext job
+                continue
+            else:
+                try:
+                    qjob.complete()
+                except LeaseLost:
+                    log.error(f"Lease lost before completion ({str(qjob)})")
+                    continue
+                n_success += 1
+                # report time
+                log.info(
+                    f"{job['filename']} (file_id: {file_id}): {(time.time() - job_start_time):.2f} seconds"
+                )
+
+        if n_jobs:
+            log.info(
+                f"{n_success}/{n_jobs} files processed, execution time {(time.time() - start_time):.2f} seconds"
+            )
+        return n_jobs
 
 
 
@@ -259,7 +589,6 @@ def sha1(filepath: str) -> str:
 ###############################################################################
 if __name__ == '__main__':
 
-    script_start_time = time.time()
     #
     # Be nice, we're not in a hurry
     #
@@ -303,127 +632,14 @@ if __name__ == '__main__':
 
 
     #
-    # Compile list of '.job' files and reserve them
+    # Enqueue and execute jobs
     #
-    log.debug(f"Looking for jobs in '{UPLOAD_DIR}'")
-    pid = os.getpid()
-    jobs = []
     try:
-        os.chdir(UPLOAD_DIR)
-        for jobfilename in glob.glob(os.path.join(UPLOAD_DIR, "*.job")):
-            jobs.append(f"{jobfilename}.{pid}")
-            os.rename(jobfilename, jobs[-1])
-    except Exception as e:
-        log.exception("Job list creation failed!")
+        with sqlite3.connect(DATABASE) as db:
+            process(db)
+    except:
+        log.exception("Process failure!")
         os._exit(-1)
-    else:
-        log.debug(f"Job list has {len(jobs)} tasks")
-
-
-    #
-    # Execute jobs
-    #
-    job = {}
-    n_success = 0
-    for jobfilename in jobs:
-        job_start_time = time.time()
-
 
-        #
-        #   Concatenate chunks into an image file
-        #
-        try:
-            with open(jobfilename, "r") as jsonfile:
-                job = json.load(jsonfile)
-            #log.debug(str(job))
-            # vmfile will be full filepath
-            vmfile = assemble_file(job)
-        except Exception as e:
-            log.error(
-                f"Assembly of '{job.get('filename', '(null)')}' failed! See error file for details."
-            )
-            log.debug(f"Exception: {str(e)}")
-            # Try next
-            continue
-        else:
-            # Chunks assembled into image, '.job' can also be removed
-            os.remove(jobfilename)
-
-
-        #
-        # Get attributes
-        #
-        _, ext = os.path.splitext(vmfile)
-        # Required attributes
-        data = basic_attributes(vmfile)
-        # Add 'owner'
-        data['owner'] = job['owner']
-        # .OVF attributes, if an '.ova' file
-        if ext.lower() == '.ova':
-            try:
-                ovfdata = ova_attributes(vmfile)
-            except:
-                log.error(f".OVF extraction failed from {vmfile}!")
-            else:
-                # Merge, 'ovfdata' overwrites values in 'data' dictionary
-                data = {**data, **ovfdata}
-
-
-        #
-        # Calculate SHA1 checksum
-        #
-        try:
-            data['sha1'] = sha1(vmfile)
-        except:
-            log.exception("Error while calculating SHA1")
-            # we can ignore this, backgroud task will take care of it
-
-
-        #
-        # Parse SQL
-        #
-        try:
-            sql  = f"INSERT INTO file ({','.join(data.keys())}) "
-            sql += f"VALUES (:{',:'.join(data.keys())})"
-        except Exception as e:
-            log.exception("Error parsing SQL!")
-            continue
-        #
-        # Insert record
-        #
-        try:
-            with sqlite3.connect(DATABASE) as db:
-                try:
-                    cursor = db.cursor()
-                    cursor.execute(sql, data)
-                    # Get AUTOINCREMENT PK
-                    file_id = cursor.lastrowid
-                    cursor.connection.commit()
-                except sqlite3.IntegrityError as e:
-                    cursor.connection.rollback()
-                    log.error(
-                        f"sqlite3.IntegrityError! SQL: {sql}, data: {str(data)}"
-                    )
-                    raise e
-                except Exception as e:
-                    cursor.connection.rollback()
-                    log.error("Non-SQL error!")
-                    raise e
-        except Exception as e:
-            log.debug(str(e))
-            log.error("Error while inserting 'file' row!")
-            # Jump to the ext job
-            continue
-        else:
-            n_success += 1
-            # report time
-            log.info(
-                f"{job['filename']} (file_id: {file_id}): {(time.time() - job_start_time):.2f} seconds"
-            )
- 
-    if jobs:
-        log.info(
-            f"{n_success}/{len(jobs)} files processed, execution time {(time.time() - script_start_time):.2f} seconds"
-        )
 
 # EOF
\ No newline at end of file
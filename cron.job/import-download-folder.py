@@ -7,31 +7,98 @@
 #
 # import-download-folder.py - Jani Tammi <jasata@utu.fi>
 #   2020-09-18  Initial version.
+#   2026-10-19  Files are imported through 'import' jobs (JobQueue.py).
+#   2026-10-19  Work moved into process(), which 'background-worker.py' calls.
+#   2026-10-19  Run and job metrics recorded (JobRun).
+#   2026-10-19  Set based reconciliation, rows inserted in batches
+#               (executemany), disappeared files marked 'missing'.
+#   2026-10-19  Scan checkpoint (STATE_DIR), unchanged folder is not scanned.
+#   2026-10-19  Watcher mode (--watch, inotify). OWNER from site configuration.
+#   2026-10-19  Metadata extraction in a process pool (IMPORT_WORKERS).
+#   2026-10-19  Pool processes restore default signal handling.
+#   2026-10-19  Scan reconciles only the new, modified and removed files.
+#   2026-10-19  Unchanged folder (no jobs due) returns before JobRun.
 #
-#   - Job added to crontab by 'setup.py'.
+#   - Hosted by 'background-worker.py' (service installed by 'setup.py').
 #   - Logging to syslog.
 #   - Must be executed as 'www-data'.
+#   - Can also be run as a one-shot cron job (the worker calls process()).
+#   - Watcher mode: './import-download-folder.py --watch' (see below).
 #
 #
 # FUNCTIONAL DESCRIPTION
 #
-#   1. Scan DOWNLOAD_DIR for '.job' files (completed Flow.js uploads).
-#   2. Add '.{PID}' suffix to each '.job' file to reserve them for this task.
-#   3. Read '.job' JSON and assemble file into DOWNLOAD_DIR
-#   4. Try extracting .OVA information.
-#   5. Insert database entry.
+#   0. If neither DOWNLOAD_DIR (its mtime) nor the rows of table 'file'
+#      (count and largest id) have changed since the checkpoint of the
+#      previous scan, skip to 4 (jobs due for a retry), or return without
+#      writing anything if no 'import' jobs are due.
+#   1. List DOWNLOAD_DIR (files of ALLOWED_EXT) and compare it to the
+#      entries of the checkpoint (inode, size, mtime). Only the files that
+#      are new, modified or removed since the previous scan are looked up
+#      from table 'file'. All rows are compared to the folder only if
+#      there is no checkpoint, or if rows that existed at the checkpoint
+#      have been deleted (their files may still be there). New or modified
+#      files that have been written in the last IMPORT_SETTLE seconds are
+#      left for a later scan (still being copied).
+#   2. Mark rows without a file 'missing' (file.integrity), and clear the
+#      mark of rows whose file has reappeared.
+#   3. Enqueue an 'import' job for each file without a row (one transaction).
+#   4. Claim 'import' jobs, IMPORT_BATCH at the time.
+#   5. Try extracting .OVA information for each, in a pool of IMPORT_WORKERS
+#      processes. Extraction time of each file is logged.
+#   6. Insert the database rows of the batch in one transaction.
+#   7. Mark the jobs done (or failed, which schedules a retry with backoff).
+#   8. Save the checkpoint (STATE_DIR/CHECKPOINT_FILE, JSON). Without
+#      STATE_DIR, every run scans.
+#
+#   Imported files are owned by OWNER (site configuration), which must be
+#   an active teacher. Without it, new files are only enqueued.
+#
+# WATCHER MODE
+#
+#   With '--watch', the script runs until terminated and imports files
+#   within seconds of them being copied or moved into DOWNLOAD_DIR:
+#
+#   1. Run once as above (catch up).
+#   2. Wait for inotify events (Inotify.py) IN_CLOSE_WRITE, IN_MOVED_TO
+#      and IN_MODIFY in DOWNLOAD_DIR.
+#   3. When a file has had no events for WATCH_SETTLE seconds and its size
+#      and mtime did not change during that time, enqueue an 'import' job
+#      for it (unless it has a row already) and execute the due jobs.
+#   4. If the kernel event queue overflows, run once as above.
+#
+#   Cron job remains useful (retries, files that are removed), and the
+#   watcher and cron job can run at the same time (JobQueue.py).
+#
+#   /etc/systemd/system/vm-import-watcher.service
+#       [Unit]
+#       Description=vm.utu.fi download folder watcher
+#       After=network.target
+#
+#       [Service]
+#       User=www-data
+#       ExecStart=/var/www/vm.utu.fi/cron.job/import-download-folder.py --watch
+#       Restart=on-failure
+#
+#       [Install]
+#       WantedBy=multi-user.target
 #
 #
 import os
+import sys
 import pwd
 import json
 import glob
 import time
+import signal
 import logging
 import logging.handlers
 import sqlite3
+import multiprocessing
 
-from OVFData import OVFData
+from OVFData    import OVFData
+from JobQueue   import JobQueue, JobRun, LeaseLost
+from Inotify    import Inotify
 
 # pylint: disable=undefined-variable
 
@@ -40,9 +107,28 @@ NICE            = 20
 EXECUTE_AS      = "www-data"
 LOGLEVEL        = logging.DEBUG  # logging.[DEBUG|INFO|WARNING|ERROR|CRITICAL]
 CONFIG_FILE     = "site.conf" # All instance/site specific values
+# Default for site configuration value (if not in CONFIG_FILE)
+STATE_DIR       = None
+
+# Owner (teacher uid) of the imported files. From CONFIG_FILE.
+OWNER           = None
+# Metadata extraction processes, at most. Also from CONFIG_FILE.
+IMPORT_WORKERS  = "4"
 
 # Settings specific for this script (and, unlikely to change)
-OWNER           = "jmjmak"
+# Jobs claimed and rows inserted in one transaction
+IMPORT_BATCH    = 100
+# Seconds since the last write, before a new file is imported
+IMPORT_SETTLE   = 60
+# Scan checkpoint, in STATE_DIR
+CHECKPOINT_FILE = "import-download-folder.json"
+# Watcher mode: seconds without writes, before a file is imported
+WATCH_SETTLE    = 5
+# Columns of the inserted rows (missing values are NULL)
+INSERT_COLUMNS  = (
+    'name', 'label', 'size', 'type', 'owner',
+    'cores', 'ram', 'description', 'disksize', 'ostype'
+)
 
 SCRIPTNAME = os.path.basename(__file__)
 
@@ -127,6 +213,445 @@ def basic_attributes(filepath: str) -> dict:
     return attributes
 
 
+
+def insert_rows(db: sqlite3.Connection, rows: list) -> dict:
+    """INSERT 'file' rows (dictionaries with INSERT_COLUMNS keys) in one transaction. Returns {name: error} for the rows that could not be inserted."""
+    sql  = f"INSERT INTO file ({', '.join(INSERT_COLUMNS)}) "
+    sql += f"VALUES (:{', :'.join(INSERT_COLUMNS)})"
+    try:
+        db.executemany(sql, rows)
+    except sqlite3.IntegrityError:
+        # One row (duplicate label, for example) fails the whole batch.
+        # Statements that fail do not roll back the transaction, so the
+        # rows are inserted one by one to find out which.
+        db.rollback()
+    else:
+        db.commit()
+        return {}
+    errors = {}
+    try:
+        for row in rows:
+            try:
+                db.execute(sql, row)
+            except sqlite3.IntegrityError as e:
+                log.error(f"sqlite3.IntegrityError! SQL: {sql}, data: {str(row)}")
+                errors[row['name']] = str(e)
+    except:
+        db.rollback()
+        raise
+    else:
+        db.commit()
+    return errors
+
+
+
+def checkpoint_file() -> str:
+    return os.path.join(STATE_DIR, CHECKPOINT_FILE) if STATE_DIR else None
+
+
+
+def load_checkpoint() -> dict:
+    """Returns the checkpoint of the previous scan, or an empty dictionary."""
+    try:
+        with open(checkpoint_file(), "r") as f:
+            return json.load(f)
+    except (TypeError, OSError, ValueError):
+        return {}
+
+
+
+def save_checkpoint(checkpoint: dict):
+    """Write (replace atomically) the scan checkpoint, if STATE_DIR is set."""
+    filepath = checkpoint_file()
+    if not filepath:
+        return
+    try:
+        with open(filepath + ".tmp", "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(filepath + ".tmp", filepath)
+    except OSError:
+        log.exception(f"Unable to save scan checkpoint '{filepath}'")
+
+
+
+def rows_fingerprint(db: sqlite3.Connection) -> list:
+    """Changes when 'file' rows are inserted or deleted."""
+    return list(db.execute("SELECT COUNT(*), MAX(id) FROM file").fetchone())
+
+
+
+def rows_deleted(db: sqlite3.Connection, fingerprint: list) -> bool:
+    """True if any of the rows that existed at 'fingerprint' (rows_fingerprint()) have been deleted since. Row IDs are not reused (AUTOINCREMENT)."""
+    if not fingerprint:
+        return True
+    count, max_id = fingerprint
+    return db.execute(
+        "SELECT COUNT(*) FROM file WHERE id <= ?",
+        [max_id or 0]
+    ).fetchone()[0] != count
+
+
+
+def select_files(db: sqlite3.Connection, names: set = None) -> dict:
+    """Returns {name: integrity} of the 'file' rows of 'names', or of all rows."""
+    sql = "SELECT name, integrity FROM file"
+    if names is None:
+        return dict(db.execute(sql).fetchall())
+    names = sorted(names)
+    rows = {}
+    # SQLite allows 999 parameters per statement (before 3.32)
+    for i in range(0, len(names), 500):
+        chunk = names[i:i + 500]
+        rows.update(
+            db.execute(
+                sql + f" WHERE name IN ({', '.join('?' * len(chunk))})",
+                chunk
+            ).fetchall()
+        )
+    return rows
+
+
+
+def scan(
+    db: sqlite3.Connection,
+    queue: JobQueue,
+    checkpoint: dict,
+    dir_mtime: int
+):
+    """Reconcile DOWNLOAD_DIR with table 'file' and enqueue 'import' jobs for new files. Returns the new checkpoint (without 'rows', which is updated after the import)."""
+    # Convert ALLOWED_EXT into a tuple (for str.endswith())
+    allowed_ext = tuple(n.strip() for n in ALLOWED_EXT.split(','))
+
+
+    #
+    # Get sets from database and DOWNLOAD_DIR. Stat of each entry is
+    # compared to the previous scan (checkpoint) to find the new, modified
+    # and removed files. Only their rows are needed, unless there is no
+    # checkpoint or rows have been deleted since.
+    #
+    log.debug(f"Scanning '{DOWNLOAD_DIR}'")
+    # {name: [inode, size, mtime_ns]}
+    entries = {}
+    with os.scandir(DOWNLOAD_DIR) as it:
+        for entry in it:
+            if entry.name.endswith(allowed_ext) and entry.is_file():
+                st = entry.stat()
+                entries[entry.name] = [st.st_ino, st.st_size, st.st_mtime_ns]
+    previous = checkpoint.get('entries', {})
+    changed = {
+        name for name, stat in entries.items()
+        if previous.get(name) != stat
+    }
+    removed = previous.keys() - entries.keys()
+    full = not previous or rows_deleted(db, checkpoint.get('rows'))
+    # Files that are still being written (copied by an admin) are left
+    # for a later run
+    # (time.time_ns() is Python 3.7+)
+    settled = int((time.time() - IMPORT_SETTLE) * 1e9)
+    unsettled = {name for name in changed if entries[name][2] > settled}
+    # Files whose rows are compared
+    folder_files = set(entries) if full else changed
+    try:
+        if full:
+            log.debug(f"Getting file list from '{DATABASE}'")
+            # {name: integrity}
+            db_files = select_files(db)
+        else:
+            log.debug(
+                f"Getting {len(changed)} new or modified and {len(removed)} removed files from '{DATABASE}'"
+            )
+            db_files = select_files(db, changed | removed)
+    except sqlite3.Error as e:
+        log.exception("Error retrieving file list from database!")
+        raise
+
+
+    #
+    # Rows without a file are marked 'missing' (File.download() would
+    # respond 404 anyway), and rows whose file has reappeared are left
+    # for the scrubber to verify again (integrity NULL).
+    #
+    missing = [
+        name for name in db_files.keys() - folder_files
+        if db_files[name] != 'missing'
+    ]
+    returned = [
+        name for name in db_files.keys() & folder_files
+        if db_files[name] == 'missing'
+    ]
+    try:
+        db.executemany(
+            "UPDATE file SET integrity = 'missing' WHERE name = ?",
+            [(name,) for name in missing]
+        )
+        db.executemany(
+            "UPDATE file SET integrity = NULL, verified = NULL WHERE name = ?",
+            [(name,) for name in returned]
+        )
+    except:
+        db.rollback()
+        log.exception("Unable to update missing files!")
+        raise
+    else:
+        db.commit()
+    for name in missing:
+        log.warning(f"File '{name}' has disappeared from '{DOWNLOAD_DIR}'!")
+    for name in returned:
+        log.info(f"File '{name}' has reappeared into '{DOWNLOAD_DIR}'")
+    for name in changed & previous.keys() & db_files.keys():
+        # Content is verified by 'scrub-download-folder.py'
+        log.info(f"File '{name}' has been modified")
+
+
+    #
+    # Orphaned - enqueue an 'import' job for each
+    #
+    try:
+        queue.enqueue_all(
+            sorted(folder_files - db_files.keys() - unsettled)
+        )
+    except Exception as e:
+        log.exception("Job queueing failed!")
+        raise
+
+
+    #
+    # New checkpoint. Unsettled files are not in the entries and the
+    # directory mtime is not saved, so the next run scans again.
+    #
+    if unsettled:
+        log.debug(f"{len(unsettled)} files are still being written")
+    return {
+        'directory':    None if unsettled else dir_mtime,
+        'entries':      {
+            name: stat for name, stat in entries.items()
+            if name not in unsettled
+        }
+    }
+
+
+
+def owner_is_valid(db: sqlite3.Connection) -> bool:
+    """Imported files are owned by OWNER, which must be an active teacher."""
+    if not OWNER:
+        log.error(f"OWNER is not configured in '{CONFIG_FILE}'! Files are not imported.")
+        return False
+    if not db.execute(
+        "SELECT 1 FROM teacher WHERE uid = ? AND status = 'active'",
+        [OWNER]
+    ).fetchone():
+        log.error(f"OWNER '{OWNER}' is not an active teacher! Files are not imported.")
+        return False
+    return True
+
+
+
+def init_worker():
+    """Extraction pool process initializer. Restores the default signal handlers and mask, which are inherited from 'background-worker.py' (if hosted)."""
+    for signum in (signal.SIGUSR1, signal.SIGHUP, signal.SIGTERM, signal.SIGALRM):
+        signal.signal(signum, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.pthread_sigmask(signal.SIG_SETMASK, [])
+
+
+
+def extract(filename: str) -> tuple:
+    """Collect the 'file' row attributes of 'filename' (in DOWNLOAD_DIR). Executed in the extraction pool. Returns (filename, row, error, seconds). Row is None if the file could not be read."""
+    start_time = time.time()
+    vmfile = os.path.join(DOWNLOAD_DIR, filename)
+    try:
+        # Required attributes
+        data = dict.fromkeys(INSERT_COLUMNS)
+        data.update(basic_attributes(vmfile))
+        # Add 'owner'
+        data['owner'] = OWNER
+        # .OVF attributes, if an '.ova' file
+        if filename.lower().endswith('.ova'):
+            try:
+                data.update(ova_attributes(vmfile))
+            except:
+                log.error(f".OVF extraction failed from {vmfile}! Can continue...")
+    except Exception as e:
+        return (filename, None, str(e), time.time() - start_time)
+    return (filename, data, None, time.time() - start_time)
+
+
+
+def import_due(db: sqlite3.Connection, queue: JobQueue) -> int:
+    """Execute due 'import' jobs. Returns the number of jobs executed."""
+    #
+    # Claim jobs IMPORT_BATCH at the time and insert their rows
+    # in one transaction
+    #
+    n_jobs = 0
+    while True:
+        try:
+            claimed = queue.claim(IMPORT_BATCH)
+        except Exception as e:
+            log.exception("Unable to claim jobs!")
+            break
+        if not claimed:
+            break
+        n_jobs += len(claimed)
+
+        #
+        # Extract attributes in a process pool (IMPORT_WORKERS processes at
+        # most). Job leases are renewed as the results come in.
+        #
+        start_time = time.time()
+        jobs = {job.target: job for job in claimed}
+        rows = {}           # {job.id: row}
+        timings = {}        # {filename: seconds}
+        nworkers = min(int(IMPORT_WORKERS), len(claimed))
+        if nworkers > 1:
+            pool = multiprocessing.Pool(nworkers, init_worker)
+            results = pool.imap_unordered(extract, jobs.keys())
+        else:
+            pool = None
+            results = map(extract, jobs.keys())
+        try:
+            for filename, data, error, seconds in results:
+                job = jobs[filename]
+                timings[filename] = seconds
+                if data is None:
+                    log.error(f"Unable to read '{filename}' ({str(job)}): {error}")
+                    job.fail(error)
+                else:
+                    rows[job.id] = data
+                # Failed jobs are no longer ours
+                for job in claimed:
+                    if job.id in rows or job.target not in timings:
+                        job.heartbeat()
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        extract_time = time.time() - start_time
+
+        try:
+            errors = insert_rows(db, list(rows.values()))
+        except Exception as e:
+            log.exception(f"Error while inserting {len(rows)} 'file' rows!")
+            errors = {row['name']: str(e) for row in rows.values()}
+        for job in claimed:
+            if job.id not in rows:
+                continue
+            if job.target in errors:
+                log.error(f"Error while inserting 'file' row for '{job.target}' ({str(job)})!")
+                job.fail(errors[job.target])
+            else:
+                try:
+                    job.complete()
+                except LeaseLost:
+                    log.error(f"Lease lost before completion ({str(job)})")
+                    continue
+                log.info(
+                    f"{job.target} imported (extraction {timings[job.target]:.2f} seconds)"
+                )
+        # report time
+        log.info(
+            f"{len(rows) - len(errors)} of {len(claimed)} files imported in {(time.time() - start_time):.2f} seconds (extraction {extract_time:.2f} seconds, {nworkers} processes, {sum(timings.values()):.2f} seconds total)"
+        )
+    return n_jobs
+
+
+
+def process(db: sqlite3.Connection) -> int:
+    """Reconcile DOWNLOAD_DIR with table 'file'. Enqueue and execute 'import' jobs for new files and mark the rows of disappeared files. Returns the number of jobs executed. Requires site configuration (read_config_file()) and module global 'log'."""
+    checkpoint = load_checkpoint()
+    dir_mtime = os.stat(DOWNLOAD_DIR).st_mtime_ns
+    unchanged = checkpoint.get('directory') == dir_mtime and \
+                checkpoint.get('rows') == rows_fingerprint(db)
+    #
+    # Nothing to scan and no jobs due for a retry: return before the run is
+    # recorded or anything is claimed (no writes, no write lock)
+    #
+    if unchanged and not JobQueue(db, 'import').due():
+        log.debug(f"'{DOWNLOAD_DIR}' and table 'file' unchanged")
+        return 0
+    with JobRun(db, SCRIPTNAME) as run:
+        queue = JobQueue(db, 'import', run = run)
+        if unchanged:
+            checkpoint = None
+        else:
+            checkpoint = scan(db, queue, checkpoint, dir_mtime)
+
+
+        n_jobs = import_due(db, queue) if owner_is_valid(db) else 0
+
+
+        #
+        # Checkpoint is saved after the imports, which change the rows
+        #
+        if checkpoint:
+            checkpoint['rows'] = rows_fingerprint(db)
+            save_checkpoint(checkpoint)
+        return n_jobs
+
+
+
+def watch(db: sqlite3.Connection):
+    """Watcher mode. Import files as soon as they have been written into DOWNLOAD_DIR (inotify). Runs until terminated. Requires site configuration (read_config_file()) and module global 'log'."""
+    # Catch up with the changes made while we were not watching
+    process(db)
+    allowed_ext = tuple(n.strip() for n in ALLOWED_EXT.split(','))
+    with Inotify() as inotify:
+        inotify.add_watch(
+            DOWNLOAD_DIR,
+            Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO | Inotify.IN_MODIFY
+        )
+        log.info(f"Watching '{DOWNLOAD_DIR}'")
+        # {name: (time of the last event, (size, mtime_ns))}
+        pending = {}
+        while True:
+            timeout = None
+            if pending:
+                timeout = max(
+                    0,
+                    min(t for t, _ in pending.values()) + WATCH_SETTLE - time.time()
+                )
+            for _, mask, _, name in inotify.read(timeout):
+                if mask & Inotify.IN_Q_OVERFLOW:
+                    # Events were lost, scan the whole folder
+                    log.warning("inotify event queue overflow")
+                    process(db)
+                elif name.endswith(allowed_ext):
+                    pending[name] = (time.time(), None)
+            #
+            # File is settled when there have been no events for it in
+            # WATCH_SETTLE seconds and its size and mtime have not changed
+            # during that time (writers that do not close the file).
+            #
+            settled = []
+            for name, (t, stat) in list(pending.items()):
+                if time.time() - t < WATCH_SETTLE:
+                    continue
+                try:
+                    st = os.stat(os.path.join(DOWNLOAD_DIR, name))
+                except FileNotFoundError:
+                    del pending[name]
+                    continue
+                if stat == (st.st_size, st.st_mtime_ns):
+                    settled.append(name)
+                    del pending[name]
+                else:
+                    pending[name] = (time.time(), (st.st_size, st.st_mtime_ns))
+            if not settled:
+                continue
+            with JobRun(db, SCRIPTNAME) as run:
+                queue = JobQueue(db, 'import', run = run)
+                existing = {
+                    row[0] for row in db.execute(
+                        f"SELECT name FROM file WHERE name IN ({', '.join('?' * len(settled))})",
+                        settled
+                    )
+                }
+                queue.enqueue_all(sorted(set(settled) - existing))
+                if owner_is_valid(db):
+                    import_due(db, queue)
+
+
+
 ###############################################################################
 #
 # MAIN
@@ -174,105 +699,22 @@ if __name__ == '__main__':
     except:
         log.exception(f"Error reading site configuration '{CONFIG_FILE}'")
         os._exit(-1)
-    # Convert ALLOWED_EXT into list
-    ALLOWED_EXT = [n.strip() for n in ALLOWED_EXT.split(',')]
 
 
     #
-    # Get lists from database and DOWNLOAD_DIR
+    # Enqueue and execute jobs (once, or until terminated in watcher mode)
     #
-    log.debug(f"Getting file list from '{DOWNLOAD_DIR}'")
-    folder_files = [s for s in os.listdir(DOWNLOAD_DIR) if s.endswith(tuple(ALLOWED_EXT))]
-    log.debug(f"Getting file list from '{DATABASE}'")
-    sql = "SELECT name FROM file"
     try:
         with sqlite3.connect(DATABASE) as db:
-            db.row_factory = lambda cursor, row: row[0]
-            try:
-                cursor = db.cursor()
-                db_files = cursor.execute(sql).fetchall()
-            except sqlite3.Error as e:
-                log.error(
-                    f"sqlite3.Error! SQL: {sql}"
-                )
-                raise e
-            except Exception as e:
-                log.error("Non-SQL error!")
-                raise e
-    except Exception as e:
-        log.debug(str(e))
-        log.error("Error retrieving file list from database!")
+            if '--watch' in sys.argv[1:]:
+                watch(db)
+            else:
+                process(db)
+    except KeyboardInterrupt:
+        pass
+    except:
+        log.exception("Process failure!")
         os._exit(-1)
 
 
-    #
-    # Orphaned
-    #
-    #orphaned = [x for x in folder_files if x not in db_files]
-    for vmfile in [x for x in folder_files if x not in db_files]:
-
-        start_time = time.time()
-        try:
-
-            #
-            # Get attributes
-            #
-            _, ext = os.path.splitext(vmfile)
-            vmfile = os.path.join(DOWNLOAD_DIR, vmfile)
-            # Required attributes
-            data = basic_attributes(vmfile)
-            # Add 'owner'
-            data['owner'] = OWNER
-            # .OVF attributes, if an '.ova' file
-            if ext.lower() == '.ova':
-                try:
-                    ovfdata = ova_attributes(vmfile)
-                except:
-                    log.error(f".OVF extraction failed from {vmfile}! Can continue...")
-                else:
-                    # Merge, 'ovfdata' overwrites values in 'data' dictionary
-                    data = {**data, **ovfdata}
-
-
-            #
-            # Parse SQL
-            #
-            try:
-                sql  = f"INSERT INTO file ({','.join(data.keys())}) "
-                sql += f"VALUES (:{',:'.join(data.keys())})"
-            except Exception as e:
-                log.exception("Error parsing SQL!")
-                continue
-            #
-            # Insert record
-            #
-            try:
-                with sqlite3.connect(DATABASE) as db:
-                    cursor = db.cursor()
-                    cursor.execute(sql, data)
-                    # Get AUTOINCREMENT PK
-                    file_id = cursor.lastrowid
-                    cursor.connection.commit()
-            except sqlite3.IntegrityError as e:
-                cursor.connection.rollback()
-                log.error(
-                    f"sqlite3.IntegrityError! SQL: {sql}, data: {str(data)}"
-                )
-                raise e
-            except Exception as e:
-                cursor.connection.rollback()
-                log.error("Non-SQL error!")
-                raise e
-        except Exception as e:
-            log.debug(str(e))
-            log.error(f"Error while inserting 'file' row for '{vmfile}'!")
-            # Try next orphaned file
-            continue
-        else:
-            # report time
-            log.info(
-                f"{vmfile} (file_id: {file_id}): {(time.time() - start_time):.2f} seconds"
-            )
- 
-
 # EOF
@@ -0,0 +1,758 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Turku University (2020) Department of Future Technologies
+# Course Virtualization / Website / Cron Jobs
+# Ingest download events from Nginx access logs (download statistics).
+#
+# ingest-access-log.py
+#   2026-10-19  Initial version (replaces 'sql/genevents.py').
+#   2026-10-19  Bulk attribution (DownloadIndex.py) instead of 'dlevent'.
+#   2026-10-19  Daily and monthly rollups ('download_daily', 'download_monthly').
+#   2026-10-19  Backfill mode (--backfill), logs parsed in a process pool.
+#   2026-10-19  Rollups are rebuilt also from the archives (DownloadArchive.py).
+#   2026-10-19  Range requests are merged into logical downloads (Sessionizer.py).
+#   2026-10-19  Unique downloader sketches ('downloader_daily', '_monthly').
+#   2026-10-19  Rollups updated without UPSERT (SQLite 3.22).
+#   2026-10-19  Read position stops at the open downloads (no losses).
+#
+#   - Job added to crontab by 'setup.py'.
+#   - Logging to syslog.
+#   - Must be executed as 'root' (Nginx logs are not readable by www-data).
+#   - Backfill mode: './ingest-access-log.py --backfill' (see below).
+#
+#
+# FUNCTIONAL DESCRIPTION
+#
+#   Download statistics (sql/download_statistics.sql) are collected from
+#   the Nginx access log ACCESS_LOG and its rotated logs (ACCESS_LOG.1,
+#   ACCESS_LOG.2.gz, ...). Each log is read only once, incrementally:
+#
+#   1. List the logs, oldest first, and identify each by the fingerprint
+#      of its first line (AccessLog.py). Logs without a complete line are
+#      skipped until the next run.
+#   2. Look up the read position of each log (table 'access_log'). Logs
+#      that have been read to the end are skipped without reading (for
+#      compressed logs, the length is in the gzip trailer).
+#   3. Load 'downloadable' into an interval index (DownloadIndex.py).
+#   4. Read the lines after the position. Download requests (2xx GET of
+#      /download/<file> of ALLOWED_EXT) are attributed to the file instance
+#      that existed at the time of the request. Requests of one client for
+#      one file instance, no more than SESSION_WINDOW seconds apart, are
+#      merged into one logical download (Sessionizer.py), which is complete
+#      if the byte ranges of its requests cover the file.
+#   5. Every INGEST_BATCH requests, and at the end of each log, downloads
+#      that have been idle for SESSION_WINDOW are inserted into 'download'
+#      with executemany(). Downloads that cannot be attributed are inserted
+#      into 'download_unresolved'. Rollups (daily and monthly) are updated
+#      and the new read positions are recorded, all in one transaction.
+#      Read position stops at the first request of the earliest download
+#      that is still open (see below), and downloads that started after it
+#      are not inserted yet.
+#      (Empty rollups are first built from all 'download' rows and the
+#      archives of closed months in STATE_DIR.)
+#      Client hashes of the downloads are added to the unique downloader
+#      sketches of the file instance and day/month (HyperLogLog.py) in the
+#      same transaction.
+#   6. At the end of the run, downloads that have been idle for
+#      SESSION_WINDOW (by the clock) are inserted as above. Downloads that
+#      are still open are left for the next run.
+#   7. Positions of logs that have not been seen in ACCESS_LOG_EXPIRE days
+#      (rotated away) are removed.
+#
+#   Sessions are merged over log rotations and over runs. Open sessions are
+#   not stored: the next run reads their lines again (the read position of
+#   the log where the earliest open download started stops at its first
+#   request, and the positions of the later logs at where this run started
+#   reading them) and rebuilds them, with the downloads that started after
+#   it (Sessionizer.py, RESUMING). A download that is in progress while the
+#   job runs is counted once, and a failed run loses nothing.
+#
+#   Clients are identified by a keyed hash of the remote address and user
+#   agent, which exists only in memory (AccessLog.py) and is discarded once
+#   the download has been added to the sketches. No client data is written
+#   into the database. The key is created in STATE_DIR ('downloader.key',
+#   readable by root only) and kept, so that the sketches of different runs
+#   count the same downloader only once when merged. Without STATE_DIR, a
+#   random key is used for each run and no sketches are maintained.
+#
+# BACKFILL MODE
+#
+#   With '--backfill', all unread logs (for example, weeks of rotated logs
+#   after a database rebuild) are parsed in parallel, one log per process,
+#   in a pool of INGEST_WORKERS processes. Each worker reads, attributes
+#   and sessionizes the requests of its log, and aggregates (rollups) the
+#   downloads that cannot continue in the neighbouring logs. Sessions near
+#   the start or end of a log are returned as such, and merged in log
+#   order, oldest first. Everything is loaded in one transaction, in sorted
+#   order, so that the rows are the same however the work was scheduled
+#   (and the same as without '--backfill', except that the downloads that
+#   are open at the end of the newest log are closed and inserted).
+#
+#   Tables 'file' and 'downloadable' are never modified; the catalog is
+#   maintained by 'import-download-folder.py' and the upload processor.
+#
+#   Configuration (CONFIG_FILE, defaults below):
+#       ACCESS_LOG      Nginx access log (without the rotation suffix).
+#       STATE_DIR       Archives (rollup rebuild) and the client hash key.
+#       INGEST_WORKERS  Backfill processes, at most.
+#       SESSION_WINDOW  Seconds between the requests of one download, at most.
+#
+import os
+import sys
+import pwd
+import time
+import logging
+import logging.handlers
+import sqlite3
+import multiprocessing
+
+from AccessLog      import AccessLog
+from DownloadIndex  import DownloadIndex
+from DownloadArchive import DownloadArchive
+from Sessionizer    import Sessionizer
+from HyperLogLog    import HyperLogLog
+from JobQueue       import JobRun
+
+# pylint: disable=undefined-variable
+
+# Unprivileged os.nice() values: 0 ... 20 (= lowest priority)
+NICE            = 20
+EXECUTE_AS      = "root"
+LOGLEVEL        = logging.INFO  # logging.[DEBUG|INFO|WARNING|ERROR|CRITICAL]
+CONFIG_FILE     = "site.conf" # All instance/site specific values
+# Defaults for site configuration values (if not in CONFIG_FILE)
+ACCESS_LOG      = "/var/log/nginx/vm.utu.fi.access.log"
+STATE_DIR       = None
+INGEST_WORKERS  = "4"
+SESSION_WINDOW  = "3600"
+# Requests per transaction
+INGEST_BATCH    = 50000
+# Days after which the read position of a vanished log is removed
+ACCESS_LOG_EXPIRE = 30
+# Rollup tables: (table, period column, strftime() format of the period)
+ROLLUPS         = (
+    ('download_daily',      'day',      '%Y-%m-%d'),
+    ('download_monthly',    'month',    '%Y-%m')
+)
+# Unique downloader sketch tables: (table, period column, strftime() format)
+SKETCHES        = (
+    ('downloader_daily',    'day',      '%Y-%m-%d'),
+    ('downloader_monthly',  'month',    '%Y-%m')
+)
+# Client hash key file (in STATE_DIR)
+SKETCH_KEY      = "downloader.key"
+# Set by process() and backfill(), when the client hash key is persistent
+SKETCH          = False
+
+SCRIPTNAME = os.path.basename(__file__)
+
+
+
+def read_config_file(cfgfile: str):
+    """Reads (with ConfigParser()) '[Site]' and creates global variables. Argument 'cfgfile' has to be a filename only (not path + file) and the file must exist in the same directory as this script."""
+    cfgfile = os.path.join(
+        os.path.split(os.path.realpath(__file__))[0],
+        cfgfile
+    )
+    if not os.path.exists(cfgfile):
+        raise FileNotFoundError(f"Site configuration '{cfgfile}' not found!")
+    import configparser
+    cfg = configparser.ConfigParser()
+    cfg.optionxform = lambda option: option # preserve case
+    cfg.read(cfgfile)
+    for k, v in cfg.items('Site'):
+        globals()[k] = v
+
+
+
+def rebuild_rollups(db: sqlite3.Connection):
+    """Replace the contents of the rollup tables with aggregates of all 'download' rows and archived events."""
+    for table, column, fmt in ROLLUPS:
+        db.execute(f"DELETE FROM {table}")
+        db.execute(
+            f"""
+            INSERT INTO {table}
+            (file_id, {column}, downloads, complete, partial, bytes)
+            SELECT      file_id,
+                        strftime('{fmt}', datetime, 'unixepoch'),
+                        COUNT(*),
+                        SUM(complete = 'TRUE'),
+                        SUM(complete IS NOT 'TRUE'),
+                        SUM(size)
+            FROM        download
+            GROUP BY    1, 2
+            """
+        )
+    # Files without a 'download_archive' row are from interrupted runs
+    recorded = {
+        row[0] for row in db.execute("SELECT filename FROM download_archive")
+    }
+    archives = [
+        filepath for filepath in DownloadArchive.archives(STATE_DIR)
+        if os.path.basename(filepath) in recorded
+    ]
+    if archives:
+        totals = {table: {} for table, _, _ in ROLLUPS}
+        for filepath in archives:
+            archive = DownloadArchive.read(filepath)
+            for table, _, fmt in ROLLUPS:
+                archive.rollup(fmt, totals = totals[table])
+        update_rollups(db, totals)
+    db.commit()
+
+
+
+def aggregate(rows: list, totals: dict = None) -> dict:
+    """Aggregate 'download' rows (file_id, filename, datetime, size, complete) for the rollup tables. Returns {table: {(file_id, period): [downloads, complete, partial, bytes]}}, added into 'totals', if given."""
+    if totals is None:
+        totals = {table: {} for table, _, _ in ROLLUPS}
+    # {day number: time.struct_time}
+    days = {}
+    for table, column, fmt in ROLLUPS:
+        for file_id, _, datetime, size, complete in rows:
+            day = datetime // 86400
+            if day not in days:
+                days[day] = time.gmtime(day * 86400)
+            t = totals[table].setdefault(
+                (file_id, time.strftime(fmt, days[day])),
+                [0, 0, 0, 0]
+            )
+            t[0] += 1
+            t[1 if complete == 'TRUE' else 2] += 1
+            t[3] += size
+    return totals
+
+
+
+def merge(totals: dict, other: dict) -> dict:
+    """Add aggregates 'other' into 'totals' (see aggregate()). Returns 'totals'."""
+    for table, counters in other.items():
+        for key, t in counters.items():
+            s = totals[table].setdefault(key, [0, 0, 0, 0])
+            for i, value in enumerate(t):
+                s[i] += value
+    return totals
+
+
+
+def update_rollups(db: sqlite3.Connection, totals: dict):
+    """Add aggregates (see aggregate()) to the rollup tables, in key order. Does not commit."""
+    # UPSERT (INSERT ... ON CONFLICT DO UPDATE) requires SQLite 3.24. Missing
+    # rows are created with zero counters, then all rows are incremented.
+    for table, column, _ in ROLLUPS:
+        keys = sorted(totals[table])
+        db.executemany(
+            f"INSERT OR IGNORE INTO {table} (file_id, {column}) VALUES (?, ?)",
+            keys
+        )
+        db.executemany(
+            f"""
+            UPDATE  {table}
+            SET     downloads   = downloads + ?,
+                    complete    = complete  + ?,
+                    partial     = partial   + ?,
+                    bytes       = bytes     + ?
+            WHERE   file_id = ? AND {column} = ?
+            """,
+            [(*totals[table][key], *key) for key in keys]
+        )
+
+
+
+def sketch_key() -> bytes:
+    """Returns the client hash key (SKETCH_KEY in STATE_DIR), created if it does not exist. Returns None if STATE_DIR is not configured or the key cannot be read or created."""
+    if not STATE_DIR:
+        log.warning("STATE_DIR not configured, unique downloaders are not estimated")
+        return None
+    filepath = os.path.join(STATE_DIR, SKETCH_KEY)
+    try:
+        try:
+            with open(filepath, "rb") as f:
+                key = f.read()
+            if len(key) == 16:
+                return key
+            log.warning(f"'{filepath}' is not a valid key, replacing it")
+            os.unlink(filepath)
+        except FileNotFoundError:
+            log.info(f"Creating client hash key '{filepath}'")
+        fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            key = os.urandom(16)
+            f.write(key)
+        return key
+    except OSError:
+        log.exception(f"Unable to read or create '{filepath}', unique downloaders are not estimated")
+        return None
+
+
+
+def sketches(sessions: list, totals: dict = None) -> dict:
+    """Add the clients of attributed 'sessions' into unique downloader sketches. Returns {table: {(file_id, period): HyperLogLog}}, added into 'totals', if given. Empty, if SKETCH is not set."""
+    if totals is None:
+        totals = {table: {} for table, _, _ in SKETCHES}
+    if not SKETCH:
+        return totals
+    for table, _, fmt in SKETCHES:
+        # {day number: period}
+        periods = {}
+        for session in sessions:
+            if session.file_id is None:
+                continue
+            day = session.first // 86400
+            if day not in periods:
+                periods[day] = time.strftime(fmt, time.gmtime(day * 86400))
+            key = (session.file_id, periods[day])
+            sketch = totals[table].get(key)
+            if sketch is None:
+                sketch = totals[table][key] = HyperLogLog()
+            sketch.add(session.key[0])
+    return totals
+
+
+
+def merge_sketches(totals: dict, other: dict) -> dict:
+    """Merge sketches 'other' into 'totals' (see sketches()). Returns 'totals'."""
+    for table, sketches in other.items():
+        for key, sketch in sketches.items():
+            if key in totals[table]:
+                totals[table][key].merge(sketch)
+            else:
+                totals[table][key] = sketch
+    return totals
+
+
+
+def update_sketches(db: sqlite3.Connection, totals: dict):
+    """Merge sketches (see sketches()) into the sketch tables, in key order. Does not commit."""
+    for table, column, _ in SKETCHES:
+        rows = []
+        for key, sketch in sorted(totals[table].items()):
+            row = db.execute(
+                f"SELECT sketch FROM {table} WHERE file_id = ? AND {column} = ?",
+                key
+            ).fetchone()
+            if row:
+                sketch = HyperLogLog.loads(row[0]).merge(sketch)
+            rows.append((*key, sketch.dumps(), sketch.estimate()))
+        db.executemany(
+            f"""
+            INSERT OR REPLACE INTO {table}
+            (file_id, {column}, sketch, downloaders)
+            VALUES (?, ?, ?, ?)
+            """,
+            rows
+        )
+
+
+
+def insert_rows(
+    db: sqlite3.Connection,
+    rows: list,
+    unresolved: list,
+    totals: dict,
+    sketches: dict,
+    positions: list
+):
+    """Insert 'download' rows, unresolved events, rollup aggregates, unique downloader sketches and read positions [(fingerprint, filepath, inode, position), ...]. Does not commit."""
+    db.executemany(
+        """
+        INSERT INTO download
+        (file_id, filename, datetime, size, complete)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        rows
+    )
+    db.executemany(
+        """
+        INSERT INTO download_unresolved
+        (filename, datetime, size)
+        VALUES (?, ?, ?)
+        """,
+        unresolved
+    )
+    update_rollups(db, totals)
+    update_sketches(db, sketches)
+    now = int(time.time())
+    db.executemany(
+        """
+        INSERT OR REPLACE INTO access_log
+        (fingerprint, filepath, inode, position, seen)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        [(*p, now) for p in positions]
+    )
+
+
+
+def insert_sessions(
+    db: sqlite3.Connection,
+    sessions: list,
+    positions: list
+) -> tuple:
+    """Insert closed 'sessions' (Sessionizer.take()) and read positions [(fingerprint, filepath, inode, position), ...], in one transaction. Returns (downloads, unresolved downloads)."""
+    rows, unresolved = Sessionizer.rows(sessions)
+    try:
+        insert_rows(
+            db, rows, unresolved, aggregate(rows), sketches(sessions), positions
+        )
+        db.commit()
+    except:
+        db.rollback()
+        raise
+    return len(rows), len(unresolved)
+
+
+
+def read_positions(read: list, resume: tuple) -> list:
+    """Read positions [(fingerprint, filepath, inode, position), ...] of the logs 'read' by this run [[AccessLog, start, end], ...]. Lines after 'resume' (index into 'read', offset), if any, are read again by the next run."""
+    positions = []
+    for n, (accesslog, start, end) in enumerate(read):
+        if resume is not None and n >= resume[0]:
+            end = resume[1] if n == resume[0] else start
+        positions.append(
+            (accesslog.fingerprint, accesslog.filepath, accesslog.stat.st_ino, end)
+        )
+    return positions
+
+
+
+def insert_settled(
+    db: sqlite3.Connection,
+    sessionizer: Sessionizer,
+    read: list
+) -> tuple:
+    """Insert the closed sessions that started before the open ones (Sessionizer.take_settled()) and the read positions of the logs 'read' by this run. Returns (downloads, unresolved downloads)."""
+    sessions, resume = sessionizer.take_settled()
+    return insert_sessions(db, sessions, read_positions(read, resume))
+
+
+
+def ingest(
+    db: sqlite3.Connection,
+    sessionizer: Sessionizer,
+    read: list
+) -> tuple:
+    """Read requests of the last log in 'read' [[AccessLog, start, end], ...] (the logs of this run, oldest first) after its start position. Returns (requests, downloads, unresolved downloads) inserted."""
+    extensions = ALLOWED_EXT.split(',')
+    nrequests = ndownloads = nunresolved = 0
+    batch = 0
+    n = len(read) - 1
+    accesslog, position, _ = read[n]
+    # Lines between two events have no events, so reading again from the
+    # end of the previous event line reads the same events
+    previous = position
+    for position, event in accesslog.events(position, extensions):
+        read[n][2] = position
+        if event:
+            sessionizer.add(*event, (n, previous))
+            previous = position
+            nrequests += 1
+            batch += 1
+            if batch < INGEST_BATCH:
+                continue
+        sessionizer.expire()
+        d, u = insert_settled(db, sessionizer, read)
+        ndownloads += d
+        nunresolved += u
+        batch = 0
+    return nrequests, ndownloads, nunresolved
+
+
+
+def unread_logs(db: sqlite3.Connection) -> tuple:
+    """Returns (all logs, [(log, read position), ...] for the logs that have unread lines), oldest first."""
+    positions = dict(
+        db.execute("SELECT fingerprint, position FROM access_log")
+    )
+    logs = [l for l in AccessLog.rotated(ACCESS_LOG) if l.fingerprint]
+    unread = []
+    for accesslog in logs:
+        position = positions.get(accesslog.fingerprint, 0)
+        if position and position == accesslog.length():
+            log.debug(f"{accesslog} has been read")
+            continue
+        if not accesslog.compressed and position > accesslog.stat.st_size:
+            log.warning(f"{accesslog} is shorter than its read position, reading from the start")
+            position = 0
+        unread.append((accesslog, position))
+    return logs, unread
+
+
+
+def expire_logs(db: sqlite3.Connection, logs: list):
+    """Update the 'seen' time of 'logs' and remove the read positions of logs that have been rotated away."""
+    now = int(time.time())
+    db.executemany(
+        "UPDATE access_log SET seen = ?, filepath = ? WHERE fingerprint = ?",
+        [(now, l.filepath, l.fingerprint) for l in logs]
+    )
+    db.execute(
+        "DELETE FROM access_log WHERE seen < ?",
+        [now - ACCESS_LOG_EXPIRE * 24 * 3600]
+    )
+    db.commit()
+
+
+
+def log_summary(
+    nlogs: int,
+    nrequests: int,
+    ndownloads: int,
+    nunresolved: int,
+    seconds: float
+):
+    if nrequests:
+        log.info(
+            f"{nrequests} download requests ingested from {nlogs} logs as {ndownloads + nunresolved} downloads in {seconds:.2f} seconds"
+        )
+    if nunresolved:
+        log.warning(
+            f"{nunresolved} downloads could not be attributed to a file (see table 'download_unresolved')"
+        )
+
+
+
+def process(db: sqlite3.Connection) -> int:
+    """Ingest new download requests from ACCESS_LOG and its rotated logs. Returns the number of requests read. Requires site configuration (read_config_file()) and module global 'log'."""
+    global SKETCH
+    with JobRun(db, SCRIPTNAME):
+        logs, unread = unread_logs(db)
+        if not logs:
+            log.warning(f"No access logs found ('{ACCESS_LOG}')")
+            return 0
+
+
+        if not db.execute("SELECT 1 FROM download_daily LIMIT 1").fetchone():
+            rebuild_rollups(db)
+        if unread:
+            key = sketch_key()
+            if key:
+                AccessLog.SALT = key
+                SKETCH = True
+        # One sessionizer for all logs, downloads continue over rotations
+        sessionizer = Sessionizer(
+            DownloadIndex(db) if unread else None,
+            int(SESSION_WINDOW)
+        )
+        nrequests = ndownloads = nunresolved = 0
+        start_time = time.time()
+        # [[AccessLog, start position, end position], ...]
+        read = []
+        for accesslog, position in unread:
+            t = time.time()
+            read.append([accesslog, position, position])
+            n, d, u = ingest(db, sessionizer, read)
+            log.debug(
+                f"{accesslog}: {n} requests from offset {position} in {(time.time() - t):.2f} seconds"
+            )
+            nrequests += n
+            ndownloads += d
+            nunresolved += u
+        # No more requests can join the downloads that have been idle for
+        # SESSION_WINDOW by now. Open downloads are left for the next run.
+        sessionizer.expire(int(time.time()))
+        d, u = insert_settled(db, sessionizer, read)
+        ndownloads += d
+        nunresolved += u
+        if len(sessionizer):
+            log.debug(f"{len(sessionizer)} downloads are open, left for the next run")
+
+
+        expire_logs(db, logs)
+        log_summary(
+            len(logs), nrequests, ndownloads, nunresolved,
+            time.time() - start_time
+        )
+        return nrequests
+
+
+
+def parse(task: tuple) -> tuple:
+    """Read, attribute and sessionize the requests of one log (backfill worker). 'task' is (filepath, fingerprint, read position). Returns (fingerprint, filepath, inode, end position, requests, rows, unresolved, aggregates, sketches, edge sessions, seconds), or None if the log has been replaced since it was listed. Rows are the downloads that are not within SESSION_WINDOW of the first or the last request of the log; the others are returned as (open) edge sessions."""
+    start_time = time.time()
+    filepath, fingerprint, position = task
+    try:
+        accesslog = AccessLog(filepath)
+    except FileNotFoundError:
+        return None
+    if accesslog.fingerprint != fingerprint:
+        return None
+    # 'index' is created by backfill() before the worker processes
+    window = int(SESSION_WINDOW)
+    sessionizer = Sessionizer(index, window)
+    first = None
+    nrequests = 0
+    for position, event in accesslog.events(position, ALLOWED_EXT.split(',')):
+        if event:
+            if first is None:
+                first = event[1]
+            sessionizer.add(*event)
+            nrequests += 1
+    sessionizer.flush()
+    interior = []
+    edges = []
+    for session in sessionizer.take():
+        if session.first - first <= window or \
+           sessionizer.latest - session.last <= window:
+            edges.append(session)
+        else:
+            interior.append(session)
+    rows, unresolved = Sessionizer.rows(interior)
+    return (
+        fingerprint, filepath, accesslog.stat.st_ino, position, nrequests,
+        rows, unresolved, aggregate(rows), sketches(interior), edges,
+        time.time() - start_time
+    )
+
+
+
+def backfill(db: sqlite3.Connection) -> int:
+    """Ingest all unread logs in parallel (INGEST_WORKERS processes, one log each) and load the results in one transaction. Returns the number of requests read. Requires site configuration (read_config_file()) and module global 'log'."""
+    global index, SKETCH
+    with JobRun(db, SCRIPTNAME):
+        logs, unread = unread_logs(db)
+        if not unread:
+            log.info(f"No unread access logs ('{ACCESS_LOG}')")
+            return 0
+
+
+        if not db.execute("SELECT 1 FROM download_daily LIMIT 1").fetchone():
+            rebuild_rollups(db)
+        # Inherited by the (forked) worker processes
+        key = sketch_key()
+        if key:
+            AccessLog.SALT = key
+            SKETCH = True
+        index = DownloadIndex(db)
+        start_time = time.time()
+        tasks = [(l.filepath, l.fingerprint, p) for l, p in unread]
+        nworkers = min(int(INGEST_WORKERS), len(tasks))
+        if nworkers > 1:
+            with multiprocessing.Pool(nworkers) as pool:
+                # Results in the order of the logs (oldest first)
+                results = pool.map(parse, tasks, chunksize = 1)
+        else:
+            results = list(map(parse, tasks))
+        parse_time = time.time() - start_time
+
+
+        #
+        # Merge in log order, so that the result does not depend on the
+        # order in which the workers finished
+        #
+        nrequests = 0
+        rows = []
+        unresolved = []
+        totals = {table: {} for table, _, _ in ROLLUPS}
+        sketch = {table: {} for table, _, _ in SKETCHES}
+        positions = []
+        sessionizer = Sessionizer(index, int(SESSION_WINDOW))
+        for task, result in zip(tasks, results):
+            if result is None:
+                log.warning(f"'{task[0]}' was rotated during the backfill, left for the next run")
+                continue
+            fingerprint, filepath, inode, position, n, r, u, t, h, edges, seconds = result
+            log.debug(
+                f"'{filepath}': {n} requests from offset {task[2]} in {seconds:.2f} seconds"
+            )
+            nrequests += n
+            rows.extend(r)
+            unresolved.extend(u)
+            merge(totals, t)
+            merge_sketches(sketch, h)
+            for session in edges:
+                sessionizer.add_session(session)
+            positions.append((fingerprint, filepath, inode, position))
+        sessionizer.flush()
+        sessions = sessionizer.take()
+        r, u = Sessionizer.rows(sessions)
+        rows.extend(r)
+        unresolved.extend(u)
+        merge(totals, aggregate(r))
+        sketches(sessions, sketch)
+        rows.sort()
+        unresolved.sort()
+        try:
+            insert_rows(db, rows, unresolved, totals, sketch, positions)
+            db.commit()
+        except:
+            db.rollback()
+            raise
+
+
+        expire_logs(db, logs)
+        log_summary(
+            len(positions), nrequests, len(rows), len(unresolved),
+            time.time() - start_time
+        )
+        log.info(
+            f"Backfill: {len(tasks)} logs parsed in {parse_time:.2f} seconds ({nworkers} processes)"
+        )
+        return nrequests
+
+
+
+###############################################################################
+#
+# MAIN
+#
+###############################################################################
+if __name__ == '__main__':
+
+    #
+    # Be nice, we're not in a hurry
+    #
+    os.nice(NICE)
+
+
+    #
+    # Set up logging
+    #
+    log = logging.getLogger(SCRIPTNAME)
+    log.setLevel(LOGLEVEL)
+    handler = logging.handlers.SysLogHandler(address = '/dev/log')
+    handler.setFormatter(
+        logging.Formatter('%(name)s: [%(levelname)s] %(message)s')
+    )
+    log.addHandler(handler)
+
+    #
+    # Resolve user and require to be executed as EXECUTE_AS
+    #
+    running_as = pwd.getpwuid(os.geteuid()).pw_name
+    if running_as != EXECUTE_AS:
+        log.error(
+           f"This job must be executed as {EXECUTE_AS} (started by user '{running_as}')"
+        )
+        os._exit(-1)
+    else:
+        log.debug(f"Started! (executing as '{running_as}')")
+
+
+    #
+    # Read site specific configuration
+    #
+    try:
+        log.debug(f"Reading site configuration '{CONFIG_FILE}'")
+        read_config_file(CONFIG_FILE)
+    except:
+        log.exception(f"Error reading site configuration '{CONFIG_FILE}'")
+        os._exit(-1)
+
+
+    #
+    # Ingest new requests (or all unread logs in parallel, in backfill mode)
+    #
+    try:
+        with sqlite3.connect(DATABASE) as db:
+            if '--backfill' in sys.argv[1:]:
+                backfill(db)
+            else:
+                process(db)
+    except:
+        log.exception("Process failure!")
+        os._exit(-1)
+
+
+# EOF
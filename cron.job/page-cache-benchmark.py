@@ -0,0 +1,108 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Turku University (2020) Department of Future Technologies
+# Course Virtualization / Website / Cron Jobs
+# Benchmark page cache residency of Checksum.file() cache modes.
+#
+# page-cache-benchmark.py
+#   2026-10-19  Initial version.
+#
+#   - Not a cron job. Run manually, as any user:
+#       ./page-cache-benchmark.py [directory] [megabytes]
+#   - Creates two files of 'megabytes' (default 256) into 'directory'
+#     (default: /tmp) and removes them afterwards.
+#
+#
+# FUNCTIONAL DESCRIPTION
+#
+#   "Hot" file is an image that Nginx is serving (fully in the page cache).
+#   "Cold" file is an image no one has read recently (not in the cache).
+#   For each cache mode ('keep', 'cold', 'drop'):
+#       1. Bring hot file into the cache, evict cold file from it.
+#       2. Checksum.file() both files.
+#       3. Report the residency (% of pages in cache) of both files and the
+#          throughput.
+#
+#   Expected result: 'keep' leaves both files cached (cold file has evicted
+#   something else to get there), 'cold' keeps the hot file and leaves the
+#   cold file uncached, 'drop' leaves neither.
+#
+#   Evicting hot pages requires more data than there is memory, which a
+#   benchmark should not do. Pages the checksum leaves behind are what
+#   pushes the hot images out, so the residency of the cold file after the
+#   checksum is the measure to look at.
+#
+import os
+import sys
+import time
+
+from Checksum   import Checksum
+from PageCache  import PageCache
+
+
+def residency(filepath: str) -> float:
+    resident, total = PageCache.file(filepath)
+    return 100 * resident / total if total else 0.0
+
+
+def create(filepath: str, size: int):
+    block = os.urandom(1024 * 1024)
+    with open(filepath, 'wb') as f:
+        for _ in range(size // len(block)):
+            f.write(block)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def warm(filepath: str):
+    """Read file into the page cache."""
+    with open(filepath, 'rb', buffering = 0) as f:
+        while f.read(Checksum.BLOCKSIZE):
+            pass
+
+
+def evict(filepath: str):
+    """Drop file from the page cache."""
+    with open(filepath, 'rb') as f:
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+
+if __name__ == '__main__':
+
+    if not PageCache.available:
+        print("mincore() is not available on this system!")
+        sys.exit(1)
+    directory = sys.argv[1] if len(sys.argv) > 1 else "/tmp"
+    megabytes = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    size = megabytes * 1024 * 1024
+    hot = os.path.join(directory, f"page-cache-benchmark-{os.getpid()}.hot")
+    cold = os.path.join(directory, f"page-cache-benchmark-{os.getpid()}.cold")
+
+    try:
+        print(f"Creating two {megabytes} MB files into '{directory}'...")
+        create(hot, size)
+        create(cold, size)
+        print()
+        print(f"{'mode':<6} {'hot before':>11} {'hot after':>10} {'cold before':>12} {'cold after':>11} {'MB/s':>8}")
+        for mode in ('keep', 'cold', 'drop'):
+            warm(hot)
+            evict(cold)
+            hot_before, cold_before = residency(hot), residency(cold)
+            start = time.perf_counter()
+            Checksum.file(hot, Checksum.ALGORITHMS, mode)
+            Checksum.file(cold, Checksum.ALGORITHMS, mode)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{mode:<6} {hot_before:>10.1f}% {residency(hot):>9.1f}% "
+                f"{cold_before:>11.1f}% {residency(cold):>10.1f}% "
+                f"{2 * megabytes / elapsed:>8.1f}"
+            )
+    finally:
+        for filepath in (hot, cold):
+            if os.path.exists(filepath):
+                os.remove(filepath)
+
+
+# EOF
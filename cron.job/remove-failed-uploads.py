@@ -3,21 +3,40 @@
 #
 # Turku University (2020) Department of Future Technologies
 # Course Virtualization / Website / Cron Jobs
-# Assemble Flow.js upload chunks and create database entry.
+# Remove failed and abandoned Flow.js uploads.
 #
 # remove-failed-uploads.py - Jani Tammi <jasata@utu.fi>
 #   2020-09-13  Skeleton/framework - does not do anything yet.
 #   2020-09-18  Config file now 'site.conf'.
+#   2026-10-19  Implemented as 'cleanup' jobs (JobQueue.py).
+#   2026-10-19  Run and job metrics recorded (JobRun), old metrics purged.
 #
 #   - Job added to crontab by 'setup.py'.
 #   - Logging to syslog.
 #   - Must be executed as 'root'.
 #
 #
+# FUNCTIONAL DESCRIPTION
+#
+#   1. Enqueue a 'cleanup' job for each Flow.js upload that
+#       a) has an 'assemble' job that failed (no attempts left), or
+#       b) has chunks in UPLOAD_DIR, but no '.job' file or 'assemble' job
+#          (upload was abandoned by the client).
+#      ...and has not been touched in FAILED_UPLOAD_AGE seconds.
+#   2. Claim 'cleanup' jobs one at the time, remove the upload files
+#      ('{flowid}.*') from UPLOAD_DIR and the 'assemble' job.
+#   3. Purge 'done' jobs older than JOB_RETENTION seconds from the job queue.
+#   4. Purge run history and job metrics older than METRICS_RETENTION seconds.
+#
 import os
 import pwd
+import glob
+import time
 import logging
 import logging.handlers
+import sqlite3
+
+from JobQueue   import JobQueue, JobRun, LeaseLost
 
 # pylint: disable=undefined-variable
 
@@ -27,6 +46,11 @@ EXECUTE_AS      = "root"
 LOGLEVEL        = logging.INFO  # logging.[DEBUG|INFO|WARNING|ERROR|CRITICAL]
 CONFIG_FILE     = "site.conf" # All instance/site specific values
 
+# Settings specific for this script (and, unlikely to change)
+FAILED_UPLOAD_AGE   = 24 * 3600         # Seconds
+JOB_RETENTION       = 30 * 24 * 3600    # Seconds
+METRICS_RETENTION   = 365 * 24 * 3600   # Seconds
+
 SCRIPTNAME = os.path.basename(__file__)
 
 
@@ -48,6 +72,31 @@ def read_config_file(cfgfile: str):
 
 
 
+def upload_files() -> dict:
+    """Returns a dictionary of Flow.js uploads in UPLOAD_DIR: {flowid: {'job': bool, 'mtime': float}}, where 'mtime' is the latest modification of any file of that upload."""
+    uploads = {}
+    for entry in os.scandir(UPLOAD_DIR):
+        if not entry.is_file():
+            continue
+        # '{flowid}.0001', '{flowid}.job', '{flowid}.error'
+        flowid, _, suffix = entry.name.partition('.')
+        upload = uploads.setdefault(flowid, {'job': False, 'mtime': 0})
+        upload['job'] |= (suffix == 'job')
+        upload['mtime'] = max(upload['mtime'], entry.stat().st_mtime)
+    return uploads
+
+
+
+def remove_upload(flowid: str) -> int:
+    """Remove all files of an upload from UPLOAD_DIR. Returns the number of files removed."""
+    n = 0
+    for filepath in glob.glob(os.path.join(UPLOAD_DIR, f"{flowid}.*")):
+        os.remove(filepath)
+        n += 1
+    return n
+
+
+
 ###############################################################################
 #
 # MAIN
@@ -98,13 +147,104 @@ if __name__ == '__main__':
 
 
     #
-    # ACTUAL WORK GOES HERE
+    # Enqueue 'cleanup' jobs
     #
     try:
-        log.info("NOT YET IMPLEMENTED!")
+        db = sqlite3.connect(DATABASE)
+        run = JobRun(db, SCRIPTNAME)
+        assembly = JobQueue(db, 'assemble')
+        queue = JobQueue(db, 'cleanup', run = run)
+        expired = time.time() - FAILED_UPLOAD_AGE
+        # 'assemble' jobs: {flowid: state}
+        assembly_state = dict(
+            db.execute(
+                "SELECT target, state FROM job WHERE task = 'assemble'"
+            ).fetchall()
+        )
+        for flowid, upload in upload_files().items():
+            if upload['mtime'] > expired:
+                continue
+            state = assembly_state.get(flowid)
+            if state == 'failed' or (state is None and not upload['job']):
+                if queue.enqueue(flowid):
+                    log.debug(f"Upload '{flowid}' queued for removal")
     except:
-        log.exception("Process failure! Database might need manual clean-up!")
+        log.exception("Job queueing failed!")
         os._exit(-1)
 
 
+    #
+    # Execute 'cleanup' jobs
+    #
+    n_removed = 0
+    while True:
+        try:
+            claimed = queue.claim()
+        except Exception as e:
+            log.exception("Unable to claim a job!")
+            break
+        if not claimed:
+            break
+        job = claimed[0]
+        try:
+            # Upload may have been restarted after the job was queued
+            state = db.execute(
+                "SELECT state FROM job WHERE task = 'assemble' AND target = ?",
+                [job.target]
+            ).fetchone()
+            if state and state[0] in ('queued', 'running'):
+                log.info(f"Upload '{job.target}' is being assembled, skipping")
+            else:
+                n = remove_upload(job.target)
+                assembly.remove(job.target)
+                n_removed += 1
+                log.info(f"Removed upload '{job.target}' ({n} files)")
+        except Exception as e:
+            log.exception(f"Removing upload '{job.target}' failed!")
+            job.fail(str(e))
+        else:
+            try:
+                job.complete()
+            except LeaseLost:
+                log.error(f"Lease lost before completion ({str(job)})")
+    try:
+        run.finish()
+    except:
+        log.exception("Recording run metrics failed!")
+
+
+    #
+    # Purge old completed jobs
+    #
+    try:
+        cursor = db.execute(
+            "DELETE FROM job WHERE state = 'done' AND updated < ?",
+            [int(time.time() - JOB_RETENTION)]
+        )
+        db.commit()
+        if cursor.rowcount:
+            log.info(f"{cursor.rowcount} completed jobs purged")
+    except:
+        db.rollback()
+        log.exception("Purging completed jobs failed!")
+    try:
+        expired = int(time.time() - METRICS_RETENTION)
+        db.execute(
+            "DELETE FROM job_metric WHERE run_id IN (SELECT id FROM job_run WHERE started < ?)",
+            [expired]
+        )
+        cursor = db.execute("DELETE FROM job_run WHERE started < ?", [expired])
+        db.commit()
+        if cursor.rowcount:
+            log.info(f"{cursor.rowcount} job runs purged from metrics")
+    except:
+        db.rollback()
+        log.exception("Purging job metrics failed!")
+    db.close()
+
+    log.info(
+        f"{n_removed} failed uploads removed, execution time {(time.time() - script_start_time):.2f} seconds"
+    )
+
+
 # EOF
@@ -0,0 +1,284 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Turku University (2020) Department of Future Technologies
+# Course Virtualization / Website / Cron Jobs
+# Verify that the images in DOWNLOAD_DIR still match their checksums.
+#
+# scrub-download-folder.py
+#   2026-10-19  Initial version.
+#   2026-10-19  Reads also charged to IOThrottle.py.
+#   2026-10-19  Jobs are enqueued in one transaction (.enqueue_all()).
+#
+#   - Job added to crontab by 'setup.py'.
+#   - Logging to syslog.
+#   - Must be executed as 'www-data'.
+#   - Not hosted by 'background-worker.py' - a run takes up to SCRUB_TIME
+#     and would hold up the other tasks.
+#
+#
+# FUNCTIONAL DESCRIPTION
+#
+#   Images are checksummed once, when they are published. Disk errors (or
+#   an accidental overwrite) after that would go unnoticed and students
+#   would download corrupted images. This script re-reads the images
+#   slowly, in the background, and compares them to the 'file' table
+#   checksums.
+#
+#   1. Enqueue a 'scrub' job for each 'file' row that has checksums and has
+#      not been verified in SCRUB_INTERVAL days (JobQueue.py).
+#   2. Claim due jobs one at the time, least recently verified file first
+#      (never verified files before all others).
+#   3. Read the file once (Checksum.py), no faster than SCRUB_RATE bytes per
+#      second (or the shared IO throttle, IOThrottle.py, if it is slower),
+#      and compare to every checksum column that has a value.
+#   4. Update 'file.integrity' and 'file.verified' (sql/core.sql):
+#           'ok'        All checksums match.
+#           'mismatch'  File content has changed. File.download() refuses
+#                       to send the file.
+#           'missing'   File does not exist in DOWNLOAD_DIR.
+#   5. Stop claiming new jobs after SCRUB_TIME seconds. Remaining jobs stay
+#      queued and the next run continues from them.
+#
+#   Configuration (CONFIG_FILE, defaults below):
+#       SCRUB_RATE      Read budget, bytes per second.
+#       SCRUB_TIME      Seconds, after which no new files are started.
+#       SCRUB_INTERVAL  Days between the verifications of a file.
+#
+#   Files are verified whole (digest state cannot be saved), so a run can
+#   exceed SCRUB_TIME by the time it takes to read one image.
+#
+import os
+import pwd
+import time
+import logging
+import logging.handlers
+import sqlite3
+
+from JobQueue   import JobQueue, JobRun, LeaseLost
+from Checksum   import Checksum
+from IOThrottle import IOThrottle
+
+# pylint: disable=undefined-variable
+
+# Unprivileged os.nice() values: 0 ... 20 (= lowest priority)
+NICE            = 20
+EXECUTE_AS      = "www-data"
+LOGLEVEL        = logging.INFO  # logging.[DEBUG|INFO|WARNING|ERROR|CRITICAL]
+CONFIG_FILE     = "site.conf" # All instance/site specific values
+# Defaults for site configuration values (if not in CONFIG_FILE)
+SCRUB_RATE      = str(10 * 1024 * 1024)
+SCRUB_TIME      = str(50 * 60)
+SCRUB_INTERVAL  = "30"
+
+SCRIPTNAME = os.path.basename(__file__)
+
+
+
+def read_config_file(cfgfile: str):
+    """Reads (with ConfigParser()) '[Site]' and creates global variables. Argument 'cfgfile' has to be a filename only (not path + file) and the file must exist in the same directory as this script."""
+    cfgfile = os.path.join(
+        os.path.split(os.path.realpath(__file__))[0],
+        cfgfile
+    )
+    if not os.path.exists(cfgfile):
+        raise FileNotFoundError(f"Site configuration '{cfgfile}' not found!")
+    import configparser
+    cfg = configparser.ConfigParser()
+    cfg.optionxform = lambda option: option # preserve case
+    cfg.read(cfgfile)
+    for k, v in cfg.items('Site'):
+        globals()[k] = v
+
+
+
+class Throttle():
+    """Checksum.file() progress callback that sleeps to keep the read rate at or below 'rate' bytes per second, and charges the reads to the shared IO throttle. Renews the job lease while doing so."""
+
+    def __init__(self, rate: int, job, io: IOThrottle):
+        self.rate   = rate
+        self.job    = job
+        self.io     = io.counter()
+        self.start  = time.time()
+
+
+    def __call__(self, nbytes: int):
+        self.io(nbytes)
+        ahead = nbytes / self.rate - (time.time() - self.start)
+        if ahead > 0:
+            time.sleep(ahead)
+        self.job.heartbeat()
+
+
+
+def verify(job, expected: dict, rate: int, io: IOThrottle) -> str:
+    """Read the file once and compare it to 'expected' {algorithm: hexdigest}. Returns 'ok', 'mismatch' or 'missing'."""
+    filepath = os.path.join(DOWNLOAD_DIR, job.payload['name'])
+    if not os.path.isfile(filepath):
+        return 'missing'
+    digests = Checksum.file(
+        filepath,
+        list(expected.keys()),
+        progress = Throttle(rate, job, io)
+    )
+    job.bytes_read = os.stat(filepath).st_size
+    mismatched = [a for a in expected if digests[a] != expected[a].lower()]
+    if mismatched:
+        log.error(
+            f"File '{job.payload['name']}' does not match its " + ", ".join(
+                f"{a.upper()} (expected {expected[a]}, calculated {digests[a]})"
+                for a in mismatched
+            )
+        )
+        return 'mismatch'
+    return 'ok'
+
+
+
+def process(db: sqlite3.Connection) -> int:
+    """Enqueue 'scrub' jobs and execute them until none are due or SCRUB_TIME has passed. Returns the number of files verified. Requires site configuration (read_config_file()) and module global 'log'."""
+    rate = int(SCRUB_RATE)
+    io = IOThrottle.from_config(globals())
+    deadline = time.time() + int(SCRUB_TIME)
+    stale = int(time.time()) - int(SCRUB_INTERVAL) * 24 * 3600
+    columns = ", ".join(Checksum.ALGORITHMS)
+    with JobRun(db, SCRIPTNAME) as run:
+        # Lease is renewed by the Throttle, after each block
+        jobs = JobQueue(db, 'scrub', run = run)
+        rows = db.execute(
+            f"""
+            SELECT      id, name, verified, {columns}
+            FROM        file
+            WHERE       sha1 IS NOT NULL
+                        AND
+                        (verified IS NULL OR verified < ?)
+            """,
+            [stale]
+        ).fetchall()
+        # {id: (verified, name, {algorithm: hexdigest})}
+        files = {}
+        for id, name, verified, *digests in rows:
+            files[str(id)] = (
+                verified or 0,
+                name,
+                {
+                    a: d
+                    for a, d in zip(Checksum.ALGORITHMS, digests)
+                    if d
+                }
+            )
+        jobs.enqueue_all({id: {'name': name} for id, name, *_ in rows})
+        # Least recently verified first
+        pending = sorted(
+            (files[target][0], int(target), target)
+            for target, _ in jobs.due()
+            if target in files
+        )
+
+
+        nverified = 0
+        nbytes = 0
+        start_time = time.time()
+        for n, (_, _, target) in enumerate(pending):
+            if time.time() > deadline:
+                log.info(
+                    f"SCRUB_TIME ({SCRUB_TIME} s) used, {len(pending) - n} files left for the next run"
+                )
+                break
+            claimed = jobs.claim(targets = [target])
+            if not claimed:
+                # Claimed by another instance
+                continue
+            job = claimed[0]
+            try:
+                integrity = verify(job, files[target][2], rate, io)
+                db.execute(
+                    "UPDATE file SET integrity = ?, verified = ? WHERE id = ?",
+                    [integrity, int(time.time()), int(target)]
+                )
+                db.commit()
+            except LeaseLost:
+                log.error(f"Lease lost while verifying ({str(job)})")
+                continue
+            except Exception as e:
+                db.rollback()
+                log.exception(f"Verification failed ({str(job)})")
+                job.fail(str(e))
+                continue
+            try:
+                job.complete()
+            except LeaseLost:
+                log.error(f"Lease lost before completion ({str(job)})")
+                continue
+            nverified += 1
+            nbytes += job.bytes_read
+            log.info(f"File '{job.payload['name']}': {integrity}")
+        if nverified:
+            elapsed = time.time() - start_time
+            log.info(
+                f"{nverified} files verified, {nbytes / 1048576:.1f} MB in {elapsed:.2f} seconds ({nbytes / 1048576 / elapsed:.1f} MB/s)"
+            )
+        return nverified
+
+
+
+###############################################################################
+#
+# MAIN
+#
+###############################################################################
+if __name__ == '__main__':
+
+    #
+    # Be nice, we're not in a hurry
+    #
+    os.nice(NICE)
+
+
+    #
+    # Set up logging
+    #
+    log = logging.getLogger(SCRIPTNAME)
+    log.setLevel(LOGLEVEL)
+    handler = logging.handlers.SysLogHandler(address = '/dev/log')
+    handler.setFormatter(
+        logging.Formatter('%(name)s: [%(levelname)s] %(message)s')
+    )
+    log.addHandler(handler)
+
+    #
+    # Resolve user and require to be executed as EXECUTE_AS
+    #
+    running_as = pwd.getpwuid(os.geteuid()).pw_name
+    if running_as != EXECUTE_AS:
+        log.error(
+           f"This job must be executed as {EXECUTE_AS} (started by user '{running_as}')"
+        )
+        os._exit(-1)
+    else:
+        log.debug(f"Started! (executing as '{running_as}')")
+
+
+    #
+    # Read site specific configuration
+    #
+    try:
+        log.debug(f"Reading site configuration '{CONFIG_FILE}'")
+        read_config_file(CONFIG_FILE)
+    except:
+        log.exception(f"Error reading site configuration '{CONFIG_FILE}'")
+        os._exit(-1)
+
+
+    #
+    # Enqueue and execute jobs
+    #
+    try:
+        with sqlite3.connect(DATABASE) as db:
+            process(db)
+    except:
+        log.exception("Process failure!")
+        os._exit(-1)
+
+
+# EOF
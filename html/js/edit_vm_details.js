@@ -4,6 +4,7 @@
  *
  *  2020-08-30  Initial version.
  *  2020-09-23  Add byte size handling (kB, MB, GB...)
+ *  2026-10-19  Add SHA256 and BLAKE2b checksums.
  *
  *  REQUIRES A <FORM ID="fileForm">
  */
@@ -42,6 +43,18 @@ form = {
             "readonly":     true,
             "placeholder":  "Checksum will be calculated automatically later..."
         },
+        {
+            "key":          "sha256",
+            "title":        "File Checksum (SHA256)",
+            "readonly":     true,
+            "placeholder":  "Checksum will be calculated automatically later..."
+        },
+        {
+            "key":          "blake2b",
+            "title":        "File Checksum (BLAKE2b)",
+            "readonly":     true,
+            "placeholder":  "Checksum will be calculated automatically later..."
+        },
         {
             "key":          "label",
             "title":        "Label",
@@ -14,6 +14,13 @@
 #   2020-09-09  Add /api/file/flow  (Flow.js GET, POST upload endpoint)
 #   2020-09-12  Add /sse/flow-upload-status
 #   2020-09-23  Clean obsolete code
+#   2026-10-19  Add /api/file/flow/status
+#   2026-10-19  Add /api/sys/jobs
+#   2026-10-19  Add /api/statistics
+#   2026-10-19  Add /api/file/export and /api/statistics/export
+#   2026-10-19  Unique downloader estimates in /api/statistics
+#   2026-10-19  /api/statistics limited by role (file.downloadable_to)
+#   2026-10-19  /api/statistics/export limited by role (file.downloadable_to)
 #
 #
 #   This Python module only defines the routes, which the application.py
@@ -111,6 +118,53 @@ def api_file(ftype = None):
 
 
 
+#
+#   Streamed exports (constant memory, rows are read from the cursor in
+#   batches as the response is sent).
+#
+#   URL parameter 'format' selects the output:
+#       csv     Comma separated values, header row (default)
+#       ndjson  Newline delimited JSON, one object per row
+#
+export_formats = {
+    'csv':      api.stream_result_as_csv,
+    'ndjson':   api.stream_result_as_ndjson
+}
+
+def export_format(request):
+    fmt = request.args.get('format', default = 'csv')
+    if fmt not in export_formats:
+        raise api.InvalidArgument(
+            f"Invalid format '{fmt}'! Must be one of: " +
+            ", ".join(export_formats.keys())
+        )
+    return export_formats[fmt]
+
+
+@app.route('/api/file/export', methods=['GET'], strict_slashes = False)
+def api_file_export():
+    """Stream the list of downloadable files (same as /api/file) as CSV or NDJSON. Optional URL parameters: 'format' ("csv" (default) or "ndjson") and 'type' ("vm" or "usb").
+
+    GET /api/file/export?format=ndjson&type=vm
+    API returns 200 OK and streams an attachment."""
+    log_request(request)
+    try:
+        stream = export_format(request)
+        ftype = request.args.get('type')
+        if ftype not in (None, "usb", "vm"):
+            raise api.InvalidArgument(f"Invalid type '{ftype}'!")
+        return stream(
+            api.File().query(
+                file_type = ftype,
+                downloadable_to = sso.role
+            ),
+            "files"
+        )
+    except Exception as e:
+        return api.exception_response(e)
+
+
+
 #
 #   /api/file/<int:id>/schema
 #
@@ -253,6 +307,47 @@ RETURN CODES
         return str(e), 400
 
 
+#
+# Assembly status (/api/file/flow/status)
+#
+#   JSON alternative to the SSE stream above. Returns the progress of the
+#   background assembly of a completed Flow.js upload.
+#
+@app.route(
+    '/api/file/flow/status',
+    methods=['GET'],
+    strict_slashes = False
+)
+def flow_assembly_status():
+    """Assembly progress of an uploaded file. Required URL parameter: 'flowid'.
+
+    GET /api/file/flow/status?flowid=<flowid>
+    API returns 200 OK and:
+    {
+        ...,
+        "data" : {
+            "state"     : "queued" | "running" | "done" | "failed",
+            "attempts"  : <int>,
+            "error"     : <str>,
+            "bytes"     : <int>,    bytes assembled so far
+            "total"     : <int>,    bytes in total
+            "percent"   : <float>,
+            "rate"      : <float>,  bytes per second
+            "eta"       : <int>     seconds
+        },
+        ...
+    }
+    404 Not Found, if the upload has not been queued for assembly."""
+    log_request(request)
+    try:
+        flowid = request.args.get('flowid', type = str)
+        if not flowid:
+            raise api.InvalidArgument("URL parameter 'flowid' is required!")
+        return api.response(api.Flow.upload_status(flowid))
+    except Exception as e:
+        return api.exception_response(e)
+
+
 #
 # Flow.js API endpoint (/api/file/flow)
 #
@@ -301,6 +396,146 @@ def flow_chunk_upload():
         return "Internal server error! Contact administration!", 500
 
 
+###############################################################################
+#
+# Background job metrics
+#
+@app.route('/api/sys/jobs', methods=['GET'], strict_slashes = False)
+def api_sys_jobs():
+    """Background job (assembly, checksum, import, cleanup) metrics. Teachers only. Optional URL parameters: 'days' (default 7) and 'runs' (default 20).
+
+    GET /api/sys/jobs?days=7&runs=20
+    API returns 200 OK and:
+    {
+        ...,
+        "data" : {
+            "days"  : 7,
+            "tasks" : {
+                "assemble" : {
+                    "jobs"          : <int>,
+                    "done"          : <int>,
+                    "retry"         : <int>,
+                    "failed"        : <int>,
+                    "bytes_read"    : <int>,
+                    "bytes_written" : <int>,
+                    "duration"      : {
+                        "p50" : <float>, "p90" : <float>, "p95" : <float>,
+                        "p99" : <float>, "max" : <float>, "mean" : <float>
+                    },
+                    "read_mbps"     : <float>,
+                    "write_mbps"    : <float>
+                },
+                ...
+            },
+            "runs" : [
+                {
+                    "id" : <int>, "script" : <str>, "started" : <int>,
+                    "duration" : <float>, "jobs" : <int>, "mbps" : <float>,
+                    "outcome" : "ok" | "error", "error" : <str>, ...
+                },
+                ...
+            ]
+        }
+    }"""
+    log_request(request)
+    try:
+        if not sso.is_teacher:
+            raise api.Unauthorized("Active teacher privileges required")
+        days = request.args.get('days', default = 7, type = int)
+        runs = request.args.get('runs', default = 20, type = int)
+        if days < 1 or runs < 0:
+            raise api.InvalidArgument("'days' must be positive and 'runs' zero or more!")
+        return api.response(api.JobMetrics().summary(days, runs))
+    except Exception as e:
+        return api.exception_response(e)
+
+
+
+###############################################################################
+#
+# Download statistics
+#
+@app.route('/api/statistics', methods=['GET'], strict_slashes = False)
+def api_statistics():
+    """Download statistics from the daily or monthly rollups. Optional URL parameters: 'period' ("daily" or "monthly", default), 'since' and 'until' (inclusive, "YYYY-MM-DD" or "YYYY-MM", according to 'period') and 'file_id' (one file instance). 'downloaders' are estimates of distinct downloaders (HyperLogLog sketches, about 1.6 % error), null if no sketches exist for the period. Teachers see the statistics of all file instances (also deleted), other roles only of the files they can download.
+
+    GET /api/statistics?period=monthly&since=2026-01&until=2026-12
+    API returns 200 OK and:
+    {
+        ...,
+        "data" : {
+            "period"    : "monthly",
+            "since"     : "2026-01",
+            "until"     : "2026-12",
+            "downloaders" : <int>,
+            "files"     : [
+                {
+                    "file_id"   : <int>,
+                    "filename"  : <str>,
+                    "size"      : <int>,
+                    "downloads" : <int>,
+                    "complete"  : <int>,
+                    "partial"   : <int>,
+                    "bytes"     : <int>,
+                    "downloaders" : <int>
+                },
+                ...
+            ],
+            "series"    : [
+                {
+                    "month"     : "2026-01",
+                    "downloads" : <int>,
+                    "complete"  : <int>,
+                    "partial"   : <int>,
+                    "bytes"     : <int>,
+                    "downloaders" : <int>
+                },
+                ...
+            ]
+        }
+    }"""
+    log_request(request)
+    try:
+        return api.response(
+            api.Statistics().downloads(
+                request.args.get('period', default = 'monthly'),
+                request.args.get('since'),
+                request.args.get('until'),
+                request.args.get('file_id', type = int),
+                downloadable_to = None if sso.is_teacher else sso.role
+            )
+        )
+    except Exception as e:
+        return api.exception_response(e)
+
+
+
+@app.route('/api/statistics/export', methods=['GET'], strict_slashes = False)
+def api_statistics_export():
+    """Stream download statistics as CSV or NDJSON, one row per period and file instance. Optional URL parameters: 'format' ("csv" (default) or "ndjson"), and 'period', 'since', 'until' and 'file_id' as in /api/statistics. Rows are limited by role as in /api/statistics.
+
+    GET /api/statistics/export?format=csv&period=daily&since=2026-01-01
+    API returns 200 OK and streams an attachment. Columns:
+        day | month, file_id, filename, size, downloads, complete, partial, bytes, downloaders"""
+    log_request(request)
+    try:
+        stream = export_format(request)
+        period = request.args.get('period', default = 'monthly')
+        return stream(
+            api.Statistics().query(
+                period,
+                request.args.get('since'),
+                request.args.get('until'),
+                request.args.get('file_id', type = int),
+                downloadable_to = None if sso.is_teacher else sso.role
+            ),
+            f"statistics-{period}"
+        )
+    except Exception as e:
+        return api.exception_response(e)
+
+
+
 ###############################################################################
 #
 # SSO API endpoints for Single Sign-On implementation
@@ -30,6 +30,18 @@
 #               inline with other config file naming.
 #   2020-09-18  Add ALLOWED_EXT to 'cron.jobs/site.conf'.
 #   2020-09-27  Change database script location to 'sql/'.
+#   2026-10-19  Add 'sql/background_jobs.sql'.
+#   2026-10-19  Add CHECKSUMS to 'cron.job/site.conf'.
+#   2026-10-19  Add STATE_DIR to 'cron.job/site.conf' and create it.
+#   2026-10-19  Add 'scrub-download-folder.py' cron job.
+#   2026-10-19  Add IO throttle settings (IO_*) to 'cron.job/site.conf'.
+#   2026-10-19  Add OWNER (of imported files) to 'cron.job/site.conf'.
+#   2026-10-19  Add ACCESS_LOG and 'ingest-access-log.py' cron job.
+#   2026-10-19  Add 'archive-downloads.py' cron job.
+#   2026-10-19  Install 'vm-background-worker.service' (systemd) and add
+#               BACKGROUND_WORKER_PIDFILE into instance/application.conf.
+#   2026-10-19  Remove the cron jobs of the tasks that the background worker
+#               hosts (checksums, flow chunks, download folder import).
 #
 #
 #   ==> REQUIRES ROOT PRIVILEGES TO RUN! <==
@@ -38,7 +50,8 @@
 #   1. Creates instance/application.conf
 #   2. Creates application.sqlite3
 #   3. If DEV, inserts test data into application.sqlite3
-#   4. Creates cron jobs
+#   4. Creates cron jobs (and removes those replaced by the service)
+#   5. Installs and (re)starts the background worker service (systemd)
 #
 #
 #   IMPORTANT NOTE!
@@ -149,6 +162,9 @@ defaults = {
         'upload_folder':            ROOTPATH + '/uploads',
         'upload_allowed_ext':       ['ova', 'zip', 'img', 'iso'],
         'download_folder':          '/var/www/downloads',
+        'state_folder':             ROOTPATH + '/state',
+        'import_owner':             'jmjmak',   # Teacher uid
+        'access_log':               '/var/log/nginx/vm.utu.fi.access.log',
         'download_urlpath':         '/x-accel-redirect/',
         'sso_cookie':               'ssoUTUauth',
         'sso_session_api':          'https://sso.utu.fi/sso/json/sessions/',
@@ -193,6 +209,11 @@ dbscripts = [
         "filename": os.path.join(ROOTPATH, "sql/download_statistics.sql"),
         "mode":     [ "DEV", "UAT", "PRD" ]
     },
+    {
+        "label":    "Background Job Queue",
+        "filename": os.path.join(ROOTPATH, "sql/background_jobs.sql"),
+        "mode":     [ "DEV", "UAT", "PRD" ]
+    },
     {
         "label":    "Virtualization Team Teacher Roles",
         "filename": os.path.join(ROOTPATH, "sql/insert_teachers.sql"),
@@ -220,16 +241,38 @@ cronjobs = {
         'script':   'cron.job/remove-failed-uploads.py',
         'schedule': '0 3 * * *'         # At 03:00 every day
     },
+    'verify vm images against their checksums':
+    {
+        'script':   'cron.job/scrub-download-folder.py',
+        'schedule': '5 * * * *',        # Hourly (runs up to SCRUB_TIME)
+        'user':     'www-data'
+    },
+    'ingest download events from nginx access logs':
+    {
+        'script':   'cron.job/ingest-access-log.py',
+        'schedule': '30 2 * * *'        # At 02:30 every day
+    },
+    'archive download events of closed months':
+    {
+        'script':   'cron.job/archive-downloads.py',
+        'schedule': '30 3 1 * *',       # At 03:30 on the 1st of each month
+        'user':     'www-data'
+    }
+}
+
+# Jobs hosted by 'cron.job/background-worker.py' (vm-background-worker.service).
+# Crontab entries installed by earlier versions of this script are removed.
+obsolete_cronjobs = {
     'calculate SHA1 checksums':
     {
         'script':   'cron.job/calculate-checksum.py',
-        'schedule': '*/5 * * * *',      # Every 5 minutes
+        'schedule': '*/5 * * * *',
         'user':     'www-data'
     },
     'assemble flow chunks':
     {
         'script':   'cron.job/flow-upload-processor.py',
-        'schedule': '*/1 * * * *',      # Every minute
+        'schedule': '*/1 * * * *',
         'user':     'www-data'
     },
     'import orphaned vm images from download directory':
@@ -237,6 +280,12 @@ cronjobs = {
         'script':   'cron.jobs/import-download-folder.py',
         'schedule': '*/15 * * * *',
         'user':     'www-data'
+    },
+    'import orphaned vm images from download directory (cron.job)':
+    {
+        'script':   'cron.job/import-download-folder.py',
+        'schedule': '*/15 * * * *',
+        'user':     'www-data'
     }
 }
 
@@ -505,12 +554,38 @@ UPLOAD_ALLOWED_EXT      = {{upload_allowed_ext}}
 DOWNLOAD_FOLDER         = '{{download_folder}}'
 DOWNLOAD_URLPATH        = '{{download_urlpath}}'
 
+
+#
+# Background worker (cron.job/background-worker.py), woken up on uploads
+#
+BACKGROUND_WORKER_PIDFILE = '{{state_folder}}/background-worker.pid'
+
 # EOF
 
 """,
     GITUSER, 'www-data'
 )
 
+files['vm-background-worker.service'] = ConfigFile(
+    '/etc/systemd/system/vm-background-worker.service',
+    """# Automatically generated by setup.py
+[Unit]
+Description=vm.utu.fi background worker
+After=network.target
+
+[Service]
+User=www-data
+ExecStart={{rootpath}}/cron.job/background-worker.py
+ExecReload=/bin/kill -HUP $MAINPID
+Restart=on-failure
+TimeoutStopSec=60
+
+[Install]
+WantedBy=multi-user.target
+""",
+    'root', 'root'
+)
+
 
 ###############################################################################
 #
@@ -752,8 +827,20 @@ if __name__ == '__main__':
         sitecfg.set('Site', 'DOWNLOAD_DIR', cfg['download_folder'])
         sitecfg.set('Site', 'DATABASE',     os.path.join(ROOTPATH, 'application.sqlite3'))
         sitecfg.set('Site', 'ALLOWED_EXT',  ', '.join(cfg['upload_allowed_ext']))
+        sitecfg.set('Site', 'CHECKSUMS',    'sha1, sha256, blake2b')
+        sitecfg.set('Site', 'STATE_DIR',    cfg['state_folder'])
+        sitecfg.set('Site', 'OWNER',        cfg['import_owner'])
+        sitecfg.set('Site', 'ACCESS_LOG',   cfg['access_log'])
+        # Background IO throttle (cron.job/IOThrottle.py), bytes per second
+        sitecfg.set('Site', 'IO_RATE',      str(100 * 1024 * 1024))
+        sitecfg.set('Site', 'IO_ADAPTIVE',  'yes')
         with open("cron.job/site.conf", "w") as sitecfgfile:
             sitecfg.write(sitecfgfile)
+        # State files of the cron jobs (digest cache, etc.)
+        log.info(f"Creating state directory '{cfg['state_folder']}'")
+        do_or_die(f"mkdir -p {cfg['state_folder']}")
+        do_or_die(f"chown {GITUSER}.www-data {cfg['state_folder']}")
+        do_or_die(f"chmod 2775 {cfg['state_folder']}")
         # Required cronjobs dictionary keys ('script', 'schedule'):
         #   { 'titlestring':
         #       {'script': str, 'schedule': str[,'user': str]},
@@ -775,6 +862,26 @@ if __name__ == '__main__':
                     )
             log.info(f"Creating cron job to {title}")
             cronjob.create()
+        # Replaced by the background worker service (step 5)
+        for title, jobDict in obsolete_cronjobs.items():
+            cronjob = CronJob(**jobDict)
+            if cronjob.exists:
+                cronjob.remove()
+                log.info(f"Obsolete job '{title}' removed")
+
+
+
+        #
+        # 5. Install and (re)start the background worker service
+        #
+        service = files['vm-background-worker.service']
+        log.info(f"Installing background worker service '{service.name}'")
+        service.replace('{{rootpath}}', ROOTPATH)
+        # Unit is generated from this repository, always overwritten
+        service.create(overwrite = True)
+        do_or_die("systemctl daemon-reload")
+        do_or_die("systemctl enable vm-background-worker.service")
+        do_or_die("systemctl restart vm-background-worker.service")
 
 
     except Exception as e:
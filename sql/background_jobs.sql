@@ -0,0 +1,135 @@
+--
+-- background_jobs.sql - Job queue for vm.utu.fi background workers
+--
+-- 2026-10-19   Initial version.
+-- 2026-10-19   Add progress columns ('progress', 'total', 'rate').
+-- 2026-10-19   Add run history and metrics tables ('job_run', 'job_metric').
+--
+--
+-- Background job queue
+--
+--      Cron jobs ('cron.job/*.py') no longer coordinate by renaming files or
+--      by writing "scheduled on ..." messages into data columns. Instead, each
+--      unit of work is a row in the 'job' table, identified by the type of
+--      work ('task') and the entity it concerns ('target'):
+--
+--          task            target
+--          'assemble'      Flow.js identifier (flowid)
+--          'checksum'      file.id
+--          'import'        filename in DOWNLOAD_DIR
+--          'cleanup'       Flow.js identifier (flowid)
+--          'scrub'         file.id
+--
+--      Producers (the scan phase of each cron job) INSERT rows. Workers claim
+--      rows inside a write transaction (BEGIN IMMEDIATE), which makes the
+--      claim atomic even when several worker processes run at the same time.
+--
+-- States
+--
+--      'queued'    Waiting for a worker. Not claimed before 'not_before'.
+--      'running'   Claimed by 'lease_owner' until 'lease_expires'. Worker must
+--                  renew the lease (heartbeat) while it is working. A running
+--                  job with an expired lease is considered abandoned (crashed
+--                  worker) and is claimed again by the next worker.
+--      'done'      Completed. A new enqueue for the same task and target
+--                  re-arms the row (back to 'queued').
+--      'failed'    Failed 'max_attempts' times. Stays failed until removed by
+--                  an administrator or by the cleanup job.
+--
+--      Failed attempts are retried with exponential backoff ('not_before').
+--
+-- Progress
+--
+--      Workers that know the size of their work (assembly) publish the
+--      bytes done ('progress'), bytes in total ('total') and the current
+--      throughput ('rate', bytes per second) at a fixed interval. These are
+--      served to the client by the upload status API and SSE stream.
+--
+-- Run history and metrics
+--
+--      Each execution of a background script that did any work (or failed)
+--      is recorded into 'job_run', and each job it finished (completed or
+--      failed) into 'job_metric'. Durations are in seconds, MB/s is derived
+--      from the byte counts and durations (API endpoint '/api/sys/jobs').
+--
+--      'job_metric.outcome'    'done'      Job completed.
+--                              'retry'     Job failed and will be retried.
+--                              'failed'    Job failed, no attempts left.
+--      'job_run.outcome'       'ok'        Script completed its run.
+--                              'error'     Script failed (see 'error').
+--
+--      Rows older than METRICS_RETENTION are purged by
+--      'remove-failed-uploads.py'.
+--
+-- Existing databases
+--
+--      This script can be applied to an existing database, all statements
+--      are conditional:
+--
+--          sqlite3 application.sqlite3 < sql/background_jobs.sql
+--
+CREATE TABLE IF NOT EXISTS job
+(
+    id                  INTEGER     NOT NULL PRIMARY KEY AUTOINCREMENT,
+    task                TEXT        NOT NULL,
+    target              TEXT        NOT NULL,
+    payload             TEXT            NULL,
+    state               TEXT        NOT NULL DEFAULT 'queued',
+    attempts            INTEGER     NOT NULL DEFAULT 0,
+    max_attempts        INTEGER     NOT NULL DEFAULT 5,
+    not_before          INTEGER     NOT NULL DEFAULT (strftime('%s', 'now')),
+    lease_owner         TEXT            NULL,
+    lease_expires       INTEGER         NULL,
+    heartbeat           INTEGER         NULL,
+    error               TEXT            NULL,
+    progress            INTEGER         NULL,
+    total               INTEGER         NULL,
+    rate                REAL            NULL,
+    created             INTEGER     NOT NULL DEFAULT (strftime('%s', 'now')),
+    updated             INTEGER     NOT NULL DEFAULT (strftime('%s', 'now')),
+    UNIQUE (task, target),
+    CHECK (state IN ('queued', 'running', 'done', 'failed'))
+);
+
+CREATE INDEX IF NOT EXISTS job_claim_idx ON job (task, state, not_before);
+
+CREATE TABLE IF NOT EXISTS job_run
+(
+    id                  INTEGER     NOT NULL PRIMARY KEY AUTOINCREMENT,
+    script              TEXT        NOT NULL,
+    owner               TEXT        NOT NULL,
+    started             INTEGER     NOT NULL,
+    duration            REAL        NOT NULL,
+    jobs                INTEGER     NOT NULL DEFAULT 0,
+    done                INTEGER     NOT NULL DEFAULT 0,
+    failed              INTEGER     NOT NULL DEFAULT 0,
+    bytes_read          INTEGER     NOT NULL DEFAULT 0,
+    bytes_written       INTEGER     NOT NULL DEFAULT 0,
+    outcome             TEXT        NOT NULL,
+    error               TEXT            NULL,
+    CHECK (outcome IN ('ok', 'error'))
+);
+
+CREATE INDEX IF NOT EXISTS job_run_started_idx ON job_run (started);
+
+CREATE TABLE IF NOT EXISTS job_metric
+(
+    id                  INTEGER     NOT NULL PRIMARY KEY AUTOINCREMENT,
+    run_id              INTEGER     NOT NULL,
+    task                TEXT        NOT NULL,
+    target              TEXT        NOT NULL,
+    attempt             INTEGER     NOT NULL,
+    started             INTEGER     NOT NULL,
+    duration            REAL        NOT NULL,
+    bytes_read          INTEGER     NOT NULL DEFAULT 0,
+    bytes_written       INTEGER     NOT NULL DEFAULT 0,
+    outcome             TEXT        NOT NULL,
+    error               TEXT            NULL,
+    FOREIGN KEY (run_id) REFERENCES job_run (id) ON DELETE CASCADE,
+    CHECK (outcome IN ('done', 'retry', 'failed'))
+);
+
+CREATE INDEX IF NOT EXISTS job_metric_task_idx ON job_metric (task, started);
+CREATE INDEX IF NOT EXISTS job_metric_run_idx ON job_metric (run_id);
+
+-- EOF
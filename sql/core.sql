@@ -4,6 +4,22 @@
 -- 2020-09-10   Add 'upload' table (STILL UNUSED!).
 -- 2020-09-11   Removed type and host_architecture CHECK constraint from 'file'
 -- 2020-09-26   Reduced into 'sql/core.sql'
+-- 2026-10-19   Add 'file.sha256' and 'file.blake2b' checksum columns.
+-- 2026-10-19   Add 'file.integrity' and 'file.verified' (scrubber results).
+--
+-- Existing databases (checksums are calculated by 'calculate-checksum.py'):
+--
+--      ALTER TABLE file ADD COLUMN sha256 TEXT NULL;
+--      ALTER TABLE file ADD COLUMN blake2b TEXT NULL;
+--      ALTER TABLE file ADD COLUMN integrity TEXT NULL
+--          CHECK (integrity IN ('ok', 'mismatch', 'missing'));
+--      ALTER TABLE file ADD COLUMN verified INTEGER NULL;
+--
+-- file.integrity       Result of the latest verification of the file
+--                      against its checksums ('scrub-download-folder.py').
+--                      NULL = not verified yet. 'mismatch' files are not
+--                      served (File.download()).
+-- file.verified        Time of that verification (UNIX timestamp).
 --
 CREATE TABLE teacher
 (
@@ -25,6 +41,10 @@ CREATE TABLE file
     name                TEXT        NOT NULL UNIQUE,
     size                INTEGER     NOT NULL,
     sha1                TEXT            NULL,
+    sha256              TEXT            NULL,
+    blake2b             TEXT            NULL,
+    integrity           TEXT            NULL,
+    verified            INTEGER         NULL,
     type                TEXT        NOT NULL,
     label               TEXT        NOT NULL,
     version             TEXT        NOT NULL DEFAULT (strftime('%Y-%m-%d', 'now')),
@@ -42,6 +62,7 @@ CREATE TABLE file
     FOREIGN KEY (host_architecture) REFERENCES host_architecture (type),
     UNIQUE (label, version, type),
     CHECK (type IN ('usb', 'vm', 'sd')),
+    CHECK (integrity IN ('ok', 'mismatch', 'missing')),
     CHECK (dtap IN ('development', 'testing', 'acceptance', 'production')),
     CHECK (downloadable_to IN ('anyone', 'student', 'teacher', 'nobody'))
 );
@@ -2,6 +2,13 @@
 -- download_statistics.sql - Structures for vm.utu.fi download statistics
 --
 -- 2020-09-26   Adapted from old 'create.sql'
+-- 2026-10-19   Add 'access_log' (read positions of the log ingester).
+-- 2026-10-19   Add 'download_unresolved', bulk attribution by the ingester.
+-- 2026-10-19   Add rollup tables 'download_daily' and 'download_monthly'.
+-- 2026-10-19   Add 'download_archive' (months moved into archive files).
+-- 2026-10-19   Ingester inserts logical downloads (merged range requests).
+-- 2026-10-19   Add 'downloader_daily' and 'downloader_monthly' (sketches).
+-- 2026-10-19   Rollups are updated without UPSERT (SQLite 3.22).
 --
 --
 -- Download statistics (automatic)
@@ -54,6 +61,97 @@
 --      script must store the offending Nginx log row separately for admins to
 --      review and resolve (or delete).
 --
+--      'dlevent' remains for manual and one-off inserts. The processor
+--      script ('cron.job/ingest-access-log.py') attributes events in bulk
+--      instead (cron.job/DownloadIndex.py): 'downloadable' is loaded once
+--      into an interval index, and each batch of events is resolved against
+--      it and INSERTed directly into 'download', which keeps the ingestion
+--      linear in the number of events. Events that cannot be attributed are
+--      stored into 'download_unresolved' for admins to review and resolve
+--      (or delete). No client information is stored, only the event.
+--
+--      A 'download' row inserted by the ingester is one logical download:
+--      the requests of one client for one file instance, no more than
+--      SESSION_WINDOW seconds apart (resumed and segmented downloads), are
+--      merged (cron.job/Sessionizer.py). 'datetime' is the time of the
+--      first request, 'size' is the bytes sent by all requests, and
+--      'complete' is TRUE if the byte ranges of the requests cover the
+--      whole file. Clients are told apart only in the memory of the
+--      ingester, by a salted hash that is never stored.
+--
+-- ----------------------------------------------------------------------------
+--
+-- Rollups
+--
+--      Statistics are served from pre-aggregated tables, never from the
+--      'download' events. For each file instance ('downloadable.file_id')
+--      and UTC day ('YYYY-MM-DD') or month ('YYYY-MM'):
+--
+--          downloads   Number of (logical) downloads.
+--          complete    Downloads that covered the whole file.
+--          partial     Downloads that did not (interrupted, abandoned).
+--          bytes       Bytes sent.
+--
+--      Ingester updates the rollups in the same transaction as it inserts
+--      the 'download' rows (INSERT OR IGNORE of a zero row, then UPDATE;
+--      UPSERT would require SQLite 3.24).
+--      Events inserted through 'dlevent' are not rolled up. If the rollups
+--      are empty (new tables on an existing database), the ingester builds
+--      them from 'download' and the archives (below).
+--
+-- ----------------------------------------------------------------------------
+--
+-- Unique downloaders
+--
+--      The number of distinct downloaders is estimated without storing
+--      anything that identifies them. For each file instance and UTC day or
+--      month, the ingester keeps a HyperLogLog sketch (cron.job/HyperLogLog.py)
+--      of the client hashes of the downloads:
+--
+--          sketch      Serialized sketch (a few dozen bytes to 4 kB).
+--          downloaders Estimate of the sketch (about 1.6 % standard error).
+--
+--      Client hash is a keyed hash of the remote address and user agent.
+--      The key is a secret in the STATE_DIR (root only), so that sketches of
+--      different runs, days and months can be merged (API merges the
+--      sketches of the requested period). Hash is discarded after it has
+--      been added to the sketches, and a register of a sketch keeps only
+--      the highest bit position seen - hashes cannot be recovered from it.
+--      If the key is replaced, the sketches before and after the change
+--      cannot be merged without counting returning downloaders twice.
+--
+--      Sketches cannot be rebuilt from 'download' rows or archives.
+--
+-- ----------------------------------------------------------------------------
+--
+-- Archive
+--
+--      Events of closed months are moved from 'download' into columnar
+--      archive files (one per month, STATE_DIR/download-YYYY-MM.arc) by
+--      'cron.job/archive-downloads.py' (see cron.job/DownloadArchive.py).
+--      Table 'download_archive' records the archived months. The file is
+--      written before the rows are deleted and the month is recorded in the
+--      same transaction as the delete, so a file without a record is left
+--      over from an interrupted run and is rewritten. Rows backfilled into
+--      an archived month are merged into its file and 'events' updated
+--      (archive-downloads.py). Rollups are not affected.
+--
+-- ----------------------------------------------------------------------------
+--
+-- Ingested access logs
+--
+--      Ingester reads each Nginx access log only once, incrementally. Table
+--      'access_log' records how far each log has been read. A log is
+--      identified by the fingerprint of its first line (which survives
+--      logrotate renames and compression) and 'position' is the byte offset
+--      (uncompressed) after the last line that was ingested.
+--
+--      Position is updated in the same transaction as the 'download' rows,
+--      so that a batch is either ingested and recorded, or neither. A
+--      recreated database starts over with the logs that are available.
+--      'seen' is the last time the log was found, rows of logs that have
+--      been rotated away are eventually removed.
+--
 -- ----------------------------------------------------------------------------
 --
 -- Identifying file
@@ -121,6 +219,104 @@ CREATE TABLE download
 );
 
 
+--
+-- Rollups of 'download' (maintained by the ingester)
+--
+CREATE TABLE IF NOT EXISTS download_daily
+(
+    file_id             INTEGER     NOT NULL,
+    day                 TEXT        NOT NULL,
+    downloads           INTEGER     NOT NULL DEFAULT 0,
+    complete            INTEGER     NOT NULL DEFAULT 0,
+    partial             INTEGER     NOT NULL DEFAULT 0,
+    bytes               INTEGER     NOT NULL DEFAULT 0,
+    PRIMARY KEY (file_id, day),
+    FOREIGN KEY (file_id) REFERENCES downloadable (file_id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS download_monthly
+(
+    file_id             INTEGER     NOT NULL,
+    month               TEXT        NOT NULL,
+    downloads           INTEGER     NOT NULL DEFAULT 0,
+    complete            INTEGER     NOT NULL DEFAULT 0,
+    partial             INTEGER     NOT NULL DEFAULT 0,
+    bytes               INTEGER     NOT NULL DEFAULT 0,
+    PRIMARY KEY (file_id, month),
+    FOREIGN KEY (file_id) REFERENCES downloadable (file_id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS download_daily_day
+    ON download_daily (day);
+CREATE INDEX IF NOT EXISTS download_monthly_month
+    ON download_monthly (month);
+
+--
+-- Unique downloader sketches (maintained by the ingester)
+-- (Rowid tables, the sketches are too large for WITHOUT ROWID)
+--
+CREATE TABLE IF NOT EXISTS downloader_daily
+(
+    file_id             INTEGER     NOT NULL,
+    day                 TEXT        NOT NULL,
+    sketch              BLOB        NOT NULL,
+    downloaders         INTEGER     NOT NULL,
+    PRIMARY KEY (file_id, day),
+    FOREIGN KEY (file_id) REFERENCES downloadable (file_id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS downloader_monthly
+(
+    file_id             INTEGER     NOT NULL,
+    month               TEXT        NOT NULL,
+    sketch              BLOB        NOT NULL,
+    downloaders         INTEGER     NOT NULL,
+    PRIMARY KEY (file_id, month),
+    FOREIGN KEY (file_id) REFERENCES downloadable (file_id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS downloader_daily_day
+    ON downloader_daily (day);
+CREATE INDEX IF NOT EXISTS downloader_monthly_month
+    ON downloader_monthly (month);
+
+--
+-- Months archived from 'download'
+--
+CREATE TABLE IF NOT EXISTS download_archive
+(
+    month               TEXT        NOT NULL,
+    filename            TEXT        NOT NULL,
+    events              INTEGER     NOT NULL,
+    filesize            INTEGER     NOT NULL,
+    created             INTEGER     NOT NULL DEFAULT (strftime('%s', 'now')),
+    PRIMARY KEY (month)
+);
+
+--
+-- Download events that could not be attributed to a 'downloadable'
+--
+CREATE TABLE IF NOT EXISTS download_unresolved
+(
+    filename            TEXT        NOT NULL,
+    datetime            TIMESTAMP   NOT NULL,
+    size                INTEGER     NOT NULL
+);
+
+--
+-- Access log read positions
+--
+CREATE TABLE IF NOT EXISTS access_log
+(
+    fingerprint         TEXT        NOT NULL,
+    filepath            TEXT        NOT NULL,
+    inode               INTEGER     NOT NULL,
+    position            INTEGER     NOT NULL DEFAULT 0,
+    seen                INTEGER     NOT NULL DEFAULT (strftime('%s', 'now')),
+    PRIMARY KEY (fingerprint)
+);
+
+
 --
 -- Create 'downloadable' row after 'file' row has been inserted
 --